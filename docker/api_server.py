@@ -9,17 +9,75 @@ desktop actions (click, scroll, type, etc.) through a REST API.
 import os
 import sys
 import json
+import io
 import base64
+import asyncio
 import logging
+import threading
+import functools
+import zlib
+import time
+import socket
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, Any, List, Union
 
 # Set up FastAPI
 from fastapi import FastAPI, HTTPException, Body
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 import uvicorn
 
+# python-xlib is used to inject input in-process; fall back to xdotool if it's missing
+try:
+    from Xlib import X, XK, display as xdisplay
+    from Xlib.ext import xtest
+    from Xlib.error import ConnectionClosedError
+except ImportError:
+    xdisplay = None
+
+# mss grabs the framebuffer over MIT-SHM; fall back to ImageMagick's import if it's missing
+try:
+    import mss
+    import mss.tools
+except ImportError:
+    mss = None
+
+# Pillow encodes JPEG and WebP screenshots; PNG doesn't need it
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# marionette_driver navigates Firefox and waits for page loads; fall back to the address bar if it's missing
+try:
+    from marionette_driver.marionette import Marionette
+    from marionette_driver import errors as marionette_errors
+except ImportError:
+    Marionette = None
+
+# zlib level used to encode PNG screenshots: 1 is fastest, 9 is smallest
+SCREENSHOT_PNG_LEVEL = int(os.environ.get("SCREENSHOT_PNG_LEVEL", "1"))
+
+# Number of threads that run blocking actions and screenshots off the event loop
+ACTION_WORKERS = int(os.environ.get("ACTION_WORKERS", "4"))
+
+# How often settle() samples the framebuffer, in seconds
+SETTLE_INTERVAL = float(os.environ.get("SETTLE_INTERVAL", "0.05"))
+
+# Firefox's own Marionette port inside the container
+MARIONETTE_PORT = int(os.environ.get("MARIONETTE_PORT", "2828"))
+
+# Seconds goto waits for a page by default
+GOTO_TIMEOUT = float(os.environ.get("GOTO_TIMEOUT", "30"))
+
+# VNC port checked by /ready
+VNC_PORT = int(os.environ.get("VNC_PORT", "5900"))
+
+# Written by startup.sh once every service is up
+READY_MARKER = os.environ.get("READY_MARKER", "/tmp/spongecake-ready")
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -65,6 +123,10 @@ class TypeRequest(BaseModel):
 class WaitRequest(BaseModel):
     seconds: float = 2.0
 
+class SettleRequest(BaseModel):
+    quiet_period: float = 0.3
+    timeout: float = 3.0
+
 class ActionRequest(BaseModel):
     type: str
     x: Optional[int] = None
@@ -76,22 +138,336 @@ class ActionRequest(BaseModel):
     text: Optional[str] = None
     seconds: Optional[float] = None
     url: Optional[str] = None
+    quiet_period: Optional[float] = None
+    timeout: Optional[float] = None
+    wait_until: Optional[str] = None  # goto: none, domcontentloaded, load or networkidle
+    delay: Optional[float] = None  # Seconds to wait after this action in a batch
+
+class ActionsRequest(BaseModel):
+    actions: List[ActionRequest]
+    delay: float = 0.0  # Default seconds to wait between actions
+    stop_on_error: bool = True
+
+class StepRequest(BaseModel):
+    action: Optional[ActionRequest] = None
+    settle: bool = True
+    quiet_period: float = 0.3
+    timeout: float = 3.0
+    format: str = "png"
+    level: Optional[int] = None
+    quality: int = 80
 
 # Helper functions to execute desktop actions
-def execute_command(command: List[str]) -> str:
-    """Execute a shell command and return its output."""
+def execute_command(command: List[str], text: bool = True) -> Union[str, bytes]:
+    """Execute a shell command and return its output (as bytes if text is False)."""
     try:
         result = subprocess.run(
             command,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True,
+            text=text,
             check=True
         )
         return result.stdout
     except subprocess.CalledProcessError as e:
-        logger.error(f"Command failed: {e.stderr}")
-        raise HTTPException(status_code=500, detail=f"Command execution failed: {e.stderr}")
+        stderr = e.stderr if text else e.stderr.decode(errors="replace")
+        logger.error(f"Command failed: {stderr}")
+        raise HTTPException(status_code=500, detail=f"Command execution failed: {stderr}")
+
+# In-process input injection (XTest)
+#
+# Keeps one connection to the X server and sends synthetic input through the XTEST
+# extension, instead of forking an xdotool process for every event.
+
+# Modifier names the model uses -> X keysym names
+MODIFIER_KEYS = {
+    "CTRL": "Control_L",
+    "CONTROL": "Control_L",
+    "SHIFT": "Shift_L",
+    "ALT": "Alt_L",
+    "OPTION": "Alt_L",
+    "META": "Super_L",
+    "SUPER": "Super_L",
+    "CMD": "Super_L",
+    "WIN": "Super_L",
+}
+
+# Other key names the model uses -> X keysym names
+KEY_ALIASES = {
+    "ENTER": "Return",
+    "RETURN": "Return",
+    "SPACE": "space",
+    "TAB": "Tab",
+    "ESC": "Escape",
+    "ESCAPE": "Escape",
+    "BACKSPACE": "BackSpace",
+    "DELETE": "Delete",
+    "DEL": "Delete",
+    "INSERT": "Insert",
+    "HOME": "Home",
+    "END": "End",
+    "PAGEUP": "Prior",
+    "PAGEDOWN": "Next",
+    "UP": "Up",
+    "DOWN": "Down",
+    "LEFT": "Left",
+    "RIGHT": "Right",
+    "ARROWUP": "Up",
+    "ARROWDOWN": "Down",
+    "ARROWLEFT": "Left",
+    "ARROWRIGHT": "Right",
+    "CAPSLOCK": "Caps_Lock",
+}
+
+class PartialInputError(RuntimeError):
+    """Input injection failed after some events were sent, so the action must not be replayed."""
+
+class X11Input:
+    """Persistent XTest connection used to inject mouse and keyboard events."""
+
+    def __init__(self, display_name: str):
+        self.display_name = display_name
+        self._display = None
+        self._spare_keycode = None
+        self._sent = False  # Whether the current run() has sent any event
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return xdisplay is not None
+
+    def _connect(self):
+        if self._display is None:
+            self._display = xdisplay.Display(self.display_name)
+            if not self._display.has_extension("XTEST"):
+                self._display.close()
+                self._display = None
+                raise RuntimeError("X server does not support the XTEST extension")
+            self._spare_keycode = self._find_spare_keycode()
+            logger.info(f"Connected to X display {self.display_name} for input injection")
+        return self._display
+
+    def run(self, fn):
+        """
+        Run fn(self) with a live connection, reconnecting once if the connection was closed
+        before any event was sent. Raises PartialInputError if fn fails after sending events,
+        since running it again (or falling back to xdotool) would repeat them.
+        """
+        with self._lock:
+            for attempt in range(2):
+                self._sent = False
+                try:
+                    self._connect()
+                    return fn(self)
+                except Exception as e:
+                    self._reset()
+                    if self._sent:
+                        raise PartialInputError(f"Input injection failed after events were sent: {e}") from e
+                    if attempt == 1 or not isinstance(e, ConnectionClosedError):
+                        raise
+                    # The X server dropped the connection (e.g. it restarted), retry on a fresh one
+                    logger.warning(f"X connection closed ({e}), reconnecting")
+
+    def _reset(self):
+        try:
+            if self._display is not None:
+                self._display.close()
+        except Exception:
+            pass
+        self._display = None
+
+    def _find_spare_keycode(self):
+        """Find a keycode with no keysyms, used to type characters missing from the keymap."""
+        d = self._display
+        first = d.display.info.min_keycode
+        count = d.display.info.max_keycode - first + 1
+        mapping = d.get_keyboard_mapping(first, count)
+        for offset in range(count - 1, -1, -1):
+            if not any(mapping[offset]):
+                return first + offset
+        return None
+
+    def _fake_input(self, event_type: int, detail: int = 0, **kwargs):
+        self._sent = True
+        xtest.fake_input(self._display, event_type, detail, **kwargs)
+
+    # Mouse
+    def move(self, x: int, y: int):
+        self._fake_input(X.MotionNotify, x=x, y=y)
+        self._display.sync()
+
+    def click(self, button: int, repeat: int = 1):
+        for _ in range(repeat):
+            self._fake_input(X.ButtonPress, button)
+            self._fake_input(X.ButtonRelease, button)
+        self._display.sync()
+
+    # Keyboard
+    def _key_event(self, keycode: int, press: bool):
+        self._fake_input(X.KeyPress if press else X.KeyRelease, keycode)
+
+    def _keysym_for_name(self, key: str) -> int:
+        """Resolve a key name from the model (e.g. 'CTRL', 'Enter', 'a', 'F5') to a keysym."""
+        upper = key.upper()
+        if upper in MODIFIER_KEYS:
+            return XK.string_to_keysym(MODIFIER_KEYS[upper])
+        if upper in KEY_ALIASES:
+            return XK.string_to_keysym(KEY_ALIASES[upper])
+        if len(key) == 1:
+            # Letters are pressed lowercase, like xdotool key names
+            return self._keysym_for_char(key.lower())
+        for candidate in (key, key.lower(), key.capitalize()):
+            keysym = XK.string_to_keysym(candidate)
+            if keysym:
+                return keysym
+        raise ValueError(f"Unknown key: {key}")
+
+    def _keysym_for_char(self, char: str) -> int:
+        if char == "\n":
+            return XK.string_to_keysym("Return")
+        if char == "\t":
+            return XK.string_to_keysym("Tab")
+        code = ord(char)
+        # Latin-1 keysyms equal their code point; everything else uses the Unicode keysym range
+        return code if 0x20 <= code <= 0xFF else 0x01000000 | code
+
+    def _keycode_for(self, keysym: int):
+        """Return (keycode, shift level) for a keysym in the keymap, or (None, None)."""
+        return next(((kc, i) for kc, i in self._display.keysym_to_keycodes(keysym) if i < 2), (None, None))
+
+    def _check_typable(self, keysyms: List[int]):
+        """Raise before anything is sent if a keysym can't be typed, so the caller can still fall back."""
+        if self._spare_keycode is not None:
+            return
+        for keysym in keysyms:
+            if self._keycode_for(keysym)[0] is None:
+                raise ValueError(f"No keycode available for keysym {keysym:#x}")
+
+    def _tap_keysym(self, keysym: int):
+        """Press and release a keysym, adding Shift or a temporary keymap entry when needed."""
+        d = self._display
+        keycode, index = self._keycode_for(keysym)
+        remapped = False
+        if keycode is None:
+            if self._spare_keycode is None:
+                raise ValueError(f"No keycode available for keysym {keysym:#x}")
+            keycode, index = self._spare_keycode, 0
+            d.change_keyboard_mapping(keycode, [(keysym, keysym)])
+            d.sync()
+            remapped = True
+        shift = XK.string_to_keysym("Shift_L")
+        if index == 1:
+            self._key_event(d.keysym_to_keycode(shift), True)
+        self._key_event(keycode, True)
+        self._key_event(keycode, False)
+        if index == 1:
+            self._key_event(d.keysym_to_keycode(shift), False)
+        d.sync()
+        if remapped:
+            d.change_keyboard_mapping(keycode, [(X.NoSymbol, X.NoSymbol)])
+            d.sync()
+
+    def keypress(self, keys: List[str]):
+        """
+        Press keys as a chord: modifiers are held down in order, the remaining keys are
+        tapped in sequence, then the modifiers are released in reverse order.
+        """
+        d = self._display
+        # Resolve every key before pressing any, so an unknown key fails without sending input
+        keysyms = [self._keysym_for_name(k) for k in keys]
+        self._check_typable([keysym for k, keysym in zip(keys, keysyms) if k.upper() not in MODIFIER_KEYS])
+        held = []
+        try:
+            for k, keysym in zip(keys, keysyms):
+                if k.upper() in MODIFIER_KEYS:
+                    keycode = d.keysym_to_keycode(keysym)
+                    self._key_event(keycode, True)
+                    held.append(keycode)
+                else:
+                    self._tap_keysym(keysym)
+        finally:
+            for keycode in reversed(held):
+                self._key_event(keycode, False)
+            d.sync()
+
+    def type_text(self, text: str):
+        keysyms = [self._keysym_for_char(char) for char in text]
+        self._check_typable(keysyms)
+        for keysym in keysyms:
+            self._tap_keysym(keysym)
+
+x11_input = X11Input(os.environ.get("DISPLAY", ":99"))
+
+def inject(fn) -> bool:
+    """
+    Inject input in-process. Returns False if the xdotool fallback should be used, which
+    is only the case when nothing was sent yet; a failure after events went out is raised.
+    """
+    if not x11_input.available:
+        return False
+    try:
+        x11_input.run(fn)
+        return True
+    except PartialInputError as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        logger.warning(f"In-process input injection unavailable, falling back to xdotool: {e}")
+        return False
+
+# In-process screen capture
+#
+# Grabs the root window straight from the X server (XShmGetImage via mss) and encodes
+# it in-process, instead of running ImageMagick's import and base64 in a shell.
+
+class ScreenCapture:
+    """Persistent mss connection used to grab the framebuffer."""
+
+    def __init__(self, display_name: str):
+        self.display_name = display_name
+        self._sct = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return mss is not None
+
+    def grab(self):
+        """Return an mss ScreenShot of the whole screen, reconnecting once if the grab fails."""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sct is None:
+                        self._sct = mss.MSS(display=self.display_name, with_cursor=False)
+                    return self._sct.grab(self._sct.monitors[0])
+                except Exception as e:
+                    self.close()
+                    if attempt == 1:
+                        raise
+                    logger.warning(f"Screen grab failed ({e}), reconnecting")
+
+    def close(self):
+        try:
+            if self._sct is not None:
+                self._sct.close()
+        except Exception:
+            pass
+        self._sct = None
+
+    def png(self, level: Optional[int] = None) -> bytes:
+        """Grab the screen and encode it as PNG bytes."""
+        shot = self.grab()
+        return mss.tools.to_png(shot.rgb, shot.size, level=SCREENSHOT_PNG_LEVEL if level is None else level)
+
+    def encode(self, image_format: str, quality: int = 80) -> bytes:
+        """Grab the screen and encode it as JPEG or WebP bytes with Pillow."""
+        shot = self.grab()
+        image = Image.frombytes("RGB", shot.size, shot.rgb)
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, quality=quality)
+        return buffer.getvalue()
+
+screen_capture = ScreenCapture(os.environ.get("DISPLAY", ":99"))
 
 def click(x: int, y: int, button: str = "left") -> Dict[str, Any]:
     """Execute a click at the specified coordinates.
@@ -111,8 +487,9 @@ def click(x: int, y: int, button: str = "left") -> Dict[str, Any]:
     button_num = button_map.get(button.lower(), 1)
     
     logger.info(f"Action: click at ({x}, {y}) with button '{button}' -> mapped to {button_num}")
-    command = ["xdotool", "mousemove", str(x), str(y), "click", str(button_num)]
-    execute_command(command)
+    if not inject(lambda inp: (inp.move(x, y), inp.click(button_num))):
+        command = ["xdotool", "mousemove", str(x), str(y), "click", str(button_num)]
+        execute_command(command)
     
     return {"status": "success", "action": "click", "x": x, "y": y, "button": button}
 
@@ -124,6 +501,23 @@ def scroll(x: int, y: int, scroll_x: int = 0, scroll_y: int = 0) -> Dict[str, An
     Negative scroll_x -> scroll left, positive -> scroll right (button 6 or 7).
     """
     logger.info(f"Scrolling at ({x}, {y}) with delta (scroll_x={scroll_x}, scroll_y={scroll_y})")
+
+    def scroll_in_process(inp):
+        inp.move(x, y)
+        if scroll_y != 0:
+            inp.click(4 if scroll_y < 0 else 5, repeat=3)
+        if scroll_x != 0:
+            inp.click(6 if scroll_x < 0 else 7, repeat=3)
+
+    if inject(scroll_in_process):
+        return {
+            "status": "success", 
+            "action": "scroll", 
+            "x": x, 
+            "y": y, 
+            "scroll_x": scroll_x, 
+            "scroll_y": scroll_y
+        }
     
     # First move to the position
     execute_command(["xdotool", "mousemove", str(x), str(y)])
@@ -159,6 +553,9 @@ def keypress(keys: List[str]) -> Dict[str, Any]:
     Example: keys=["CTRL","F"] -> Ctrl+F
     """
     logger.info(f"Pressing keys: {keys}")
+
+    if inject(lambda inp: inp.keypress(keys)):
+        return {"status": "success", "action": "keypress", "keys": keys}
     
     ctrl_pressed = False
     shift_pressed = False
@@ -196,41 +593,217 @@ def keypress(keys: List[str]) -> Dict[str, Any]:
 def type_text(text: str) -> Dict[str, Any]:
     """Type text."""
     logger.info(f"Typing text: {text}")
-    
-    # Use --clearmodifiers to clear any stuck modifier keys
-    execute_command(["xdotool", "type", "--clearmodifiers", text])
+
+    if not inject(lambda inp: inp.type_text(text)):
+        # Use --clearmodifiers to clear any stuck modifier keys
+        execute_command(["xdotool", "type", "--clearmodifiers", text])
     
     return {"status": "success", "action": "type", "text": text}
 
-def wait(seconds: float = 2.0) -> Dict[str, Any]:
-    """Wait for the specified number of seconds."""
+async def wait(seconds: float = 2.0) -> Dict[str, Any]:
+    """Wait for the specified number of seconds without blocking the event loop."""
     logger.info(f"Waiting for {seconds} seconds")
     
-    import time
-    time.sleep(seconds)
+    await asyncio.sleep(seconds)
     
     return {"status": "success", "action": "wait", "seconds": seconds}
 
-def goto(url: str) -> Dict[str, Any]:
-    """Open Firefox and navigate to the specified URL.
+def frame_signature() -> int:
+    """Return a checksum of the current framebuffer, used to detect screen changes."""
+    if screen_capture.available:
+        try:
+            return zlib.crc32(screen_capture.grab().raw)
+        except Exception as e:
+            logger.warning(f"In-process screen grab failed, falling back to import: {e}")
+    return zlib.crc32(execute_command(["bash", "-c", "export DISPLAY=:99 && import -window root -depth 8 rgb:-"], text=False))
+
+async def settle(quiet_period: float = 0.3, timeout: float = 3.0) -> Dict[str, Any]:
+    """Wait until the screen has stopped changing.
+
+    Samples the framebuffer every SETTLE_INTERVAL seconds and returns once it has
+    been unchanged for quiet_period seconds, or after timeout seconds at most.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    signature = await run_blocking(frame_signature)
+    last_change = loop.time()
+    changes = 0
+
+    while True:
+        now = loop.time()
+        if now - last_change >= quiet_period:
+            settled = True
+            break
+        if now - start >= timeout:
+            settled = False
+            break
+        await asyncio.sleep(SETTLE_INTERVAL)
+        current = await run_blocking(frame_signature)
+        if current != signature:
+            signature = current
+            last_change = loop.time()
+            changes += 1
+
+    elapsed = round(loop.time() - start, 3)
+    logger.info(f"Screen {'settled' if settled else 'still changing'} after {elapsed}s ({changes} changes)")
+    return {"status": "success", "action": "settle", "settled": settled, "elapsed": elapsed, "changes": changes}
+
+# Navigation
+#
+# Navigates the current tab through Marionette and waits for the page to load, instead of
+# starting a firefox-esr process that opens a new tab and returns before anything loaded.
+# Firefox allows a single Marionette session and the SDK usually holds it, so the server
+# only opens one for the duration of a navigation. When it can't, the URL is typed into
+# the address bar and the screen is left to settle.
+
+# Page states goto can wait for, from earliest to latest
+WAIT_UNTIL = ("none", "domcontentloaded", "load", "networkidle")
+
+# networkidle: no new resource may finish loading for this many seconds
+NETWORK_IDLE_TIME = 0.5
+
+# Reports the state of the current document. timeOrigin is unique per document, so it
+# tells the old page apart from the new one while a navigation is in flight.
+# This script, WAIT_UNTIL, NETWORK_IDLE_TIME and the wait loop in marionette_navigate are
+# copies of the ones in spongecake-sdk/spongecake/marionette.py (this image can't import
+# the SDK) - keep them in sync.
+PAGE_STATE_SCRIPT = """
+const nav = performance.getEntriesByType("navigation")[0];
+return {
+    url: document.location.href,
+    origin: performance.timeOrigin,
+    readyState: document.readyState,
+    resources: performance.getEntriesByType("resource").length,
+    timing: nav ? {
+        dom_content_loaded: Math.round(nav.domContentLoadedEventEnd),
+        load: Math.round(nav.loadEventEnd),
+        response_end: Math.round(nav.responseEnd),
+    } : null,
+};
+"""
+
+def marionette_navigate(url: str, wait_until: str, timeout: float) -> Dict[str, Any]:
+    """Navigate the current tab over a short-lived Marionette session and wait for wait_until."""
+    client = Marionette("127.0.0.1", port=MARIONETTE_PORT)
+    try:
+        client.start_session(timeout=2)
+    except TimeoutError:
+        raise ConnectionRefusedError(f"Marionette is not listening on port {MARIONETTE_PORT}")
+    try:
+        start = time.monotonic()
+        deadline = start + timeout
+        before = client.execute_script(PAGE_STATE_SCRIPT)
+        client.execute_script("window.location.assign(arguments[0]);", script_args=[url])
+
+        # A fragment change on the same page doesn't load a new document
+        same_document = before["url"].split("#")[0] == url.split("#")[0] and "#" in url
+        ready_states = ("interactive", "complete") if wait_until == "domcontentloaded" else ("complete",)
+        state, loaded = {}, wait_until == "none"
+        resources, idle_since = None, None
+        while not loaded:
+            try:
+                current = client.execute_script(PAGE_STATE_SCRIPT)
+            except marionette_errors.MarionetteException:
+                # The old document was torn down mid-call; try again on the new one
+                current = None
+
+            now = time.monotonic()
+            if current is not None and (same_document or current["origin"] != before["origin"]) and current["readyState"] in ready_states:
+                state = current
+                if wait_until != "networkidle":
+                    loaded = True
+                elif current["resources"] != resources:
+                    resources, idle_since = current["resources"], now
+                elif now - idle_since >= NETWORK_IDLE_TIME:
+                    loaded = True
+            if loaded or now >= deadline:
+                state = state or current or {}
+                break
+            time.sleep(SETTLE_INTERVAL)
+
+        return {
+            "status": "success",
+            "action": "goto",
+            "url": state.get("url") or url,
+            "requested_url": url,
+            "wait_until": wait_until,
+            "loaded": loaded,
+            "elapsed": round(time.monotonic() - start, 3),
+            "timing": state.get("timing"),
+        }
+    finally:
+        try:
+            client.delete_session()
+        except Exception:
+            pass
+
+async def goto(url: str, wait_until: str = "load", timeout: float = GOTO_TIMEOUT) -> Dict[str, Any]:
+    """Navigate the current Firefox tab to the specified URL and wait for it to load.
     
     Args:
         url: The URL to navigate to (e.g., "https://example.com")
+        wait_until: none, domcontentloaded, load or networkidle
+        timeout: Maximum seconds to wait for the page
     """
-    logger.info(f"Navigating to URL: {url}")
-    
-    # Use firefox-esr with new-tab option and run in background
-    execute_command(["bash", "-c", f"export DISPLAY=:99 && firefox-esr -new-tab {url} &"])
-    
-    return {"status": "success", "action": "goto", "url": url}
+    logger.info(f"Navigating to URL: {url} (wait until {wait_until})")
+    if wait_until not in WAIT_UNTIL:
+        raise HTTPException(status_code=400, detail=f"wait_until must be one of {', '.join(WAIT_UNTIL)}")
+
+    if Marionette is not None:
+        try:
+            result = await run_blocking(marionette_navigate, url, wait_until, timeout)
+            if not result["loaded"]:
+                logger.warning(f"Page did not reach '{wait_until}' within {timeout}s: {url}")
+            return result
+        except ConnectionRefusedError:
+            # Firefox isn't running, so start it on the URL
+            logger.warning("Marionette is not listening, starting Firefox")
+            execute_command(["bash", "-c", f"export DISPLAY=:99 && firefox-esr -new-tab {url} &"])
+            return await wait_for_screen(url, wait_until, timeout)
+        except Exception as e:
+            logger.warning(f"Marionette navigation unavailable, using the address bar: {e}")
 
-def take_screenshot() -> Dict[str, Any]:
+    # Type the URL into the current tab's address bar
+    await run_blocking(keypress, ["CTRL", "l"])
+    await run_blocking(type_text, url)
+    await run_blocking(keypress, ["Return"])
+    return await wait_for_screen(url, wait_until, timeout)
+
+async def wait_for_screen(url: str, wait_until: str, timeout: float) -> Dict[str, Any]:
+    """Without Marionette the page can't be observed, so wait for the screen to settle instead."""
+    result = {"settled": True, "elapsed": 0.0}
+    if wait_until != "none":
+        result = await settle(quiet_period=0.5, timeout=timeout)
+    return {
+        "status": "success",
+        "action": "goto",
+        "url": url,
+        "requested_url": url,
+        "wait_until": wait_until,
+        "loaded": result["settled"],
+        "elapsed": result["elapsed"],
+        "timing": None,
+    }
+
+def take_screenshot(level: Optional[int] = None) -> Dict[str, Any]:
     """Take a screenshot and return it as base64.
     
     Takes a screenshot of the current desktop.
     Returns the base64-encoded PNG screenshot as a string.
+    level optionally overrides the PNG compression level (0-9).
     """
     logger.info("Taking screenshot")
+
+    if screen_capture.available:
+        try:
+            png_data = screen_capture.png(level)
+            return {
+                "status": "success",
+                "action": "screenshot",
+                "screenshot": base64.b64encode(png_data).decode("ascii")
+            }
+        except Exception as e:
+            logger.warning(f"In-process screenshot failed, falling back to import: {e}")
     
     try:
         # Use ImageMagick's import command to capture the screen
@@ -257,6 +830,207 @@ def take_screenshot() -> Dict[str, Any]:
             "error": str(e)
         }
 
+# Binary screenshot formats: URL suffix -> (Pillow format, media type)
+SCREENSHOT_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpg": ("JPEG", "image/jpeg"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+def screenshot_bytes(fmt: str = "png", level: Optional[int] = None, quality: int = 80) -> bytes:
+    """Take a screenshot and return the raw encoded image bytes.
+
+    fmt is one of png, jpg/jpeg or webp. level sets the PNG compression level,
+    quality the JPEG/WebP quality.
+    """
+    logger.info(f"Taking {fmt} screenshot")
+    image_format, _ = SCREENSHOT_FORMATS[fmt]
+
+    if screen_capture.available and (image_format == "PNG" or Image is not None):
+        try:
+            if image_format == "PNG":
+                return screen_capture.png(level)
+            return screen_capture.encode(image_format, quality)
+        except Exception as e:
+            logger.warning(f"In-process screenshot failed, falling back to import: {e}")
+
+    # ImageMagick writes the requested format to stdout
+    magick_format = "jpeg" if image_format == "JPEG" else fmt
+    return execute_command(
+        ["bash", "-c", f"export DISPLAY=:99 && import -window root -quality {quality} {magick_format}:-"],
+        text=False
+    )
+
+# Readiness
+#
+# Reports each subsystem started by startup.sh separately, so clients can wait for exactly
+# what they need instead of sleeping for a fixed time after the container starts. The
+# checks run live on every request; startup.sh's ready marker records how long boot took.
+
+def port_listening(port: int) -> bool:
+    """Return True if something accepts TCP connections on the local port."""
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+def x_readiness() -> Dict[str, bool]:
+    """Check the X display, whether a window manager is running and whether Firefox has a window."""
+    checks = {"display": False, "window_manager": False, "browser_window": False}
+    display_name = os.environ.get("DISPLAY", ":99")
+
+    if xdisplay is None:
+        # Without python-xlib, look for the X socket and ask xprop/xdotool
+        checks["display"] = os.path.exists(f"/tmp/.X11-unix/X{display_name.lstrip(':').split('.')[0]}")
+        if checks["display"]:
+            for name, command in (
+                ("window_manager", f"export DISPLAY={display_name} && xprop -root _NET_SUPPORTING_WM_CHECK | grep -q 'window id'"),
+                ("browser_window", f"export DISPLAY={display_name} && xdotool search --class firefox"),
+            ):
+                checks[name] = subprocess.run(["bash", "-c", command], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+        return checks
+
+    try:
+        d = xdisplay.Display(display_name)
+    except Exception:
+        return checks
+    try:
+        checks["display"] = True
+        root = d.screen().root
+        # EWMH window managers (xfwm4) advertise themselves on the root window
+        wm_check = root.get_full_property(d.intern_atom("_NET_SUPPORTING_WM_CHECK"), X.AnyPropertyType)
+        checks["window_manager"] = bool(wm_check and len(wm_check.value))
+        client_list = root.get_full_property(d.intern_atom("_NET_CLIENT_LIST"), X.AnyPropertyType)
+        for window_id in (client_list.value if client_list else []):
+            wm_class = d.create_resource_object("window", window_id).get_wm_class() or ()
+            if any("firefox" in name.lower() for name in wm_class):
+                checks["browser_window"] = True
+                break
+    except Exception as e:
+        logger.warning(f"Readiness check on {display_name} failed: {e}")
+    finally:
+        d.close()
+    return checks
+
+def readiness() -> Dict[str, bool]:
+    """Check every subsystem the desktop needs."""
+    checks = x_readiness()
+    checks["vnc"] = port_listening(VNC_PORT)
+    checks["api"] = True  # We're answering
+    checks["marionette"] = port_listening(MARIONETTE_PORT)
+    return checks
+
+def boot_status() -> Optional[Dict[str, Any]]:
+    """Return the ready marker written by startup.sh (boot time in ms), or None if boot hasn't finished."""
+    try:
+        with open(READY_MARKER, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Request scheduling
+#
+# Actions and screenshots block (X round trips, subprocesses, PNG encoding), so they run
+# on a bounded thread pool and the event loop stays free for /health and other readers.
+# Input actions additionally go through a single lock, so they reach the desktop in the
+# order they were received and never interleave. Screenshots don't take the lock.
+
+action_executor = ThreadPoolExecutor(max_workers=ACTION_WORKERS, thread_name_prefix="action")
+action_lock = asyncio.Lock()
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking function on the worker pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(action_executor, functools.partial(fn, *args, **kwargs))
+
+async def run_action(fn, *args, **kwargs):
+    """Run an input action in order with the other input actions."""
+    async with action_lock:
+        if asyncio.iscoroutinefunction(fn):
+            return await fn(*args, **kwargs)
+        return await run_blocking(fn, *args, **kwargs)
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    action_executor.shutdown(wait=False)
+
+async def perform_action(action: ActionRequest) -> Dict[str, Any]:
+    """Validate an action request and run it."""
+    action_type = action.type
+    
+    if action_type == "click":
+        if action.x is None or action.y is None:
+            raise HTTPException(status_code=400, detail="Click action requires x and y coordinates")
+        return await run_action(click, action.x, action.y, action.button or "left")
+    
+    elif action_type == "scroll":
+        if action.x is None or action.y is None:
+            raise HTTPException(status_code=400, detail="Scroll action requires x and y coordinates")
+        return await run_action(scroll, action.x, action.y, action.scroll_x or 0, action.scroll_y or 0)
+    
+    elif action_type == "keypress":
+        if not action.keys:
+            raise HTTPException(status_code=400, detail="Keypress action requires keys")
+        return await run_action(keypress, action.keys)
+    
+    elif action_type == "type":
+        if action.text is None:
+            raise HTTPException(status_code=400, detail="Type action requires text")
+        return await run_action(type_text, action.text)
+    
+    elif action_type == "wait":
+        return await run_action(wait, action.seconds or 2.0)
+    
+    elif action_type == "settle":
+        return await settle(
+            0.3 if action.quiet_period is None else action.quiet_period,
+            3.0 if action.timeout is None else action.timeout
+        )
+    
+    elif action_type == "screenshot":
+        return await run_blocking(take_screenshot)
+        
+    elif action_type == "goto":
+        if action.url is None:
+            raise HTTPException(status_code=400, detail="Goto action requires a URL")
+        return await run_action(goto, action.url, action.wait_until or "load", action.timeout or GOTO_TIMEOUT)
+    
+    else:
+        raise HTTPException(status_code=400, detail=f"Unknown action type: {action_type}")
+
+async def perform_actions(actions: List[ActionRequest], delay: float = 0.0, stop_on_error: bool = True) -> Dict[str, Any]:
+    """Run a batch of actions in order and collect their results."""
+    results = []
+    errors = 0
+    for index, action in enumerate(actions):
+        try:
+            result = {"index": index, **await perform_action(action)}
+        except Exception as e:
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            result = {"index": index, "status": "error", "action": action.type, "error": error}
+        results.append(result)
+
+        if result.get("status") == "error":
+            logger.error(f"Batch action {index} ({action.type}) failed: {result.get('error')}")
+            errors += 1
+            if stop_on_error:
+                break
+            continue
+
+        action_delay = delay if action.delay is None else action.delay
+        if action_delay > 0 and index < len(actions) - 1:
+            await asyncio.sleep(action_delay)
+
+    return {
+        "status": "error" if errors else "success",
+        "action": "actions",
+        "completed": len(results) - errors,
+        "total": len(actions),
+        "results": results
+    }
+
 # API endpoints
 @app.get("/")
 async def root():
@@ -272,74 +1046,95 @@ async def health_check():
     """Health check endpoint."""
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def ready_check():
+    """Readiness endpoint: 200 once every subsystem is up, 503 until then."""
+    checks = await run_blocking(readiness)
+    ready = all(checks.values())
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "checks": checks, "boot": boot_status()})
+
 @app.post("/click")
 async def api_click(request: ClickRequest):
     """Click at the specified coordinates."""
-    return click(request.x, request.y, request.button)
+    return await run_action(click, request.x, request.y, request.button)
 
 @app.post("/scroll")
 async def api_scroll(request: ScrollRequest):
     """Scroll at the specified coordinates."""
-    return scroll(request.x, request.y, request.scroll_x, request.scroll_y)
+    return await run_action(scroll, request.x, request.y, request.scroll_x, request.scroll_y)
 
 @app.post("/keypress")
 async def api_keypress(request: KeypressRequest):
     """Execute keypress(es)."""
-    return keypress(request.keys)
+    return await run_action(keypress, request.keys)
 
 @app.post("/type")
 async def api_type(request: TypeRequest):
     """Type text."""
-    return type_text(request.text)
+    return await run_action(type_text, request.text)
 
 @app.post("/wait")
 async def api_wait(request: WaitRequest):
     """Wait for the specified number of seconds."""
-    return wait(request.seconds)
+    return await run_action(wait, request.seconds)
+
+@app.post("/settle")
+async def api_settle(request: SettleRequest):
+    """Wait until the screen has been stable for the quiet period (or the timeout)."""
+    return await settle(request.quiet_period, request.timeout)
 
 @app.get("/screenshot")
-async def api_screenshot():
+async def api_screenshot(level: Optional[int] = None):
     """Take a screenshot and return it as base64."""
-    return take_screenshot()
+    return await run_blocking(take_screenshot, level)
+
+@app.get("/screenshot.{fmt}")
+async def api_screenshot_binary(fmt: str, level: Optional[int] = None, quality: int = 80):
+    """Take a screenshot and return the raw image bytes (png, jpg or webp)."""
+    fmt = fmt.lower()
+    if fmt not in SCREENSHOT_FORMATS:
+        raise HTTPException(status_code=404, detail=f"Unsupported screenshot format: {fmt}")
+    content = await run_blocking(screenshot_bytes, fmt, level, quality)
+    return Response(content=content, media_type=SCREENSHOT_FORMATS[fmt][1])
 
 @app.post("/action")
 async def api_action(action: ActionRequest):
     """Execute an action based on its type."""
-    action_type = action.type
-    
-    if action_type == "click":
-        if action.x is None or action.y is None:
-            raise HTTPException(status_code=400, detail="Click action requires x and y coordinates")
-        return click(action.x, action.y, action.button or "left")
-    
-    elif action_type == "scroll":
-        if action.x is None or action.y is None:
-            raise HTTPException(status_code=400, detail="Scroll action requires x and y coordinates")
-        return scroll(action.x, action.y, action.scroll_x or 0, action.scroll_y or 0)
-    
-    elif action_type == "keypress":
-        if not action.keys:
-            raise HTTPException(status_code=400, detail="Keypress action requires keys")
-        return keypress(action.keys)
-    
-    elif action_type == "type":
-        if action.text is None:
-            raise HTTPException(status_code=400, detail="Type action requires text")
-        return type_text(action.text)
-    
-    elif action_type == "wait":
-        return wait(action.seconds or 2.0)
-    
-    elif action_type == "screenshot":
-        return take_screenshot()
-        
-    elif action_type == "goto":
-        if action.url is None:
-            raise HTTPException(status_code=400, detail="Goto action requires a URL")
-        return goto(action.url)
-    
-    else:
-        raise HTTPException(status_code=400, detail=f"Unknown action type: {action_type}")
+    return await perform_action(action)
+
+@app.post("/actions")
+async def api_actions(request: ActionsRequest):
+    """Execute an ordered list of actions in one request.
+
+    Waits `delay` seconds between actions (or each action's own delay). With
+    stop_on_error the batch stops at the first failing action; otherwise the
+    failure is recorded and the remaining actions still run.
+    """
+    return await perform_actions(request.actions, request.delay, request.stop_on_error)
+
+@app.post("/step")
+async def api_step(request: StepRequest):
+    """Run an action, wait for the screen to settle, and return the screenshot that follows.
+
+    Saves the separate screenshot round trip after every action. The image is the
+    response body; the action type and settle outcome are sent in the X-Action,
+    X-Settled and X-Settle-Elapsed headers.
+    """
+    fmt = request.format.lower()
+    if fmt not in SCREENSHOT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported screenshot format: {fmt}")
+
+    headers = {}
+    if request.action is not None:
+        await perform_action(request.action)
+        headers["X-Action"] = request.action.type
+    if request.settle:
+        result = await settle(request.quiet_period, request.timeout)
+        headers["X-Settled"] = str(result["settled"]).lower()
+        headers["X-Settle-Elapsed"] = str(result["elapsed"])
+
+    content = await run_blocking(screenshot_bytes, fmt, request.level, request.quality)
+    return Response(content=content, media_type=SCREENSHOT_FORMATS[fmt][1], headers=headers)
 
 if __name__ == "__main__":
     # Run the server
@@ -0,0 +1,71 @@
+// Preferences for the Firefox profile baked into the spongecake image.
+// They skip first-run pages and background work that would otherwise slow down
+// the first page load after every container start.
+
+// Marionette (forwarded to the host by socat in startup.sh)
+user_pref("marionette.port", 2828);
+user_pref("marionette.host", "127.0.0.1");
+user_pref("marionette.accept_remote_connections", true);
+
+// First-run and welcome pages
+user_pref("browser.startup.homepage_override.mstone", "ignore");
+user_pref("startup.homepage_welcome_url", "");
+user_pref("startup.homepage_welcome_url.additional", "");
+user_pref("startup.homepage_override_url", "");
+user_pref("browser.aboutwelcome.enabled", false);
+user_pref("browser.startup.firstrunSkipsHomepage", true);
+user_pref("trailhead.firstrun.didSeeAboutWelcome", true);
+user_pref("browser.disableResetPrompt", true);
+user_pref("browser.uitour.enabled", false);
+user_pref("browser.rights.3.shown", true);
+user_pref("toolkit.startup.max_resumed_crashes", -1);
+user_pref("browser.sessionstore.resume_from_crash", false);
+user_pref("browser.tabs.warnOnClose", false);
+user_pref("browser.warnOnQuit", false);
+
+// Default browser check
+user_pref("browser.shell.checkDefaultBrowser", false);
+user_pref("browser.shell.skipDefaultBrowserCheckOnFirstRun", true);
+
+// Telemetry and data reporting
+user_pref("datareporting.policy.dataSubmissionEnabled", false);
+user_pref("datareporting.policy.dataSubmissionPolicyBypassNotification", true);
+user_pref("datareporting.healthreport.uploadEnabled", false);
+user_pref("toolkit.telemetry.enabled", false);
+user_pref("toolkit.telemetry.unified", false);
+user_pref("toolkit.telemetry.archive.enabled", false);
+user_pref("toolkit.telemetry.server", "");
+user_pref("toolkit.coverage.opt-out", true);
+user_pref("app.shield.optoutstudies.enabled", false);
+user_pref("app.normandy.enabled", false);
+user_pref("browser.crashReports.unsubmittedCheck.enabled", false);
+user_pref("browser.ping-centre.telemetry", false);
+
+// Updates
+user_pref("app.update.auto", false);
+user_pref("app.update.enabled", false);
+user_pref("app.update.checkInstallTime", false);
+user_pref("app.update.disabledForTesting", true);
+user_pref("extensions.update.enabled", false);
+user_pref("extensions.update.autoUpdateDefault", false);
+user_pref("extensions.getAddons.cache.enabled", false);
+user_pref("browser.search.update", false);
+
+// Background network requests at startup
+user_pref("network.captive-portal-service.enabled", false);
+user_pref("network.connectivity-service.enabled", false);
+user_pref("browser.safebrowsing.malware.enabled", false);
+user_pref("browser.safebrowsing.phishing.enabled", false);
+user_pref("browser.safebrowsing.downloads.enabled", false);
+user_pref("browser.safebrowsing.provider.mozilla.updateURL", "");
+user_pref("browser.newtabpage.activity-stream.feeds.telemetry", false);
+user_pref("browser.newtabpage.activity-stream.feeds.snippets", false);
+user_pref("browser.newtabpage.activity-stream.feeds.section.topstories", false);
+user_pref("browser.newtabpage.activity-stream.showSponsored", false);
+user_pref("browser.newtabpage.activity-stream.showSponsoredTopSites", false);
+user_pref("browser.discovery.enabled", false);
+user_pref("extensions.pocket.enabled", false);
+
+// The profile may live on a small tmpfs (/dev/shm), so keep the disk cache bounded
+user_pref("browser.cache.disk.capacity", 32768);
+user_pref("browser.cache.disk.smart_size.enabled", false);
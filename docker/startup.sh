@@ -1,43 +1,107 @@
 #!/usr/bin/env bash
 
-# 1) Clean up any stale X lock files and sockets.
+# Boot the desktop. Each service starts as soon as what it depends on is actually ready
+# (the X socket, the window manager, listening ports) instead of after fixed sleeps, and
+# services that don't depend on each other start in parallel. Once everything is up, a
+# ready marker is written for the API server to report on /ready.
+
+BOOT_START=$(date +%s%N)
+READY_MARKER=${READY_MARKER:-/tmp/spongecake-ready}
+
+# wait_for <what> <timeout seconds> <command...>: poll until the command succeeds
+wait_for() {
+  local what=$1 timeout=$2
+  shift 2
+  local deadline=$((SECONDS + timeout))
+  until "$@" >/dev/null 2>&1; do
+    if (( SECONDS >= deadline )); then
+      echo "startup: timed out after ${timeout}s waiting for ${what}" >&2
+      return 1
+    fi
+    sleep 0.05
+  done
+}
+
+port_listening() { (exec 3<>"/dev/tcp/127.0.0.1/$1") 2>/dev/null; }
+wm_running() { xprop -root _NET_SUPPORTING_WM_CHECK | grep -q "window id"; }
+browser_window() { xdotool search --class firefox; }
+
+# 1) Clean up any stale X lock files, sockets and ready marker.
 rm -f /tmp/.X*-lock
 rm -f /tmp/.X11-unix/X*
+rm -f "$READY_MARKER"
+
+# Restore the Firefox profile baked into the image while X starts. tmpfs (the default)
+# keeps profile writes and the disk cache in memory; disk keeps them in the home directory.
+# Docker's default /dev/shm is only 64MB and Firefox needs it for shared memory too, so
+# tmpfs is only used when the container was given a bigger one (the SDK asks for 512MB).
+FIREFOX_PROFILE_MODE=${FIREFOX_PROFILE_MODE:-tmpfs}
+FIREFOX_MIN_SHM_KB=${FIREFOX_MIN_SHM_KB:-262144}
+FIREFOX_BAKED_PROFILE=${FIREFOX_BAKED_PROFILE:-/opt/spongecake/firefox-profile}
+FIREFOX_PROFILE=/home/myuser/.mozilla/firefox/spongecake
+restore_profile() {
+  mkdir -p "$(dirname "$FIREFOX_PROFILE")"
+  if [ "$FIREFOX_PROFILE_MODE" != "disk" ]; then
+    shm_kb=$(df -Pk /dev/shm 2>/dev/null | awk 'NR==2 {print $2}')
+    if [ "${shm_kb:-0}" -lt "$FIREFOX_MIN_SHM_KB" ]; then
+      echo "startup: /dev/shm is only ${shm_kb:-0}KB, keeping the Firefox profile on disk (run with --shm-size=512m)" >&2
+      FIREFOX_PROFILE_MODE=disk
+    fi
+  fi
+  if [ "$FIREFOX_PROFILE_MODE" = "disk" ]; then
+    [ -L "$FIREFOX_PROFILE" ] && rm -f "$FIREFOX_PROFILE"
+    [ -d "$FIREFOX_PROFILE" ] || cp -a "$FIREFOX_BAKED_PROFILE" "$FIREFOX_PROFILE"
+    return
+  fi
+  if [ "$FIREFOX_PROFILE_MODE" != "tmpfs" ]; then
+    echo "startup: unknown FIREFOX_PROFILE_MODE '${FIREFOX_PROFILE_MODE}', using tmpfs" >&2
+  fi
+  rm -rf /dev/shm/firefox-profile "$FIREFOX_PROFILE"
+  cp -a "$FIREFOX_BAKED_PROFILE" /dev/shm/firefox-profile
+  ln -s /dev/shm/firefox-profile "$FIREFOX_PROFILE"
+}
+restore_profile &
+PROFILE_PID=$!
 
 # 2) Start a virtual X server on display :99 with extra flags (-ac, -nolisten tcp).
 Xvfb :99 -screen 0 1280x720x24 -ac -nolisten tcp &
 export DISPLAY=:99
+wait_for "the X display" 30 test -S /tmp/.X11-unix/X99
 
-# Give Xvfb a moment to come up.
-sleep 3
-
-# 3) Start Xfce4 session
+# 3) Everything below only needs X, so start it all at once.
 startxfce4 &
 
-# Give Xfce a moment to start up
-sleep 3
-
-# Start x11vnc server (password-protected)
+# VNC server (password-protected)
 x11vnc -display :99 -N -forever -shared -rfbauth /home/myuser/.vncpass -rfbport 5900 &
 
-# Start Marionette server for Firefox
-export MOZ_MARIONETTE=1
-socat TCP-LISTEN:2829,fork TCP:localhost:2828 &
-
-# Start the Spongecake API server
+# Spongecake API server
 python3 /app/api_server.py &
 
-# Start Firefox with Marionette
-firefox-esr -marionette &
-
-# Start socat for port forwarding
+# Marionette forwards; socat only connects to Firefox when a client connects
+export MOZ_MARIONETTE=1
+socat TCP-LISTEN:2829,fork TCP:localhost:2828 &
 socat TCP-LISTEN:3838,fork TCP:127.0.0.1:2828 &
 
+# 4) Firefox and the wallpaper need the window manager.
+wait_for "the window manager" 30 wm_running
+wait "$PROFILE_PID"
+firefox-esr -marionette -profile "$FIREFOX_PROFILE" &
+
 # Re-apply the wallpaper in case it didn't stick during build
 xfconf-query -c xfce4-desktop \
   -p /backdrop/screen0/monitorscreen/workspace0/last-image \
   -s /usr/share/backgrounds/spongecake-background.png \
   --create -t string || true
 
+# 5) Write the ready marker once every service is up.
+wait_for "VNC" 30 port_listening 5900 \
+  && wait_for "the API server" 30 port_listening 8000 \
+  && wait_for "Marionette" 60 port_listening 2828 \
+  && wait_for "the Firefox window" 60 browser_window \
+  && BOOT_MS=$(( ($(date +%s%N) - BOOT_START) / 1000000 )) \
+  && echo "{\"boot_ms\": ${BOOT_MS}, \"ready_at\": \"$(date -u +%Y-%m-%dT%H:%M:%SZ)\"}" > "${READY_MARKER}.tmp" \
+  && mv "${READY_MARKER}.tmp" "$READY_MARKER" \
+  && echo "startup: desktop ready in ${BOOT_MS} ms"
+
 # Keep the container alive (log tailing, etc.)
 tail -f /dev/null
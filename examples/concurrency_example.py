@@ -3,7 +3,7 @@ import concurrent.futures
 from datetime import date, timedelta
 from time import sleep
 from dotenv import load_dotenv
-from spongecake import Desktop, AgentStatus
+from spongecake import DesktopPool, AgentStatus
 import subprocess
 
 # Configure logging - most logs in the SDK are INFO level logs
@@ -40,28 +40,19 @@ def get_nth_weekend_dates(year, month, n):
     return nth_friday.day, nth_sunday.day
 
 
-def check_flight_price(month, origin, destination, weekend_number):
-    # Use local Docker container
-    desktop_name = f"spongecake_weekend_flight_{weekend_number}"
-    ## Best practice: When running desktops concurrently, its generally better to manage which ports each desktop will run on
-    #   This avoids port conflicts. Spongecake will automatically handle port conflicts if needed, but this could lead to issues.
-    # Set all ports based on weekend number (default port + weekend_number - 1)
-    desktop = Desktop(
-        name=desktop_name,
-        vnc_port=5900 + weekend_number - 1,
-        api_port=8000 + weekend_number - 1,
-        marionette_port=3838 + weekend_number - 1,
-        socat_port=2828 + weekend_number - 1
-    )
-    container = desktop.start()
-    logging.info(f"🍰 Local Spongecake container started for weekend {weekend_number}: {container}")
-
+def check_flight_price(pool, month, origin, destination, weekend_number):
     friday_date, sunday_date = get_nth_weekend_dates(2025, int(month), int(weekend_number))
     if friday_date is None or sunday_date is None:
-        desktop.stop()
-        logging.info(f"🍰 Local Spongecake container stopped for weekend: {weekend_number}")
+        logging.info(f"🍰 No weekend number {weekend_number} in month {month}, skipping")
         return None
-    
+
+    # Lease an already started desktop from the pool - it goes back to the pool (reset) when we're done
+    with pool.lease() as desktop:
+        logging.info(f"🍰 Leased desktop '{desktop.container_name}' for weekend {weekend_number}")
+        return run_weekend_check(desktop, month, origin, destination, weekend_number, friday_date, sunday_date)
+
+
+def run_weekend_check(desktop, month, origin, destination, weekend_number, friday_date, sunday_date):
     logging.info(f"Checking dates: {friday_date} - {sunday_date}")
     try:
         prompt = f'''First, navigate to: https://www.google.com/travel/flights
@@ -98,11 +89,14 @@ def check_flight_price(month, origin, destination, weekend_number):
     except Exception as e:
         logging.error(f"Exception while checking weekend number {weekend_number}: {str(e)}")
         return f"EXCEPTION: {str(e)}"
-    finally:
-        desktop.stop()
-        logging.info(f"🍰 Local Spongecake container stopped for weekend: {weekend_number}")
 
 def main():
+    weekends = [1, 2, 3, 4, 5]
+
+    # Start warming up a pool of desktops while the user answers the prompts, so each check can begin acting right away.
+    ## Spongecake automatically picks free ports for pooled desktops, so there is no need to manage ports manually
+    pool = DesktopPool(size=len(weekends), name_prefix="spongecake_weekend_flight")
+
     # Prompt user for emails
     print('\n -> This is a flight price checker to find the cheapest set of flights for a weekend trip to a given destination. Provide the starting location, destination, and the month you want to travel to find the best weekend to fly')
     origin = input("\n>Starting location (Origin): ").strip()
@@ -110,16 +104,14 @@ def main():
     month = input("\n>Month Number (e.g. 1 - January, 2 - February, ... 10 - October, etc.): ").strip()
     
     print(f"\nChecking best weekend to fly in {month_map[month]}...\n")
-
-    weekends = [1, 2, 3, 4, 5]
     
     # Store results
     results = {}
     cheapest_weekend = float('inf')
     # Use ThreadPoolExecutor to run checks concurrently
-    with concurrent.futures.ThreadPoolExecutor(max_workers=min(5, len(weekends))) as executor:
+    with pool, concurrent.futures.ThreadPoolExecutor(max_workers=min(5, len(weekends))) as executor:
         # Submit all checks and store the futures with their corresponding weekend numbers
-        future_to_weekend = {executor.submit(check_flight_price, month, origin, destination, weekend): weekend for weekend in weekends}
+        future_to_weekend = {executor.submit(check_flight_price, pool, month, origin, destination, weekend): weekend for weekend in weekends}
         
         # Process results as they complete
         for future in concurrent.futures.as_completed(future_to_weekend):
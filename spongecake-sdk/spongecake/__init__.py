@@ -1,7 +1,10 @@
 from .desktop import Desktop
+from .pool import DesktopPool
 from .agent import Agent
+from .async_desktop import AsyncDesktop
+from .async_agent import AsyncAgent
 from .constants import AgentStatus
 from .trace import TraceConfig
 from .telemetry import Telemetry
 
-__all__ = ["Desktop", "AgentStatus", "Agent", "TraceConfig", "Telemetry"]
\ No newline at end of file
+__all__ = ["Desktop", "DesktopPool", "AsyncDesktop", "AgentStatus", "Agent", "AsyncAgent", "TraceConfig", "Telemetry"]
\ No newline at end of file
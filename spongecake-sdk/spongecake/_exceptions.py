@@ -1,2 +1,10 @@
 class SpongecakeException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class StepLimitExceeded(SpongecakeException):
+    """Raised when an agent needs more steps than its max_steps budget allows."""
+    pass
+
+class DesktopNotReady(SpongecakeException):
+    """Raised when a desktop's subsystems don't all come up within the readiness timeout."""
+    pass
@@ -1,12 +1,18 @@
 import base64
+import json
 import logging
 import time
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait as wait_for_futures
 from typing import List, Dict, Any, Optional, Union, Tuple
 from openai import OpenAI
 
 # Import from constants module
 from .constants import AgentStatus
 from .telemetry import Telemetry
+from .history import History, history_spill_path
+from .input_detection import classify_input_request, verdict_cache
+from . import _exceptions
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -22,7 +28,9 @@ class Agent:
     status-based API.
     """
 
-    def __init__(self, desktop=None, openai_api_key=None):
+    def __init__(self, desktop=None, openai_api_key=None, max_steps: int = 100, history_size: int = 50, history_spill_dir: Optional[str] = None,
+                 stream: bool = False, on_reasoning_delta=None, on_message_delta=None,
+                 tool_workers: int = 4, tool_timeout: Optional[float] = 60, tool_timeouts: Optional[Dict[str, float]] = None):
         """
         Initialize an Agent instance.
         
@@ -30,6 +38,18 @@ class Agent:
             desktop: A Desktop instance to control. Can be set later with set_desktop().
             openai_api_key: OpenAI API key for authentication. If None, will try to use
                            the one from the desktop or environment variables.
+            max_steps: Maximum number of model round trips (computer or function calls)
+                       one action may take before it stops with an error
+            history_size: Number of responses and inputs kept in memory
+            history_spill_dir: Optional directory older history entries are written to
+                               instead of being dropped
+            stream: Stream model responses, and start each computer action as soon as it
+                    has been received instead of after the whole response
+            on_reasoning_delta: Optional function called with each reasoning summary text delta
+            on_message_delta: Optional function called with each message text delta
+            tool_workers: Maximum number of function calls from one response run at the same time
+            tool_timeout: Seconds a function call may run before it's reported as timed out (None waits forever)
+            tool_timeouts: Optional per-function timeouts, keyed by function name
         """
         self.desktop = desktop
         
@@ -45,14 +65,27 @@ class Agent:
             self.openai_client = None
             
         # Initialize state tracking
-        self._response_history = []  # List of all responses from the API
-        self._input_history = []     # List of all inputs sent to the API
+        self.max_steps = max_steps
+        self._response_history = History(history_size, history_spill_path(history_spill_dir, "responses"))  # Recent responses from the API
+        self._input_history = History(history_size, history_spill_path(history_spill_dir, "inputs"))        # Recent inputs sent to the API
         self._current_response = None  # Current response object
         self._pending_call = None     # Pending computer call that needs safety check acknowledgment
         self._pending_safety_checks = []  # Pending safety checks
         self._needs_input = []        # Messages requesting user input
         self._error = None            # Last error message, if any
 
+        # Streaming
+        self.stream = stream
+        self.on_reasoning_delta = on_reasoning_delta
+        self.on_message_delta = on_message_delta
+        self._dispatched_calls = {}   # call_id -> computer action started while its response was streaming
+        self._action_executor = None
+
+        # Function tools
+        self.tool_workers = tool_workers
+        self.tool_timeout = tool_timeout
+        self.tool_timeouts = tool_timeouts or {}
+
         self.telemetry = Telemetry()
 
     def set_desktop(self, desktop):
@@ -82,34 +115,89 @@ class Agent:
         """
         if self.desktop is None:
             raise ValueError("No desktop has been set for this agent.")
-            
-        action_type = action.type
 
         try:
-            if action_type == "click":
-                x, y = int(action.x), int(action.y)
-                self.desktop.click(x, y, action.button)
-            elif action_type == "scroll":
-                x, y = int(action.x), int(action.y)
-                scroll_x, scroll_y = int(action.scroll_x), int(action.scroll_y)
-                self.desktop.scroll(x, y, scroll_x=scroll_x, scroll_y=scroll_y)
-            elif action_type == "keypress":
-                keys = action.keys
-                self.desktop.keypress(keys)
-            elif action_type == "type":
-                text = action.text
-                self.desktop.type_text(text)
-            elif action_type == "wait":
-                time.sleep(2)
-            elif action_type == "screenshot":
-                # Nothing to do as screenshot is taken at each turn
-                screenshot_bytes = self.desktop.get_screenshot()
-                return screenshot_bytes
-            else:
-                logger.info(f"Unrecognized action: {action}")
+            call = self._desktop_call(action)
+            if call is not None:
+                method, args, kwargs = call
+                result = getattr(self.desktop, method)(*args, **kwargs)
+                return result if method == "get_screenshot" else None
+        except Exception as e:
+            logger.error(f"Error handling action {action}: {e}")
+
+    def _desktop_call(self, action):
+        """
+        Translate a model action into the Desktop method that runs it, as
+        (method name, args, kwargs), or None if the action isn't recognized.
+        """
+        action_type = action.type
+        if action_type == "click":
+            return "click", (int(action.x), int(action.y), action.button), {}
+        elif action_type == "scroll":
+            return "scroll", (int(action.x), int(action.y)), {"scroll_x": int(action.scroll_x), "scroll_y": int(action.scroll_y)}
+        elif action_type == "keypress":
+            return "keypress", (action.keys,), {}
+        elif action_type == "type":
+            return "type_text", (action.text,), {}
+        elif action_type == "wait":
+            # Wait for the screen to stop changing, for up to 2 seconds
+            return "settle", (), {"quiet_period": 1.0, "timeout": 2.0}
+        elif action_type == "screenshot":
+            # Nothing to do as screenshot is taken at each turn
+            return "get_screenshot", (), {}
+        logger.info(f"Unrecognized action: {action}")
+        return None
 
+    def _run_computer_action(self, action):
+        """
+        Execute a model action, wait for the screen to settle and return the screenshot
+        that follows, using a single Desktop.step() round trip.
+        """
+        if self.desktop is None:
+            raise ValueError("No desktop has been set for this agent.")
+
+        try:
+            step_action, settle_args = self._step_args(action)
+            return self.desktop.step(step_action, **settle_args)
         except Exception as e:
             logger.error(f"Error handling action {action}: {e}")
+            return self.desktop.get_screenshot_bytes()
+
+    def _computer_call_result(self, computer_call):
+        """Return the screenshot for a computer call, waiting for it if streaming already started the action."""
+        dispatched = self._dispatched_calls.pop(computer_call.call_id, None)
+        if dispatched is not None:
+            return dispatched.result()
+        return self._run_computer_action(computer_call.action)
+
+    def _step_args(self, action):
+        """
+        Translate a model action into Desktop.step() arguments: the API action dict
+        (None if there is nothing to run) and settle options.
+        """
+        action_type = action.type
+        if action_type == "click":
+            return {"type": "click", "x": int(action.x), "y": int(action.y), "button": action.button}, {}
+        elif action_type == "scroll":
+            return {
+                "type": "scroll",
+                "x": int(action.x),
+                "y": int(action.y),
+                "scroll_x": int(action.scroll_x),
+                "scroll_y": int(action.scroll_y)
+            }, {}
+        elif action_type == "keypress":
+            return {"type": "keypress", "keys": action.keys}, {}
+        elif action_type == "type":
+            return {"type": "type", "text": action.text}, {}
+        elif action_type == "wait":
+            # Wait for the screen to stop changing, for up to 2 seconds
+            return None, {"quiet_period": 1.0, "timeout": 2.0}
+        elif action_type == "screenshot":
+            # Nothing to do as screenshot is taken at each turn
+            return None, {"settle": False}
+        logger.info(f"Unrecognized action: {action}")
+        return None, {}
 
     def _auto_generate_input(self, question: str, input_history=None) -> str:
         """Generate an automated response to agent questions using OpenAI.
@@ -122,38 +210,45 @@ class Agent:
             str: An appropriate response to the agent's question
         """
         try:
-            # Extract original task and conversation history
-            original_task = input_history[0].get('content', '') if input_history and len(input_history) > 0 else ''
-            
-            # Build conversation history
-            conversation_history = ""
-            if input_history and len(input_history) > 1:
-                for i, inp in enumerate(input_history[1:], 1):
-                    conversation_history += f"User input {i}: {inp.get('content', '')}\n"
-            
-            messages = [
-                {"role": "system", "content": "You are a helpful assistant generating responses to questions in the context of desktop automation tasks. Keep responses concise and direct."},
-                {"role": "user", "content": f"Original task: {original_task}\nConversation history:\n{conversation_history}\nAgent question: {question}\nPlease provide a suitable response to help complete this task."}
-            ]
-            
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                max_tokens=100,
-                temperature=0.7
-            )
-            
-            auto_response = response.choices[0].message.content.strip()
-            logger.info(f"Auto-generated response: {auto_response}")
-            return auto_response
+            response = self.openai_client.chat.completions.create(**self._auto_input_params(question, input_history))
+            return self._auto_input_from(response)
         except Exception as e:
             logger.error(f"Error generating automated response: {str(e)}")
             return "continue"
 
+    def _auto_input_params(self, question: str, input_history=None):
+        """Build the chat completion parameters used to auto-generate an answer to an agent question."""
+        # Extract original task and conversation history (History keeps the first input even once it's evicted)
+        first_input = getattr(input_history, "first", None) or (input_history[0] if input_history else None)
+        original_task = first_input.get('content', '') if first_input else ''
+        
+        # Build conversation history
+        conversation_history = ""
+        if input_history and len(input_history) > 1:
+            for i, inp in enumerate(input_history[1:], 1):
+                conversation_history += f"User input {i}: {inp.get('content', '')}\n"
+        
+        return {
+            "model": "gpt-4o-mini",
+            "messages": [
+                {"role": "system", "content": "You are a helpful assistant generating responses to questions in the context of desktop automation tasks. Keep responses concise and direct."},
+                {"role": "user", "content": f"Original task: {original_task}\nConversation history:\n{conversation_history}\nAgent question: {question}\nPlease provide a suitable response to help complete this task."}
+            ],
+            "max_tokens": 100,
+            "temperature": 0.7
+        }
+
+    def _auto_input_from(self, response) -> str:
+        """Extract the auto-generated answer from its chat completion."""
+        auto_response = response.choices[0].message.content.strip()
+        logger.info(f"Auto-generated response: {auto_response}")
+        return auto_response
+
     def _is_message_asking_for_input(self, message, input_history=None):
         """
         Determine if a message from the agent is asking for more input or providing a final answer.
-        Uses a lightweight GPT model to analyze the message content.
+        Clear cases are decided locally; ambiguous messages are sent to a lightweight GPT model,
+        whose verdicts are cached by message hash.
         
         Args:
             message: The message object from the agent
@@ -162,20 +257,68 @@ class Agent:
         Returns:
             bool: True if the message is asking for more input, False if it's a final answer
         """
+        message_text = self._message_text(message)
+        verdict = self._input_verdict_without_model(message_text)
+        if verdict is not None:
+            return verdict
+
+        try:
+            # Make a lightweight call to the model
+            response = self.openai_client.chat.completions.create(**self._input_detection_params(message_text, input_history))
+            return self._model_input_verdict(message_text, response)
+        except Exception as e:
+            # If there's an error, default to assuming it needs input
+            logger.error(f"Error determining if message needs input: {e}. Assuming input is needed.")
+            return True
+
+    def _input_verdict_without_model(self, message_text: str) -> Optional[bool]:
+        """Decide whether a message asks for input without calling the model, or return None if the model has to decide."""
+        # If message is empty, assume it doesn't need input
+        if not message_text.strip():
+            return False
+
+        verdict = self._local_input_verdict(message_text)
+        if verdict is not None:
+            return verdict
+
         if not self.openai_client:
             # If no OpenAI client is available, assume it needs input if it's a message
             return True
-            
-        # Extract text from the message
-        message_text = ""
+        return None
+
+    def _input_detection_params(self, message_text: str, input_history=None):
+        """Build the chat completion parameters for the input detection model."""
+        return {
+            "model": "gpt-4o-mini",  # Using a lightweight model
+            "messages": [{"role": "user", "content": self._input_detection_prompt(message_text, input_history)}],
+            "max_tokens": 1,  # We only need a single digit
+            "temperature": 0.0  # Deterministic response
+        }
+
+    def _model_input_verdict(self, message_text: str, response) -> bool:
+        """Read the input detection model's verdict and cache it."""
+        verdict = self._parse_input_detection(response.choices[0].message.content.strip())
+        verdict_cache.set(message_text, verdict)
+        return verdict
+
+    def _local_input_verdict(self, message_text: str) -> Optional[bool]:
+        """Decide without the model whether a message asks for input: rules first, then cached model verdicts."""
+        verdict = classify_input_request(message_text)
+        if verdict is None:
+            verdict = verdict_cache.get(message_text)
+        if verdict is not None:
+            logger.debug(f"Input detection decided locally: {'needs input' if verdict else 'final answer'}")
+        return verdict
+
+    def _message_text(self, message) -> str:
+        """Join the text parts of a message output item."""
         if hasattr(message, "content"):
             text_parts = [part.text for part in message.content if hasattr(part, "text")]
-            message_text = " ".join(text_parts)
-        
-        # If message is empty, assume it doesn't need input
-        if not message_text.strip():
-            return False
-            
+            return " ".join(text_parts)
+        return ""
+
+    def _input_detection_prompt(self, message_text: str, input_history=None) -> str:
+        """Build the prompt used to ask the model whether a message is asking for input."""
         # Prepare context from input history if available
         context = ""
         if input_history and len(input_history) > 0:
@@ -183,7 +326,7 @@ class Agent:
             context = "Previous user inputs:\n" + "\n".join([f"- {inp.get('content', '')}" for inp in last_inputs])
         
         # Create prompt for the model
-        prompt = f"""Analyze this message from an AI agent and determine if it's asking for more input (1) or providing a final answer (0).
+        return f"""Analyze this message from an AI agent and determine if it's asking for more input (1) or providing a final answer (0).
 
 {context}
 
@@ -191,32 +334,16 @@ Agent message: "{message_text}"
 
 Is this message asking for more input from the user?
 Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing final answer)."""
-        
-        try:
-            # Make a lightweight call to the model
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",  # Using a lightweight model
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=1,  # We only need a single digit
-                temperature=0.0  # Deterministic response
-            )
-            
-            # Extract the response
-            result = response.choices[0].message.content.strip()
-            
-            # Parse the result
-            if "1" in result:
-                return True
-            elif "0" in result:
-                return False
-            else:
-                # If the model didn't return a clear 0 or 1, default to assuming input is needed
-                logger.info(f"Unclear response from input detection model: {result}. Assuming input is needed.")
-                return True
-                
-        except Exception as e:
-            # If there's an error, default to assuming it needs input
-            logger.error(f"Error determining if message needs input: {e}. Assuming input is needed.")
+
+    def _parse_input_detection(self, result: str) -> bool:
+        """Turn the input detection model's 0/1 answer into a bool."""
+        if "1" in result:
+            return True
+        elif "0" in result:
+            return False
+        else:
+            # If the model didn't return a clear 0 or 1, default to assuming input is needed
+            logger.info(f"Unclear response from input detection model: {result}. Assuming input is needed.")
             return True
     
     def computer_use_loop(
@@ -230,6 +357,7 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
         Run the loop that executes computer actions until no 'computer_call' is found,
         handling pending safety checks BEFORE actually executing the call.
         Also handles function calls like get_page_html.
+        Runs iteratively and raises StepLimitExceeded after max_steps steps.
         
         Args:
             response: A response object from the OpenAI API.
@@ -241,69 +369,245 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
             (response, messages, safety_checks, pending_call, needs_input)
         """
 
-        # 1) Check the stop_event at the beginning
-        if stop_event is not None and stop_event.is_set():
-            logger.info("Stop event is set. Exiting 'computer_use_loop' early.")
-            # Return some safe defaults or partial results here
-            return response, None, None, None
-
         if self.desktop is None:
             raise ValueError("No desktop has been set for this agent.")
-            
-        # Check for function calls and handle them
-        function_calls = [item for item in response.output if item.type == "function_call"]
-        if function_calls:
-            import json
-            input_messages = []
-            
-            for tool_call in function_calls:
-                name = tool_call.name
-                args = json.loads(tool_call.arguments) if hasattr(tool_call, 'arguments') and tool_call.arguments else {}
-                
-                # Dispatch to the appropriate function
-                if name == "get_page_html":
-                    result = self.get_page_html(**args)
-                elif function_map and name in function_map:
-                    logger.info(f"[TOOL CALL] Calling function: {name}, with arguments: {args}")
-                    result = function_map[name](**args)
-                else:
-                    logger.info(f"[TOOL CALL] Function: {name} not found in function map. Unable to call.")
-                    result = f"Function {name} not implemented"
-                    
-                # Add the result to input messages
-                input_messages.append({
-                    "type": "function_call_output",
-                    "call_id": tool_call.call_id,
-                    "output": str(result)
-                })
-                
-            # Create a new response with the function results
-            new_response = self._create_response(
-                input_data=input_messages,
+
+        steps = 0
+        while True:
+            # Check the stop_event before every step
+            if self._stop_requested(stop_event):
+                # Return some safe defaults or partial results here
+                self._discard_dispatched()
+                return response, None, None, None
+
+            step, calls = self._plan_step(response)
+            if step == "done":
+                return calls
+
+            steps += 1
+            self._check_step_budget(steps)
+
+            # Function calls are handled first; their results go back to the model
+            if step == "functions":
+                input_messages = self._run_function_calls(calls, function_map)
+
+                # Computer calls that streaming started before a function call arrived have
+                # already run, so their screenshots go back with the function results
+                for computer_call in self._dispatched_in(response):
+                    input_messages.append(self._computer_call_output(computer_call, self._computer_call_result(computer_call)))
+
+                # Create a new response with the function results
+                response = self._create_response(
+                    input_data=input_messages,
+                    previous_response_id=response.id,
+                    custom_tools=custom_tools,
+                    stop_event=stop_event
+                )
+
+                # Add to response history
+                self._record_response(response)
+                continue
+
+            # Computer calls with no safety checks => execute all of them, in order
+            call_outputs = []
+            for computer_call in calls:
+                if self._stop_requested(stop_event):
+                    self._discard_dispatched()
+                    return response, None, None, None
+
+                # Run the action, let the screen settle and take a screenshot in one round trip
+                screenshot_bytes = self._computer_call_result(computer_call)
+
+                # Return screenshot as computer_call_output
+                call_outputs.append(self._computer_call_output(computer_call, screenshot_bytes))
+            self._save_screenshot(screenshot_bytes)
+
+            response = self._create_response(
+                input_data=call_outputs,
                 previous_response_id=response.id,
-                custom_tools=custom_tools
-            )
-            
-            # Add to response history
-            self._response_history.append(new_response)
-            self._current_response = new_response
-            
-            # 2) Pass stop_event along in the recursive call
-            return self.computer_use_loop(
-                new_response,
                 custom_tools=custom_tools,
-                function_map=function_map,
                 stop_event=stop_event
             )
-        
+
+    def _plan_step(self, response):
+        """
+        Decide what computer_use_loop does next with a response. Shared by Agent and
+        AsyncAgent, which only differ in how they run the I/O.
+
+        Returns:
+            ("done", loop result) when the loop should return, ("functions", function calls)
+            to run the function calls, or ("computer", computer calls) to execute them in order.
+        """
+        function_calls, messages, computer_calls, all_safety_checks = self._split_response(response)
+
+        if function_calls:
+            return "functions", function_calls
+
+        # If there are computer_calls with safety checks, return before running any of them
+        if computer_calls and all_safety_checks:
+            return "done", (response, messages or None, all_safety_checks, self._safety_checked_call(computer_calls))
+
+        if computer_calls:
+            return "computer", computer_calls
+
+        # If no call but we have messages or checks
+        if messages or all_safety_checks:
+            return "done", (response, messages or None, all_safety_checks or None, None)
+
+        logger.info("No actionable computer_call or interactive prompt found. Finishing loop.")
+        return "done", (response, None, None, None)
+
+    def _stop_requested(self, stop_event) -> bool:
+        """Whether the loop's stop_event has been set."""
+        if stop_event is not None and stop_event.is_set():
+            logger.info("Stop event is set. Exiting 'computer_use_loop' early.")
+            return True
+        return False
+
+    def _dispatched_in(self, response):
+        """The computer calls of a response that streaming has already started, in order."""
+        return [call for call in self._split_response(response)[2] if call.call_id in self._dispatched_calls]
+
+    def _discard_dispatched(self):
+        """Forget the computer calls started while streaming, cancelling the ones that haven't started yet."""
+        for dispatched in self._dispatched_calls.values():
+            dispatched.cancel()
+        self._dispatched_calls = {}
+
+    def _computer_call_output(self, computer_call, screenshot_bytes, acknowledged_safety_checks=None):
+        """Build the computer_call_output item returning a call's screenshot."""
+        return self._build_input_dict(
+            call_id=computer_call.call_id,
+            output=self._screenshot_output(screenshot_bytes),
+            acknowledged_safety_checks=acknowledged_safety_checks
+        )
+
+    def _record_response(self, response):
+        """Add a response to the history and make it the current one."""
+        self._response_history.append(response)
+        self._current_response = response
+
+    def _safety_checked_call(self, computer_calls):
+        """Return the computer call to hold for safety check acknowledgment: the first one with checks."""
+        for computer_call in computer_calls:
+            if getattr(computer_call, "pending_safety_checks", None):
+                return computer_call
+        return computer_calls[0]
+
+    def _calls_to_execute(self, response, pending_call):
+        """All computer calls of the response the pending call came from, in order."""
+        computer_calls = self._split_response(response)[2]
+        if any(call.call_id == pending_call.call_id for call in computer_calls):
+            return computer_calls
+        return [pending_call]
+
+    def _run_function_calls(self, function_calls, function_map=None):
+        """
+        Run the function calls of one response concurrently, at most tool_workers at a time,
+        each with its timeout, and return their function_call_output items in call order.
+
+        As in AsyncAgent, a call's timeout counts from when it starts running, so calls queued
+        behind others don't lose their queue time. Threads can't be interrupted, so a call that
+        times out is abandoned: its daemon thread keeps running until the function returns, but
+        it gives up its tool_workers slot and can't hold up later calls or batches.
+        """
+        calls = [self._function_call_args(tool_call) for tool_call in function_calls]
+        results = {}
+        queued = list(range(len(calls)))
+        running = {}  # index -> (future, deadline)
+        while queued or running:
+            # Start queued calls while there are free slots; their timeouts start now
+            while queued and len(running) < max(1, self.tool_workers):
+                index = queued.pop(0)
+                name, args = calls[index]
+                timeout = self._tool_timeout_for(name)
+                deadline = None if timeout is None else time.monotonic() + timeout
+                running[index] = (self._start_function_call(name, args, function_map), deadline)
+
+            deadlines = [deadline for _, deadline in running.values() if deadline is not None]
+            wait_time = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+            wait_for_futures([future for future, _ in running.values()], timeout=wait_time, return_when=FIRST_COMPLETED)
+
+            now = time.monotonic()
+            for index, (future, deadline) in list(running.items()):
+                if future.done():
+                    results[index] = future.result()
+                elif deadline is not None and now >= deadline:
+                    name = calls[index][0]
+                    results[index] = self._timed_out_result(name, self._tool_timeout_for(name))
+                else:
+                    continue
+                del running[index]
+
+        # Add the results to input messages, in call order
+        return [self._function_call_output(tool_call, results[index]) for index, tool_call in enumerate(function_calls)]
+
+    def _start_function_call(self, name, args, function_map=None) -> Future:
+        """Run one function call in its own daemon thread and return a Future for its result."""
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def run():
+            try:
+                future.set_result(self._call_function(name, args, function_map))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name=f"spongecake-tool-{name}", daemon=True).start()
+        return future
+
+    def _call_function(self, name, args, function_map=None):
+        """Dispatch one function call to get_page_html or the function map."""
+        function = self._resolve_function(name, args, function_map)
+        if function is None:
+            return f"Function {name} not implemented"
+        return function(**args)
+
+    def _resolve_function(self, name, args, function_map=None):
+        """Return the callable for a function call: get_page_html or a function from the map (None if unknown)."""
+        if name == "get_page_html":
+            return self.get_page_html
+        elif function_map and name in function_map:
+            logger.info(f"[TOOL CALL] Calling function: {name}, with arguments: {args}")
+            return function_map[name]
+        logger.info(f"[TOOL CALL] Function: {name} not found in function map. Unable to call.")
+        return None
+
+    def _function_call_output(self, tool_call, result):
+        """Build the function_call_output item returning a function call's result."""
+        return {
+            "type": "function_call_output",
+            "call_id": tool_call.call_id,
+            "output": str(result)
+        }
+
+    def _timed_out_result(self, name, timeout):
+        """Log a function call timeout and return the result sent to the model instead."""
+        logger.error(f"[TOOL CALL] Function: {name} timed out after {timeout} seconds.")
+        return f"Error: function {name} timed out after {timeout} seconds"
+
+    def _tool_timeout_for(self, name):
+        """Timeout in seconds for a function call, from tool_timeouts or tool_timeout."""
+        return self.tool_timeouts.get(name, self.tool_timeout)
+
+    def _check_step_budget(self, steps):
+        """Raise StepLimitExceeded once a loop has taken more than max_steps steps."""
+        if self.max_steps is not None and steps > self.max_steps:
+            raise _exceptions.StepLimitExceeded(f"Exceeded the maximum of {self.max_steps} steps for this action.")
+
+    def _split_response(self, response):
+        """
+        Split a response's output into function calls, messages, computer calls
+        and the pending safety checks of all items.
+        """
+        function_calls = [item for item in response.output if item.type == "function_call"]
+
         # Identify all message items (the agent wants text input)
         messages = [item for item in response.output if item.type == "message"]
 
         # Identify any computer_call items
         computer_calls = [item for item in response.output if item.type == "computer_call"]
 
-        computer_call = computer_calls[0] if computer_calls else None
-
         # Identify all safety checks
         all_safety_checks = []
         for item in response.output:
@@ -311,51 +615,25 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
             if checks:
                 all_safety_checks.extend(checks)
 
-        # If there's a computer_call that also has safety checks, return immediately
-        if computer_call and all_safety_checks:
-            return response, messages or None, all_safety_checks, computer_call
-
-        # If no computer_call but we have messages or checks
-        if not computer_call:
-            if messages or all_safety_checks:
-                return response, messages or None, all_safety_checks or None, None
-            
-            logger.info("No actionable computer_call or interactive prompt found. Finishing loop.")
-            return response, None, None, None
+        return function_calls, messages, computer_calls, all_safety_checks
 
-        # If we get here, we have a computer_call with no safety checks => execute
-        self.handle_model_action(computer_call.action)
-        time.sleep(1)
+    def _function_call_args(self, tool_call):
+        """Return the name and decoded JSON arguments of a function call."""
+        args = json.loads(tool_call.arguments) if hasattr(tool_call, 'arguments') and tool_call.arguments else {}
+        return tool_call.name, args
 
-        # Take a screenshot
-        screenshot_base64 = self.desktop.get_screenshot()
-        image_data = base64.b64decode(screenshot_base64)
+    def _save_screenshot(self, screenshot_bytes):
+        """Write the latest screenshot to output_image.png."""
         with open("output_image.png", "wb") as f:
-            f.write(image_data)
+            f.write(screenshot_bytes)
         logger.info("* Saved image data.")
 
-        # Return screenshot as computer_call_output
-        call_output = self._build_input_dict(
-            call_id=computer_call.call_id,
-            output={
-                "type": "input_image",
-                "image_url": f"data:image/png;base64,{screenshot_base64}"
-            }
-        )
-        
-        new_response = self._create_response(
-            input_data=call_output,
-            previous_response_id=response.id,
-            custom_tools=custom_tools
-        )
-
-        # 3) Recursive call again, passing the same stop_event
-        return self.computer_use_loop(
-            new_response,
-            custom_tools=custom_tools,
-            function_map=function_map,
-            stop_event=stop_event
-        )
+    def _screenshot_output(self, screenshot_bytes):
+        """Build the input_image output for a computer call; the only place the screenshot is base64-encoded."""
+        return {
+            "type": "input_image",
+            "image_url": f"data:image/png;base64,{base64.b64encode(screenshot_bytes).decode('ascii')}"
+        }
 
 
     @property
@@ -365,12 +643,12 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
         
     @property
     def response_history(self):
-        """Get the history of all responses."""
+        """Get the recent responses (up to history_size)."""
         return self._response_history.copy()
         
     @property
     def input_history(self):
-        """Get the history of all inputs."""
+        """Get the recent inputs (up to history_size)."""
         return self._input_history.copy()
         
     @property
@@ -395,13 +673,17 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
         
     def reset_state(self):
         """Reset the agent's state, clearing all history and pending items."""
-        self._response_history = []
-        self._input_history = []
+        self._response_history.clear()
+        self._input_history.clear()
         self._current_response = None
         self._pending_call = None
         self._pending_safety_checks = []
         self._needs_input = []
         self._error = None
+        self._discard_dispatched()
+        if self._action_executor is not None:
+            self._action_executor.shutdown(wait=False, cancel_futures=True)
+            self._action_executor = None
         
     def action(self, input_text=None, acknowledged_safety_checks=False, ignore_safety_and_input=False,
                complete_handler=None, needs_input_handler=None, needs_safety_check_handler=None, error_handler=None,
@@ -455,67 +737,48 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
             
             If handlers are provided, this function may return different values based on the handler's execution.
         """
-        # Annonimized telemetry
-        # To opt-out, set SPONGECAKE_TELEMETRY=false or SPONGECAKE_DISABLE_TELEMETRY=true
-        self.telemetry.capture(
-            event="agent.action_called",
-            properties={
-                "input_text": input_text,
-                "ignore_safety_and_input": ignore_safety_and_input,
-                "has_tools": tools is not None
-            }
-        )
+        self._capture_action_called(input_text, ignore_safety_and_input, tools)
         if self.desktop is None:
-            self._error = "No desktop has been set for this agent."
-            error_result = AgentStatus.ERROR, self._error
+            error_result = self._fail("No desktop has been set for this agent.")
             if error_handler:
                 error_handler(self._error)
             return error_result
             
         try:
-            # If we're ignoring safety and input, handle them automatically
-            if ignore_safety_and_input:
-                status, data = self._handle_action_with_auto_responses(input_text, tools=tools, function_map=function_map, stop_event=stop_event)
-                # Even in auto mode, we should pass through handlers if provided
-                return self._process_result_with_handlers(status, data, complete_handler, needs_input_handler, 
-                                                        needs_safety_check_handler, error_handler, tools=tools, function_map=function_map)
-            
-            # Case 1: Acknowledging safety checks for a pending call
-            if acknowledged_safety_checks and self._pending_call:
-                status, data = self._handle_acknowledged_safety_checks(custom_tools=tools, function_map=function_map, stop_event=stop_event)
-                return self._process_result_with_handlers(status, data, complete_handler, needs_input_handler, 
-                                                        needs_safety_check_handler, error_handler, tools=tools, function_map=function_map)
-                
-            # Case 2: Continuing a conversation with user input
-            if self._needs_input and input_text is not None:
-                status, data = self._handle_user_input(input_text, tools=tools, function_map=function_map, stop_event=stop_event)
-                return self._process_result_with_handlers(status, data, complete_handler, needs_input_handler, 
-                                                        needs_safety_check_handler, error_handler, tools=tools, function_map=function_map)
-                
-            # Case 3: Starting a new conversation with a command
-            if input_text is not None:
-                status, data = self._handle_new_command(input_text, tools=tools, function_map=function_map, stop_event=stop_event)
-                return self._process_result_with_handlers(status, data, complete_handler, needs_input_handler, 
-                                                        needs_safety_check_handler, error_handler, tools=tools, function_map=function_map)
-                
-            # If we get here, there's no valid action to take
-            self._error = "No valid action to take. Provide input text or acknowledge safety checks."
-            error_result = AgentStatus.ERROR, self._error
-            if error_handler:
-                error_handler(self._error)
-            return error_result
+            selected = self._select_action(input_text, acknowledged_safety_checks, ignore_safety_and_input,
+                                           tools=tools, function_map=function_map, stop_event=stop_event)
+            if selected is None:
+                # If we get here, there's no valid action to take
+                error_result = self._fail("No valid action to take. Provide input text or acknowledge safety checks.")
+                if error_handler:
+                    error_handler(self._error)
+                return error_result
+
+            handle, kwargs = selected
+            status, data = handle(**kwargs)
+            # Even in auto mode, we should pass through handlers if provided
+            return self._process_result_with_handlers(status, data, complete_handler, needs_input_handler, 
+                                                    needs_safety_check_handler, error_handler, tools=tools, function_map=function_map)
                 
         except Exception as e:
-            self._error = str(e)
-            error_result = AgentStatus.ERROR, self._error
+            error_result = self._fail(str(e))
             if error_handler:
                 error_handler(self._error)
             return error_result
-            
-    def _process_result_with_handlers(self, status, data, complete_handler, needs_input_handler, 
-                                     needs_safety_check_handler, error_handler, tools=None, function_map=None):
-        """Process a result with the appropriate handler if provided."""
-        # If handlers are provided, use them to handle the different statuses
+
+    def _capture_action_called(self, input_text, ignore_safety_and_input, tools):
+        # Annonimized telemetry
+        # To opt-out, set SPONGECAKE_TELEMETRY=false or SPONGECAKE_DISABLE_TELEMETRY=true
+        self.telemetry.capture(
+            event="agent.action_called",
+            properties={
+                "input_text": input_text,
+                "ignore_safety_and_input": ignore_safety_and_input,
+                "has_tools": tools is not None
+            }
+        )
+
+    def _capture_action_completed(self, status, data):
         # Annonimized telemetry
         # To opt-out, set SPONGECAKE_TELEMETRY=false or SPONGECAKE_DISABLE_TELEMETRY=true
         self.telemetry.capture(
@@ -525,46 +788,72 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
                 "data": data
             }
         )
+
+    def _fail(self, message):
+        """Record an error and return the ERROR result for it."""
+        self._error = message
+        return AgentStatus.ERROR, self._error
+
+    def _select_action(self, input_text, acknowledged_safety_checks, ignore_safety_and_input, tools=None, function_map=None, stop_event=None):
+        """
+        Pick the handler for an action() call and its keyword arguments, or return None if
+        there is no valid action to take. The handlers are coroutines on AsyncAgent.
+        """
+        # If we're ignoring safety and input, handle them automatically
+        if ignore_safety_and_input:
+            return self._handle_action_with_auto_responses, {"input_text": input_text, "tools": tools, "function_map": function_map, "stop_event": stop_event}
+
+        # Case 1: Acknowledging safety checks for a pending call
+        if acknowledged_safety_checks and self._pending_call:
+            return self._handle_acknowledged_safety_checks, {"custom_tools": tools, "function_map": function_map, "stop_event": stop_event}
+
+        # Case 2: Continuing a conversation with user input
+        if self._needs_input and input_text is not None:
+            return self._handle_user_input, {"input_text": input_text, "tools": tools, "function_map": function_map, "stop_event": stop_event}
+
+        # Case 3: Starting a new conversation with a command
+        if input_text is not None:
+            return self._handle_new_command, {"command_text": input_text, "tools": tools, "function_map": function_map, "stop_event": stop_event}
+        return None
+
+    def _process_result_with_handlers(self, status, data, complete_handler, needs_input_handler, 
+                                     needs_safety_check_handler, error_handler, tools=None, function_map=None):
+        """Process a result with the appropriate handler if provided."""
+        # If handlers are provided, use them to handle the different statuses
+        self._capture_action_completed(status, data)
+        handlers = self._handler_kwargs(complete_handler, needs_input_handler, needs_safety_check_handler, error_handler, tools, function_map)
+
         if status == AgentStatus.COMPLETE and complete_handler:
             complete_handler(data)
-            return status, data
             
         elif status == AgentStatus.NEEDS_INPUT and needs_input_handler:
             user_input = needs_input_handler(data)
             if user_input:
                 # Continue with the provided input - pass all handlers
-                return self.action(
-                    input_text=user_input,
-                    complete_handler=complete_handler,
-                    needs_input_handler=needs_input_handler,
-                    needs_safety_check_handler=needs_safety_check_handler,
-                    error_handler=error_handler,
-                    tools=tools,
-                    function_map=function_map
-                )
-            return status, data
+                return self.action(input_text=user_input, **handlers)
             
         elif status == AgentStatus.NEEDS_SAFETY_CHECK and needs_safety_check_handler:
             proceed = needs_safety_check_handler(data["safety_checks"], data["pending_call"])
             if proceed:
                 # Continue with acknowledged safety checks - pass all handlers
-                return self.action(
-                    acknowledged_safety_checks=True,
-                    complete_handler=complete_handler,
-                    needs_input_handler=needs_input_handler,
-                    needs_safety_check_handler=needs_safety_check_handler,
-                    error_handler=error_handler,
-                    tools=tools,
-                    function_map=function_map
-                )
-            return status, data
+                return self.action(acknowledged_safety_checks=True, **handlers)
             
         elif status == AgentStatus.ERROR and error_handler:
             error_handler(data)
-            return status, data
             
         # If no handler or handler didn't take action, return the result
         return status, data
+
+    def _handler_kwargs(self, complete_handler, needs_input_handler, needs_safety_check_handler, error_handler, tools, function_map):
+        """Keyword arguments that carry the handlers and tools over to a follow-up action() call."""
+        return {
+            "complete_handler": complete_handler,
+            "needs_input_handler": needs_input_handler,
+            "needs_safety_check_handler": needs_safety_check_handler,
+            "error_handler": error_handler,
+            "tools": tools,
+            "function_map": function_map
+        }
             
     def _handle_action_with_auto_responses(self, input_text, tools=None, function_map=None, stop_event=None):
         """Handle an action with automatic responses to safety checks and input requests."""
@@ -575,110 +864,97 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
             # Continue from current state
             status, data = AgentStatus.COMPLETE, self._current_response
         else:
-            self._error = "No input provided and no current conversation to continue."
-            return AgentStatus.ERROR, self._error
+            return self._fail("No input provided and no current conversation to continue.")
             
         # Loop until we get a COMPLETE status or hit an error
         max_iterations = 5  # Safety limit to prevent infinite loops
-        iteration = 0
-        
-        while iteration < max_iterations:
-            iteration += 1
+        for iteration in range(1, max_iterations + 1):
             logger.info(f"Auto-response iteration {iteration}")
             
-            if status == AgentStatus.COMPLETE:
-                # We're done
+            if status in (AgentStatus.COMPLETE, AgentStatus.ERROR):
+                # We're done, or an error occurred
                 return status, data
                 
             elif status == AgentStatus.NEEDS_SAFETY_CHECK:
                 # Automatically acknowledge safety checks
-                logger.info("Automatically acknowledging safety checks:")
-                safety_checks = data["safety_checks"]
-                for check in safety_checks:
-                    if hasattr(check, "message"):
-                        logger.info(f"- Pending safety check: {check.message}")
-                
-                # Handle the acknowledged safety checks
+                self._log_auto_acknowledged(data["safety_checks"])
                 status, data = self._handle_acknowledged_safety_checks(custom_tools=tools, function_map=function_map)
                 
             elif status == AgentStatus.NEEDS_INPUT:
-                # Generate an automatic response
-                messages = data
-                question = ""
-                for msg in messages:
-                    if hasattr(msg, "content"):
-                        text_parts = [part.text for part in msg.content if hasattr(part, "text")]
-                        question += " ".join(text_parts)
-                
-                # Generate an automatic response
-                auto_response = self._auto_generate_input(question, self._input_history)
-                
-                # Continue with the auto-generated response
+                # Generate an automatic response and continue with it
+                auto_response = self._auto_generate_input(self._messages_text(data), self._input_history)
                 status, data = self._handle_user_input(auto_response, tools=tools, function_map=function_map)
                 
-            elif status == AgentStatus.ERROR:
-                # An error occurred
-                return status, data
-                
         # If we get here, we hit the iteration limit
-        self._error = f"Exceeded maximum iterations ({max_iterations}) in auto-response mode."
-        return AgentStatus.ERROR, self._error
+        return self._fail(f"Exceeded maximum iterations ({max_iterations}) in auto-response mode.")
+
+    def _log_auto_acknowledged(self, safety_checks):
+        logger.info("Automatically acknowledging safety checks:")
+        for check in safety_checks:
+            if hasattr(check, "message"):
+                logger.info(f"- Pending safety check: {check.message}")
+
+    def _messages_text(self, messages) -> str:
+        """Join the text of several message output items, e.g. the question behind a NEEDS_INPUT status."""
+        return "".join(self._message_text(message) for message in messages)
             
     def _handle_new_command(self, command_text, tools=None, function_map=None, stop_event=None):
         """Handle a new command from the user."""
+        new_input = self._start_new_command(command_text, function_map)
+        
+        response = self._create_response(new_input, custom_tools=tools, stop_event=stop_event)
+        self._record_response(response)
+        
+        # Process the response
+        return self._process_response(response, custom_tools=tools, function_map=self._function_map, stop_event=stop_event)
+
+    def _start_new_command(self, command_text, function_map=None):
+        """Reset the conversation state for a new command and return its input item."""
         # Reset state for new conversation
         self._pending_call = None
         self._pending_safety_checks = []
         self._needs_input = []
         self._function_map = function_map or {}
+        self._discard_dispatched()
         
-        # Create input and response
+        # Create input
         new_input = self._build_input_dict("user", command_text)
         self._input_history.append(new_input)
-        
-        response = self._create_response(new_input, custom_tools=tools)
-        self._response_history.append(response)
-        self._current_response = response
-        
-        # Process the response
-        return self._process_response(response, custom_tools=tools, function_map=self._function_map, stop_event=stop_event)
+        return new_input
         
     def _handle_user_input(self, input_text, tools=None, function_map=None, stop_event=None):
         """Handle user input in response to an agent request."""
         if not self._current_response:
-            self._error = "No active conversation to continue."
-            return AgentStatus.ERROR, self._error
-            
-        # Update function map if provided
-        if function_map:
-            self._function_map = function_map
+            return self._fail("No active conversation to continue.")
             
-        # Create input and response
-        new_input = self._build_input_dict("user", input_text)
-        self._input_history.append(new_input)
+        new_input = self._start_user_input(input_text, function_map)
         
-        response = self._create_response(new_input, previous_response_id=self._current_response.id, custom_tools=tools)
-        self._response_history.append(response)
-        self._current_response = response
+        response = self._create_response(new_input, previous_response_id=self._current_response.id, custom_tools=tools, stop_event=stop_event)
+        self._record_response(response)
         
         # Clear the needs_input flag since we've provided input
         self._needs_input = []
         
         # Process the response
         return self._process_response(response, custom_tools=tools, function_map=self._function_map, stop_event=stop_event)
+
+    def _start_user_input(self, input_text, function_map=None):
+        """Return the input item for a user's answer to the agent, updating the function map if provided."""
+        if function_map:
+            self._function_map = function_map
+            
+        new_input = self._build_input_dict("user", input_text)
+        self._input_history.append(new_input)
+        return new_input
         
     def _handle_acknowledged_safety_checks(self, custom_tools=None, function_map=None, stop_event=None):
         """Handle acknowledged safety checks for a pending call."""
-        if not self._current_response or not self._pending_call or not self._pending_safety_checks:
-            self._error = "No pending call or safety checks to acknowledge."
-            return AgentStatus.ERROR, self._error
-            
-        # Update function map if provided
-        if function_map:
-            self._function_map = function_map
+        error_result = self._check_acknowledgeable(function_map)
+        if error_result:
+            return error_result
             
         # Execute the call with acknowledged safety checks
-        self._execute_and_continue_call(self._current_response, self._pending_call, self._pending_safety_checks, custom_tools=custom_tools)
+        self._execute_and_continue_call(self._current_response, self._pending_call, self._pending_safety_checks, custom_tools=custom_tools, stop_event=stop_event)
         
         # Clear the pending call and safety checks
         self._pending_call = None
@@ -687,6 +963,15 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
         # Process the updated response
         return self._process_response(self._current_response, custom_tools=custom_tools, function_map=self._function_map, stop_event=stop_event)
         
+    def _check_acknowledgeable(self, function_map=None):
+        """Return an ERROR result if there is no pending call to acknowledge, and update the function map if provided."""
+        if not self._current_response or not self._pending_call or not self._pending_safety_checks:
+            return self._fail("No pending call or safety checks to acknowledge.")
+            
+        if function_map:
+            self._function_map = function_map
+        return None
+
     def get_page_html(self, query="return document.documentElement.outerHTML;", *args, **kwargs):
         """
         Get the HTML content of the currently displayed webpage using Marionette.
@@ -697,43 +982,40 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
         if self.desktop is None:
             return "Error: No desktop has been set for this agent."
             
-        # Check if marionette_driver is available
+        # Reuse the desktop's persistent Marionette session instead of connecting per call
+        session = self.desktop.get_marionette()
         try:
-            import json
-            try:
-                from marionette_driver.marionette import Marionette
-            except ImportError:
-                return "Error: marionette_driver package is not installed. Please install it with 'pip install marionette_driver'."
-            
-            # Connect to Marionette through the port forwarded by socat
-            host = "localhost"
-            port = self.desktop.marionette_port  # Use the marionette_port directly
-            
-            # logger.info(f"Connecting to Marionette server at {host}:{port}...")
-            try:
-                client = Marionette(host, port=port)
-                # logger.info("Successfully connected to Marionette server.")
-
-                client.start_session()
-                # Execute JavaScript to get the full DOM HTML
-                html = client.execute_script(query)
-                
-                # logger.info("Successfully retrieved page HTML")
-                return html
-            except ConnectionRefusedError:
-                return f"Error: Could not connect to Marionette server at {host}:{port}. Make sure Firefox is running with marionette enabled."
-            except Exception as e:
-                error_message = f"Error in Marionette connection: {str(e)}"
-                logger.error(error_message)
-                return error_message
+            return session.execute_script(query)
+        except RuntimeError as e:
+            error_message = f"Error: {str(e)}. Make sure Firefox is running with marionette enabled."
+            logger.error(error_message)
+            return error_message
         except Exception as e:
-            error_message = f"Unexpected error retrieving page HTML: {str(e)}"
+            error_message = f"Error in Marionette connection: {str(e)}"
             logger.error(error_message)
             return error_message
     
     def _process_response(self, response, custom_tools=None, function_map=None, stop_event=None):
         """Process a response from the API and determine the next action."""
         output, messages, checks, pending_call = self.computer_use_loop(response, custom_tools=custom_tools, function_map=function_map, stop_event=stop_event)
+        result = self._apply_loop_result(output, messages, checks, pending_call)
+        if result is not None:
+            return result
+            
+        # Check if any of the messages are asking for input
+        for message in messages:
+            if self._is_message_asking_for_input(message, self._input_history):
+                return self._needs_input_result(messages)
+                
+        # The message is a final answer
+        return AgentStatus.COMPLETE, output
+
+    def _apply_loop_result(self, output, messages, checks, pending_call):
+        """
+        Update the state from a computer_use_loop result and return the status when it
+        doesn't depend on the messages (None means the messages have to be checked for
+        questions to the user).
+        """
         self._current_response = output
         
         # Update state based on the response
@@ -745,24 +1027,15 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
                 "pending_call": pending_call
             }
             
-        if messages:
-            # Check if any of the messages are asking for input
-            needs_input = False
-            for message in messages:
-                if self._is_message_asking_for_input(message, self._input_history):
-                    needs_input = True
-                    break
-                    
-            if needs_input:
-                # The message is asking for more input
-                self._needs_input = messages
-                return AgentStatus.NEEDS_INPUT, messages
-            else:
-                # The message is a final answer
-                return AgentStatus.COMPLETE, output
-            
-        # If we get here, the action is complete
-        return AgentStatus.COMPLETE, output
+        if not messages:
+            # If we get here, the action is complete
+            return AgentStatus.COMPLETE, output
+        return None
+
+    def _needs_input_result(self, messages):
+        """Record messages that ask the user for input and return the NEEDS_INPUT result."""
+        self._needs_input = messages
+        return AgentStatus.NEEDS_INPUT, messages
 
     def _build_input_dict(self, role=None, content=None, call_id=None, call_type=None, output=None, safety_checks=None, acknowledged_safety_checks=None):
         """
@@ -814,7 +1087,7 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
         else:
             raise ValueError("Either role or call_id must be provided")
 
-    def _create_response(self, input_data, previous_response_id=None, reasoning=None, custom_tools=None):
+    def _create_response(self, input_data, previous_response_id=None, reasoning=None, custom_tools=None, stop_event=None):
         """
         Helper method to create a response from the OpenAI API.
         
@@ -827,6 +1100,85 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
         Returns:
             A response object from the OpenAI API
         """
+        params = self._response_params(input_data, previous_response_id=previous_response_id, reasoning=reasoning, custom_tools=custom_tools)
+
+        try:
+            if self.stream:
+                return self._stream_response(params, stop_event)
+            return self.openai_client.responses.create(**params)
+        except Exception as e:
+            self._log_response_error(e)
+            raise
+
+    def _stream_response(self, params, stop_event=None):
+        """
+        Create a response with streaming and return the completed response.
+
+        Text deltas are forwarded to on_reasoning_delta / on_message_delta as they arrive.
+        A computer call without safety checks is started in the background as soon as its
+        item is complete, unless stop_event is set; computer_use_loop picks up the result via
+        _computer_call_result(), or discards it if the loop stops first.
+        """
+        response = None
+        held = False
+        for event in self.openai_client.responses.create(stream=True, **params):
+            delta = self._stream_delta(event)
+            if delta is not None:
+                callback, text = delta
+                callback(text)
+                continue
+
+            dispatch, held, completed = self._handle_stream_event(event, held, stop_event)
+            if dispatch is not None:
+                if self._action_executor is None:
+                    self._action_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spongecake-action")
+                self._dispatched_calls[dispatch.call_id] = self._action_executor.submit(self._run_computer_action, dispatch.action)
+            if completed is not None:
+                response = completed
+        if response is None:
+            raise RuntimeError("Response stream ended before the response was completed.")
+        return response
+
+    def _stream_delta(self, event):
+        """Return (callback, text) for a reasoning or message text delta that has a callback, else None."""
+        event_type = getattr(event, "type", "")
+        if event_type == "response.reasoning_summary_text.delta" and self.on_reasoning_delta:
+            return self.on_reasoning_delta, event.delta
+        elif event_type == "response.output_text.delta" and self.on_message_delta:
+            return self.on_message_delta, event.delta
+        return None
+
+    def _handle_stream_event(self, event, held, stop_event=None):
+        """
+        Handle one streaming event other than the text deltas (see _stream_delta).
+        Nothing is started once stop_event is set.
+
+        Returns:
+            (computer call to start now or None, whether early starts are held,
+             the completed response or None)
+        """
+        event_type = getattr(event, "type", "")
+        if event_type == "response.output_item.done":
+            item = event.item
+            # computer_use_loop handles function calls first and holds calls with safety checks
+            # until they're acknowledged. Later computer calls must not overtake either, so
+            # early starts stop at the first function call or call with safety checks.
+            if item.type == "function_call" or (item.type == "computer_call" and getattr(item, "pending_safety_checks", None)):
+                held = True
+            elif item.type == "computer_call" and not held:
+                if stop_event is None or not stop_event.is_set():
+                    return item, held, None
+        elif event_type == "response.completed":
+            return None, held, event.response
+        elif event_type in ("response.failed", "response.incomplete"):
+            details = getattr(event.response, "error", None) or getattr(event.response, "incomplete_details", None)
+            raise RuntimeError(f"Response stream ended with {event_type}: {details}")
+        elif event_type == "error":
+            raise RuntimeError(f"Response stream error: {getattr(event, 'message', event)}")
+        return None, held, None
+
+    def _response_params(self, input_data, previous_response_id=None, reasoning=None, custom_tools=None):
+        """Build the parameters for a `responses.create` call."""
         # Ensure input_data is a list
         if not isinstance(input_data, list):
             input_data = [input_data]
@@ -877,18 +1229,18 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
         if self.desktop.tracer.config.trace_api_calls:
             self.desktop.tracer.add_entry("api_call", endpoint="openai/responses", params=params)
 
-        try:
-            return self.openai_client.responses.create(**params)
-        except Exception as e:
-            import traceback
-            error_traceback = traceback.format_exc()
-            logger.error(f"Error creating response: {str(e)}")
-            logger.error(f"Error code: {getattr(e, 'code', 'N/A')}")
-            logger.error(f"Error details: {getattr(e, 'json', {})}")
-            logger.error(f"Stacktrace:\n{error_traceback}")
-            raise
+        return params
+
+    def _log_response_error(self, e):
+        """Log the details of a failed `responses.create` call."""
+        import traceback
+        error_traceback = traceback.format_exc()
+        logger.error(f"Error creating response: {str(e)}")
+        logger.error(f"Error code: {getattr(e, 'code', 'N/A')}")
+        logger.error(f"Error details: {getattr(e, 'json', {})}")
+        logger.error(f"Stacktrace:\n{error_traceback}")
 
-    def _execute_and_continue_call(self, input, computer_call, safety_checks, custom_tools=None, function_map=None):
+    def _execute_and_continue_call(self, input, computer_call, safety_checks, custom_tools=None, function_map=None, stop_event=None):
         """
         Helper for 'action': directly executes a 'computer_call' after user acknowledged
         safety checks. Then performs the screenshot step, sending 'acknowledged_safety_checks'
@@ -897,40 +1249,29 @@ Respond with only a single digit: 1 (yes, asking for input) or 0 (no, providing
         Args:
             input: The input response object
             computer_call: The computer call to execute
-            safety_checks: The safety checks that were acknowledged
+            safety_checks: The safety checks the user acknowledged (those of every computer call
+                           in the response; each call's output acknowledges its own)
             custom_tools: Optional list of additional tool definitions to include
         """
         if self.desktop is None:
             raise ValueError("No desktop has been set for this agent.")
             
-        # Actually execute the call
-        self.handle_model_action(computer_call.action)
-        time.sleep(1)
+        # Actually execute the call, and any other computer calls of the same response, in order
+        call_outputs = []
+        for call in self._calls_to_execute(input, computer_call):
+            # Run the action, let the screen settle and take a screenshot in one round trip
+            screenshot_bytes = self._computer_call_result(call)
 
-        # Take a screenshot
-        screenshot_base64 = self.desktop.get_screenshot()
-        image_data = base64.b64decode(screenshot_base64)
-        with open("output_image.png", "wb") as f:
-            f.write(image_data)
-        logger.info("* Saved image data.")
-
-        # Now, create a new response with an acknowledged_safety_checks field
-        # in the computer_call_output
-        call_output = self._build_input_dict(
-            call_id=computer_call.call_id,
-            output={
-                "type": "input_image",
-                "image_url": f"data:image/png;base64,{screenshot_base64}"
-            },
-            acknowledged_safety_checks=safety_checks
-        )
+            # Each call acknowledges only its own safety checks
+            call_outputs.append(self._computer_call_output(call, screenshot_bytes, getattr(call, "pending_safety_checks", None)))
+        self._save_screenshot(screenshot_bytes)
         
         new_response = self._create_response(
-            input_data=call_output,
+            input_data=call_outputs,
             previous_response_id=input.id,
             custom_tools=custom_tools,
+            stop_event=stop_event,
         )
         
         # Add to response history
-        self._response_history.append(new_response)
-        self._current_response = new_response
\ No newline at end of file
+        self._record_response(new_response)
\ No newline at end of file
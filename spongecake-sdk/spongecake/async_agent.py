@@ -0,0 +1,464 @@
+import asyncio
+import logging
+from openai import AsyncOpenAI
+
+# Import from constants module
+from .constants import AgentStatus
+from .agent import Agent
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+class AsyncAgent(Agent):
+    """
+    Asyncio counterpart of Agent, driving an AsyncDesktop with AsyncOpenAI.
+
+    All methods that talk to OpenAI or the desktop are coroutines, so a single event
+    loop can run many agents concurrently instead of needing one thread per agent.
+    State tracking and the status-based API are the same as Agent's: the decisions
+    (what to run next, how results and state are recorded) are Agent's helpers, and
+    only the awaited I/O lives here.
+    """
+
+    def __init__(self, desktop=None, openai_api_key=None, **kwargs):
+        """
+        Initialize an AsyncAgent instance.
+
+        Args:
+            desktop: An AsyncDesktop instance to control. Can be set later with set_desktop().
+            openai_api_key: OpenAI API key for authentication. If None, will try to use
+                           the one from the desktop or environment variables.
+            **kwargs: max_steps, history_size and history_spill_dir, as for Agent
+        """
+        super().__init__(desktop=desktop, openai_api_key=openai_api_key, **kwargs)
+        self.openai_client = AsyncOpenAI(api_key=self.openai_api_key) if self.openai_api_key is not None else None
+
+    def set_desktop(self, desktop):
+        """
+        Set or update the desktop instance this agent controls.
+
+        Args:
+            desktop: An AsyncDesktop instance to control.
+        """
+        self.desktop = desktop
+
+        # If we don't have an API key yet, try to get it from the desktop
+        if self.openai_api_key is None and desktop.openai_api_key is not None:
+            self.openai_api_key = desktop.openai_api_key
+            self.openai_client = AsyncOpenAI(api_key=self.openai_api_key)
+
+    async def handle_model_action(self, action):
+        """
+        Given a computer action (e.g., click, double_click, scroll, etc.),
+        execute the corresponding operation on the AsyncDesktop environment.
+
+        Args:
+            action: An action object from the OpenAI model response.
+
+        Returns:
+            Screenshot bytes if the action is a screenshot, None otherwise.
+        """
+        if self.desktop is None:
+            raise ValueError("No desktop has been set for this agent.")
+
+        try:
+            call = self._desktop_call(action)
+            if call is not None:
+                method, args, kwargs = call
+                result = await getattr(self.desktop, method)(*args, **kwargs)
+                return result if method == "get_screenshot" else None
+        except Exception as e:
+            logger.error(f"Error handling action {action}: {e}")
+
+    async def _run_computer_action(self, action):
+        """Execute a model action and return the settled screenshot in one AsyncDesktop.step() round trip."""
+        if self.desktop is None:
+            raise ValueError("No desktop has been set for this agent.")
+
+        try:
+            step_action, settle_args = self._step_args(action)
+            return await self.desktop.step(step_action, **settle_args)
+        except Exception as e:
+            logger.error(f"Error handling action {action}: {e}")
+            return await self.desktop.get_screenshot_bytes()
+
+    async def _run_function_calls(self, function_calls, function_map=None):
+        """
+        Run the function calls of one response concurrently (at most tool_workers at a time),
+        each with its timeout, and return their function_call_output items in call order.
+        Plain functions run in worker threads; coroutine functions run on the event loop.
+        A call's timeout counts from when it starts running, as in Agent. A timed-out coroutine
+        is cancelled; a timed-out plain function keeps its worker thread until it returns.
+        """
+        semaphore = asyncio.Semaphore(self.tool_workers)
+
+        async def run(tool_call):
+            name, args = self._function_call_args(tool_call)
+            timeout = self._tool_timeout_for(name)
+            async with semaphore:
+                try:
+                    result = await asyncio.wait_for(self._call_function(name, args, function_map), timeout)
+                except asyncio.TimeoutError:
+                    result = self._timed_out_result(name, timeout)
+            return self._function_call_output(tool_call, result)
+
+        return list(await asyncio.gather(*(run(tool_call) for tool_call in function_calls)))
+
+    async def _call_function(self, name, args, function_map=None):
+        """Dispatch one function call to get_page_html or the function map."""
+        function = self._resolve_function(name, args, function_map)
+        if function is None:
+            return f"Function {name} not implemented"
+        if asyncio.iscoroutinefunction(function):
+            result = await function(**args)
+        else:
+            result = await asyncio.to_thread(function, **args)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    async def _computer_call_result(self, computer_call):
+        """Return the screenshot for a computer call, awaiting it if streaming already started the action."""
+        dispatched = self._dispatched_calls.pop(computer_call.call_id, None)
+        if dispatched is not None:
+            return await dispatched
+        return await self._run_computer_action(computer_call.action)
+
+    async def _run_after(self, previous, action):
+        """Run a computer action once the previously started one has finished."""
+        if previous is not None:
+            await asyncio.wait([previous])
+        return await self._run_computer_action(action)
+
+    async def _auto_generate_input(self, question: str, input_history=None) -> str:
+        """Generate an automated response to agent questions using OpenAI."""
+        try:
+            response = await self.openai_client.chat.completions.create(**self._auto_input_params(question, input_history))
+            return self._auto_input_from(response)
+        except Exception as e:
+            logger.error(f"Error generating automated response: {str(e)}")
+            return "continue"
+
+    async def _is_message_asking_for_input(self, message, input_history=None):
+        """
+        Determine if a message from the agent is asking for more input or providing a final answer.
+        Clear cases are decided locally; ambiguous messages go to a lightweight GPT model.
+        """
+        message_text = self._message_text(message)
+        verdict = self._input_verdict_without_model(message_text)
+        if verdict is not None:
+            return verdict
+
+        try:
+            response = await self.openai_client.chat.completions.create(**self._input_detection_params(message_text, input_history))
+            return self._model_input_verdict(message_text, response)
+        except Exception as e:
+            # If there's an error, default to assuming it needs input
+            logger.error(f"Error determining if message needs input: {e}. Assuming input is needed.")
+            return True
+
+    async def computer_use_loop(
+        self,
+        response,
+        custom_tools=None,
+        function_map=None,
+        stop_event=None  # kill signal
+    ):
+        """
+        Run the loop that executes computer actions until no 'computer_call' is found,
+        handling pending safety checks BEFORE actually executing the call.
+        Also handles function calls like get_page_html. Functions in function_map may
+        be plain callables or coroutine functions. Raises StepLimitExceeded after max_steps steps.
+
+        Returns:
+            (response, messages, safety_checks, pending_call)
+        """
+        if self.desktop is None:
+            raise ValueError("No desktop has been set for this agent.")
+
+        steps = 0
+        while True:
+            # Check the stop_event before every step
+            if self._stop_requested(stop_event):
+                self._discard_dispatched()
+                return response, None, None, None
+
+            step, calls = self._plan_step(response)
+            if step == "done":
+                return calls
+
+            steps += 1
+            self._check_step_budget(steps)
+
+            # Function calls are handled first; their results go back to the model
+            if step == "functions":
+                input_messages = await self._run_function_calls(calls, function_map)
+
+                # Computer calls that streaming started before a function call arrived have
+                # already run, so their screenshots go back with the function results
+                for computer_call in self._dispatched_in(response):
+                    input_messages.append(self._computer_call_output(computer_call, await self._computer_call_result(computer_call)))
+
+                # Create a new response with the function results
+                response = await self._create_response(
+                    input_data=input_messages,
+                    previous_response_id=response.id,
+                    custom_tools=custom_tools,
+                    stop_event=stop_event
+                )
+
+                # Add to response history
+                self._record_response(response)
+                continue
+
+            # Computer calls with no safety checks => execute all of them, in order
+            call_outputs = []
+            for computer_call in calls:
+                if self._stop_requested(stop_event):
+                    self._discard_dispatched()
+                    return response, None, None, None
+
+                # Run the action, let the screen settle and take a screenshot in one round trip
+                screenshot_bytes = await self._computer_call_result(computer_call)
+                call_outputs.append(self._computer_call_output(computer_call, screenshot_bytes))
+            await asyncio.to_thread(self._save_screenshot, screenshot_bytes)
+
+            response = await self._create_response(
+                input_data=call_outputs,
+                previous_response_id=response.id,
+                custom_tools=custom_tools,
+                stop_event=stop_event
+            )
+
+    async def action(self, input_text=None, acknowledged_safety_checks=False, ignore_safety_and_input=False,
+                     complete_handler=None, needs_input_handler=None, needs_safety_check_handler=None, error_handler=None,
+                     tools=None, function_map=None, stop_event=None):
+        """
+        Execute an action in the desktop environment. Same arguments and return value as
+        Agent.action(); handlers may be plain functions or coroutine functions.
+        """
+        self._capture_action_called(input_text, ignore_safety_and_input, tools)
+        if self.desktop is None:
+            error_result = self._fail("No desktop has been set for this agent.")
+            if error_handler:
+                await _call_handler(error_handler, self._error)
+            return error_result
+
+        try:
+            selected = self._select_action(input_text, acknowledged_safety_checks, ignore_safety_and_input,
+                                           tools=tools, function_map=function_map, stop_event=stop_event)
+            if selected is None:
+                # If we get here, there's no valid action to take
+                error_result = self._fail("No valid action to take. Provide input text or acknowledge safety checks.")
+                if error_handler:
+                    await _call_handler(error_handler, self._error)
+                return error_result
+
+            handle, kwargs = selected
+            status, data = await handle(**kwargs)
+            return await self._process_result_with_handlers(status, data, complete_handler, needs_input_handler,
+                                                            needs_safety_check_handler, error_handler, tools=tools, function_map=function_map)
+
+        except Exception as e:
+            error_result = self._fail(str(e))
+            if error_handler:
+                await _call_handler(error_handler, self._error)
+            return error_result
+
+    async def _process_result_with_handlers(self, status, data, complete_handler, needs_input_handler,
+                                            needs_safety_check_handler, error_handler, tools=None, function_map=None):
+        """Process a result with the appropriate handler if provided."""
+        self._capture_action_completed(status, data)
+        handlers = self._handler_kwargs(complete_handler, needs_input_handler, needs_safety_check_handler, error_handler, tools, function_map)
+
+        if status == AgentStatus.COMPLETE and complete_handler:
+            await _call_handler(complete_handler, data)
+
+        elif status == AgentStatus.NEEDS_INPUT and needs_input_handler:
+            user_input = await _call_handler(needs_input_handler, data)
+            if user_input:
+                # Continue with the provided input - pass all handlers
+                return await self.action(input_text=user_input, **handlers)
+
+        elif status == AgentStatus.NEEDS_SAFETY_CHECK and needs_safety_check_handler:
+            proceed = await _call_handler(needs_safety_check_handler, data["safety_checks"], data["pending_call"])
+            if proceed:
+                # Continue with acknowledged safety checks - pass all handlers
+                return await self.action(acknowledged_safety_checks=True, **handlers)
+
+        elif status == AgentStatus.ERROR and error_handler:
+            await _call_handler(error_handler, data)
+
+        # If no handler or handler didn't take action, return the result
+        return status, data
+
+    async def _handle_action_with_auto_responses(self, input_text, tools=None, function_map=None, stop_event=None):
+        """Handle an action with automatic responses to safety checks and input requests."""
+        # Start with a new command if provided, or continue from current state
+        if input_text is not None:
+            status, data = await self._handle_new_command(input_text, tools=tools, function_map=function_map, stop_event=stop_event)
+        elif self._current_response:
+            # Continue from current state
+            status, data = AgentStatus.COMPLETE, self._current_response
+        else:
+            return self._fail("No input provided and no current conversation to continue.")
+
+        # Loop until we get a COMPLETE status or hit an error
+        max_iterations = 5  # Safety limit to prevent infinite loops
+        for iteration in range(1, max_iterations + 1):
+            logger.info(f"Auto-response iteration {iteration}")
+
+            if status in (AgentStatus.COMPLETE, AgentStatus.ERROR):
+                return status, data
+
+            elif status == AgentStatus.NEEDS_SAFETY_CHECK:
+                # Automatically acknowledge safety checks
+                self._log_auto_acknowledged(data["safety_checks"])
+                status, data = await self._handle_acknowledged_safety_checks(custom_tools=tools, function_map=function_map)
+
+            elif status == AgentStatus.NEEDS_INPUT:
+                # Generate an automatic response and continue with it
+                auto_response = await self._auto_generate_input(self._messages_text(data), self._input_history)
+                status, data = await self._handle_user_input(auto_response, tools=tools, function_map=function_map)
+
+        # If we get here, we hit the iteration limit
+        return self._fail(f"Exceeded maximum iterations ({max_iterations}) in auto-response mode.")
+
+    async def _handle_new_command(self, command_text, tools=None, function_map=None, stop_event=None):
+        """Handle a new command from the user."""
+        new_input = self._start_new_command(command_text, function_map)
+
+        response = await self._create_response(new_input, custom_tools=tools, stop_event=stop_event)
+        self._record_response(response)
+
+        # Process the response
+        return await self._process_response(response, custom_tools=tools, function_map=self._function_map, stop_event=stop_event)
+
+    async def _handle_user_input(self, input_text, tools=None, function_map=None, stop_event=None):
+        """Handle user input in response to an agent request."""
+        if not self._current_response:
+            return self._fail("No active conversation to continue.")
+
+        new_input = self._start_user_input(input_text, function_map)
+
+        response = await self._create_response(new_input, previous_response_id=self._current_response.id, custom_tools=tools, stop_event=stop_event)
+        self._record_response(response)
+
+        # Clear the needs_input flag since we've provided input
+        self._needs_input = []
+
+        # Process the response
+        return await self._process_response(response, custom_tools=tools, function_map=self._function_map, stop_event=stop_event)
+
+    async def _handle_acknowledged_safety_checks(self, custom_tools=None, function_map=None, stop_event=None):
+        """Handle acknowledged safety checks for a pending call."""
+        error_result = self._check_acknowledgeable(function_map)
+        if error_result:
+            return error_result
+
+        # Execute the call with acknowledged safety checks
+        await self._execute_and_continue_call(self._current_response, self._pending_call, self._pending_safety_checks, custom_tools=custom_tools, stop_event=stop_event)
+
+        # Clear the pending call and safety checks
+        self._pending_call = None
+        self._pending_safety_checks = []
+
+        # Process the updated response
+        return await self._process_response(self._current_response, custom_tools=custom_tools, function_map=self._function_map, stop_event=stop_event)
+
+    async def get_page_html(self, query="return document.documentElement.outerHTML;", *args, **kwargs):
+        """
+        Get the HTML content of the currently displayed webpage using Marionette.
+        The blocking Marionette client runs in a worker thread.
+        """
+        return await asyncio.to_thread(super().get_page_html, query, *args, **kwargs)
+
+    async def _process_response(self, response, custom_tools=None, function_map=None, stop_event=None):
+        """Process a response from the API and determine the next action."""
+        output, messages, checks, pending_call = await self.computer_use_loop(response, custom_tools=custom_tools, function_map=function_map, stop_event=stop_event)
+        result = self._apply_loop_result(output, messages, checks, pending_call)
+        if result is not None:
+            return result
+
+        # Check if any of the messages are asking for input
+        for message in messages:
+            if await self._is_message_asking_for_input(message, self._input_history):
+                return self._needs_input_result(messages)
+
+        # The message is a final answer
+        return AgentStatus.COMPLETE, output
+
+    async def _create_response(self, input_data, previous_response_id=None, reasoning=None, custom_tools=None, stop_event=None):
+        """Create a response from the OpenAI API without blocking the event loop."""
+        params = self._response_params(input_data, previous_response_id=previous_response_id, reasoning=reasoning, custom_tools=custom_tools)
+
+        try:
+            if self.stream:
+                return await self._stream_response(params, stop_event)
+            return await self.openai_client.responses.create(**params)
+        except Exception as e:
+            self._log_response_error(e)
+            raise
+
+    async def _stream_response(self, params, stop_event=None):
+        """
+        Create a response with streaming and return the completed response (see Agent._stream_response).
+        Early computer calls run as tasks on the event loop; delta callbacks may be coroutine functions.
+        """
+        response = None
+        held = False
+        last_dispatched = None
+        stream = await self.openai_client.responses.create(stream=True, **params)
+        async for event in stream:
+            delta = self._stream_delta(event)
+            if delta is not None:
+                callback, text = delta
+                await _call_handler(callback, text)
+                continue
+
+            dispatch, held, completed = self._handle_stream_event(event, held, stop_event)
+            if dispatch is not None:
+                # Chain early calls so they still reach the desktop in order
+                previous = self._dispatched_calls[last_dispatched] if last_dispatched in self._dispatched_calls else None
+                self._dispatched_calls[dispatch.call_id] = asyncio.create_task(self._run_after(previous, dispatch.action))
+                last_dispatched = dispatch.call_id
+            if completed is not None:
+                response = completed
+        if response is None:
+            raise RuntimeError("Response stream ended before the response was completed.")
+        return response
+
+    async def _execute_and_continue_call(self, input, computer_call, safety_checks, custom_tools=None, function_map=None, stop_event=None):
+        """
+        Directly executes a 'computer_call' after user acknowledged safety checks, then
+        sends the screenshot with 'acknowledged_safety_checks' in the computer_call_output.
+        """
+        if self.desktop is None:
+            raise ValueError("No desktop has been set for this agent.")
+
+        # Actually execute the call, and any other computer calls of the same response, in order
+        call_outputs = []
+        for call in self._calls_to_execute(input, computer_call):
+            # Run the action, let the screen settle and take a screenshot in one round trip
+            screenshot_bytes = await self._computer_call_result(call)
+            # Each call acknowledges only its own safety checks
+            call_outputs.append(self._computer_call_output(call, screenshot_bytes, getattr(call, "pending_safety_checks", None)))
+        await asyncio.to_thread(self._save_screenshot, screenshot_bytes)
+
+        new_response = await self._create_response(
+            input_data=call_outputs,
+            previous_response_id=input.id,
+            custom_tools=custom_tools,
+            stop_event=stop_event,
+        )
+
+        # Add to response history
+        self._record_response(new_response)
+
+
+async def _call_handler(handler, *args):
+    """Call a status handler that may be a plain function or a coroutine function."""
+    result = handler(*args)
+    if asyncio.iscoroutine(result):
+        result = await result
+    return result
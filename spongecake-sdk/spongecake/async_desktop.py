@@ -0,0 +1,424 @@
+import asyncio
+import base64
+import logging
+import uuid
+
+import httpx
+
+from .desktop import Desktop
+from .async_agent import AsyncAgent
+from .marionette import MarionetteUnavailable, GOTO_TIMEOUT
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+################################
+# AsyncDesktop Class           #
+################################
+class AsyncDesktop(Desktop):
+    """
+    Asyncio counterpart of Desktop.
+
+    Takes the same arguments as Desktop. Desktop actions (click, scroll, keypress, type_text,
+    get_screenshot, goto, wait) and action() are coroutines that talk to the container API
+    through a pooled httpx.AsyncClient, so one event loop can drive many desktops at once.
+    Container lifecycle calls (start, stop) run the blocking Docker client in a worker thread.
+
+    Example:
+        desktop = AsyncDesktop(name="async_desktop")
+        await desktop.start()
+        status, data = await desktop.action(input_text="...")
+        await desktop.stop()
+    """
+
+    # Agent class created by get_agent() and when create_agent=True
+    agent_class = AsyncAgent
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._http_client = None
+
+    # -------------------------
+    # Container lifecycle
+    # -------------------------
+
+    async def start(self):
+        """Starts the container if it's not already running (see Desktop.start)."""
+        return await asyncio.to_thread(super().start)
+
+    async def wait_until_ready(self, timeout: float = 60.0, require=None) -> dict:
+        """Poll the container API's /ready endpoint until the desktop is ready (see Desktop.wait_until_ready)."""
+        return await asyncio.to_thread(self._wait_until_ready, timeout, require)
+
+    async def stop(self):
+        """Stops and removes the container, and closes the HTTP client."""
+        await asyncio.to_thread(super().stop)
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the pooled HTTP client. A new one is created on the next request."""
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        """Return the pooled keep-alive client used to talk to the container API."""
+        if self._http_client is None or self._http_client.is_closed:
+            # httpx only retries failed connection attempts, so actions are never sent twice
+            transport = httpx.AsyncHTTPTransport(retries=self.http_retries)
+            limits = httpx.Limits(max_connections=self.http_pool_size, max_keepalive_connections=self.http_pool_size)
+            self._http_client = httpx.AsyncClient(transport=transport, limits=limits, timeout=self._httpx_timeout(self.http_timeout))
+        return self._http_client
+
+    def _httpx_timeout(self, timeout) -> httpx.Timeout:
+        """Convert a float or (connect, read) tuple timeout into an httpx.Timeout."""
+        if isinstance(timeout, tuple):
+            connect_timeout, read_timeout = timeout
+            return httpx.Timeout(read_timeout, connect=connect_timeout)
+        return httpx.Timeout(timeout)
+
+    async def _call_api_with_fallback(self, endpoint, method="post", json_data=None, fallback_cmd=None, timeout=None):
+        """
+        Call the API endpoint with fallback to exec if the API server can't be reached
+        (see Desktop._call_api_with_fallback). The exec fallback runs the blocking Docker
+        client in a worker thread.
+        """
+        url = f"{self.api_base_url}{endpoint}"
+        logger.debug(f"Calling API: {url} with data: {json_data}")
+        if method.lower() not in ("post", "get"):
+            raise ValueError(f"Unsupported HTTP method: {method}")
+        request_timeout = self._httpx_timeout(timeout or self.http_timeout)
+
+        try:
+            client = self._get_http_client()
+            if method.lower() == "post":
+                response = await client.post(url, json=json_data, timeout=request_timeout)
+            else:
+                response = await client.get(url, timeout=request_timeout)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            # The request never reached the server, so the action can safely be run another way
+            logger.warning(f"API server unreachable: {str(e)}")
+            # Only try fallback if we have a local container
+            if fallback_cmd and self.docker_client is not None and self.container_started:
+                logger.warning("Falling back to exec command")
+                return await asyncio.to_thread(self.exec, fallback_cmd)
+            raise RuntimeError(f"API call failed and fallback not available: {str(e)}")
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"API call failed: {str(e)}")
+
+        try:
+            response.raise_for_status()  # Raise exception for HTTP errors
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            raise RuntimeError(f"API call failed: {str(e)}: {response.text}")
+
+    # -------------------------
+    # DESKTOP ACTIONS
+    # -------------------------
+
+    async def click(self, x: int, y: int, click_type: str = "left"):
+        """Move the mouse to (x, y) and click the specified button."""
+        if self.environment == "mac":
+            return await asyncio.to_thread(super().click, x, y, click_type)
+
+        logger.info(f"Action: click at ({x}, {y}) with button '{click_type}'")
+        self.tracer.add_entry("click", x=x, y=y, button=click_type)
+        json_data, fallback_cmd = self._click_request(x, y, click_type)
+        return await self._call_api_with_fallback("/action", json_data=json_data, fallback_cmd=fallback_cmd)
+
+    async def scroll(self, x: int, y: int, scroll_x: int = 0, scroll_y: int = 0):
+        """Move to (x, y) and scroll horizontally (scroll_x) or vertically (scroll_y)."""
+        if self.environment == "mac":
+            return await asyncio.to_thread(super().scroll, x, y, scroll_x, scroll_y)
+
+        logger.info(f"Action: scroll at ({x}, {y}) with offsets (scroll_x={scroll_x}, scroll_y={scroll_y})")
+        self.tracer.add_entry("scroll", x=x, y=y, scroll_x=scroll_x, scroll_y=scroll_y)
+        json_data, fallback_cmd = self._scroll_request(x, y, scroll_x, scroll_y)
+        return await self._call_api_with_fallback("/action", json_data=json_data, fallback_cmd=fallback_cmd)
+
+    async def keypress(self, keys: list[str]):
+        """Press (and possibly hold) keys in sequence, e.g. keys=["CTRL","F"] -> Ctrl+F."""
+        if self.environment == "mac":
+            return await asyncio.to_thread(super().keypress, keys)
+
+        logger.info(f"Action: keypress with keys: {keys}")
+        self.tracer.add_entry("keypress", keys=keys)
+        json_data, fallback_cmd = self._keypress_request(keys)
+        return await self._call_api_with_fallback("/action", json_data=json_data, fallback_cmd=fallback_cmd)
+
+    async def type_text(self, text: str):
+        """Type a string of text at the current cursor location."""
+        if self.environment == "mac":
+            return await asyncio.to_thread(super().type_text, text)
+
+        logger.info(f"Action: type text: {text}")
+        self.tracer.add_entry("type", text=text)
+        json_data, fallback_cmd = self._type_request(text)
+        return await self._call_api_with_fallback("/action", json_data=json_data, fallback_cmd=fallback_cmd)
+
+    async def get_screenshot(self):
+        """Takes a screenshot of the current desktop and returns it as a base64-encoded PNG string."""
+        if self.environment == "mac":
+            return await asyncio.to_thread(super().get_screenshot)
+
+        logger.info("Action: take screenshot")
+        json_data, fallback_cmd = self._screenshot_request()
+        response = await self._call_api_with_fallback("/action", json_data=json_data, fallback_cmd=fallback_cmd)
+        return self._extract_screenshot(response)
+
+    async def get_screenshot_bytes(self, fmt: str = "png") -> bytes:
+        """Takes a screenshot of the current desktop and returns the raw image bytes (see Desktop.get_screenshot_bytes)."""
+        if self.environment == "mac":
+            return await asyncio.to_thread(super().get_screenshot_bytes, fmt)
+
+        logger.info("Action: take screenshot")
+        try:
+            response = await self._get_http_client().get(f"{self.api_base_url}/screenshot.{fmt}")
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            if fmt != "png":
+                raise RuntimeError(f"Screenshot as {fmt} failed: {str(e)}")
+            # Older images only serve base64 screenshots; get_screenshot() also falls back to exec
+            logger.warning(f"Binary screenshot failed, falling back to base64 screenshot: {str(e)}")
+            return base64.b64decode(await self.get_screenshot())
+
+        screenshot_bytes = response.content
+        if self.tracer.config.trace_screenshots:
+            self._trace_screenshot(base64.b64encode(screenshot_bytes).decode("ascii"), response.headers.get("Content-Type", "image/png"))
+        return screenshot_bytes
+
+    async def goto(self, url: str, wait_until: str = "load", timeout: float = GOTO_TIMEOUT):
+        """Navigate the current Firefox tab to the specified URL and wait for it to load (see Desktop.goto)."""
+        if self.environment == "mac":
+            return await asyncio.to_thread(super().goto, url)
+
+        logger.info(f"Action: goto URL: {url}")
+        self.tracer.add_entry("goto", url=url)
+        try:
+            result = await asyncio.to_thread(self.get_marionette().navigate, url, wait_until, timeout)
+            await asyncio.to_thread(self._enforce_tab_limit)
+            return result
+        except MarionetteUnavailable as e:
+            # Nothing was sent, so navigating over the API can't load the page twice
+            logger.warning(f"Marionette navigation failed, falling back to the API: {str(e)}")
+
+        json_data, fallback_cmd = self._goto_request(url, wait_until, timeout)
+        result = await self._call_api_with_fallback("/action", json_data=json_data, fallback_cmd=fallback_cmd, timeout=self._extended_timeout(timeout))
+        await asyncio.to_thread(self._enforce_tab_limit)
+        return result
+
+    async def wait(self, seconds: float = 2.0):
+        """Wait for the specified number of seconds."""
+        logger.info(f"Action: wait for {seconds} seconds")
+        self.tracer.add_entry("wait", seconds=seconds)
+
+        if self.environment == "mac":
+            await asyncio.sleep(seconds)
+            return
+
+        json_data, fallback_cmd = self._wait_request(seconds)
+        # The server sleeps before replying, so allow for that
+        return await self._call_api_with_fallback("/action", json_data=json_data, fallback_cmd=fallback_cmd, timeout=self._extended_timeout(seconds))
+
+    async def settle(self, quiet_period=None, timeout=None):
+        """Wait until the screen has stopped changing (see Desktop.settle)."""
+        quiet_period = self.settle_quiet_period if quiet_period is None else quiet_period
+        timeout = self.settle_timeout if timeout is None else timeout
+
+        if self.environment == "mac":
+            await asyncio.sleep(min(quiet_period, timeout))
+            return {"settled": True, "elapsed": min(quiet_period, timeout)}
+
+        try:
+            response = await self._get_http_client().post(
+                f"{self.api_base_url}/settle",
+                json=self._settle_request(quiet_period, timeout),
+                timeout=self._httpx_timeout(self._extended_timeout(timeout))
+            )
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            # Older images don't have /settle, so wait a fixed amount instead
+            fallback = min(1.0, timeout)
+            logger.warning(f"Settle failed, waiting {fallback} seconds instead: {str(e)}")
+            await asyncio.sleep(fallback)
+            return {"settled": False, "elapsed": fallback}
+
+    async def perform_action(self, action: dict):
+        """Run one action given as an API action dict (see Desktop.perform_action)."""
+        action_type = action.get("type")
+        if action_type == "click":
+            return await self.click(action["x"], action["y"], action.get("button") or "left")
+        elif action_type == "scroll":
+            return await self.scroll(action["x"], action["y"], action.get("scroll_x") or 0, action.get("scroll_y") or 0)
+        elif action_type == "keypress":
+            return await self.keypress(action["keys"])
+        elif action_type == "type":
+            return await self.type_text(action["text"])
+        elif action_type == "wait":
+            return await self.wait(action.get("seconds") or 2.0)
+        elif action_type == "goto":
+            return await self.goto(action["url"], action.get("wait_until") or "load", action.get("timeout") or GOTO_TIMEOUT)
+        elif action_type == "settle":
+            return await self.settle(action.get("quiet_period"), action.get("timeout"))
+        elif action_type == "screenshot":
+            return await self.get_screenshot()
+        raise ValueError(f"Unknown action type: {action_type}")
+
+    async def step(self, action=None, settle=True, quiet_period=None, timeout=None, fmt="png") -> bytes:
+        """Run an action, settle and return the following screenshot in one round trip (see Desktop.step)."""
+        screenshot_bytes = await self._step(action, settle, quiet_period, timeout, fmt)
+        if self._may_open_tabs([action]):
+            await asyncio.to_thread(self._enforce_tab_limit)
+        return screenshot_bytes
+
+    async def _step(self, action, settle, quiet_period, timeout, fmt):
+        quiet_period = self.settle_quiet_period if quiet_period is None else quiet_period
+        timeout = self.settle_timeout if timeout is None else timeout
+
+        # Older images don't have /step, so run the three parts separately
+        if self.environment == "mac" or "/step" in self._missing_endpoints:
+            return await self._step_separately(action, settle, quiet_period, timeout, fmt)
+
+        logger.info(f"Action: step {action}")
+        try:
+            response = await self._get_http_client().post(
+                f"{self.api_base_url}/step",
+                json=self._step_request(action, settle, quiet_period, timeout, fmt),
+                timeout=self._httpx_timeout(self._step_timeout(action, settle, timeout))
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            # The request never reached the server, so the action can safely be run again
+            logger.warning(f"Step failed, running action and screenshot separately: {str(e)}")
+            return await self._step_separately(action, settle, quiet_period, timeout, fmt)
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"Step failed: {str(e)}")
+
+        if response.status_code in (404, 405):
+            logger.warning("Container API has no /step endpoint, running action and screenshot separately")
+            self._missing_endpoints.add("/step")
+            return await self._step_separately(action, settle, quiet_period, timeout, fmt)
+        try:
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"Step failed: {str(e)}: {response.text}")
+
+        return self._step_result(action, response.content, response.headers)
+
+    async def _step_separately(self, action, settle, quiet_period, timeout, fmt):
+        """Run a step as separate action, settle and screenshot calls."""
+        if action is not None:
+            await self.perform_action(action)
+        if settle:
+            await self.settle(quiet_period, timeout)
+        return await self.get_screenshot_bytes(fmt)
+
+    async def run_actions(self, actions: list[dict], delay: float = 0.0, stop_on_error: bool = True) -> dict:
+        """Run an ordered list of actions in a single request (see Desktop.run_actions)."""
+        result = await self._run_actions(actions, delay, stop_on_error)
+        if self._may_open_tabs(actions):
+            await asyncio.to_thread(self._enforce_tab_limit)
+        return result
+
+    async def _run_actions(self, actions, delay, stop_on_error):
+        logger.info(f"Action: run {len(actions)} actions")
+
+        # Older images don't have /actions, so run the actions one by one
+        if self.environment == "mac" or "/actions" in self._missing_endpoints:
+            return await self._run_actions_separately(actions, delay, stop_on_error)
+
+        try:
+            response = await self._get_http_client().post(
+                f"{self.api_base_url}/actions",
+                json={"actions": actions, "delay": delay, "stop_on_error": stop_on_error},
+                timeout=self._httpx_timeout(self._actions_timeout(actions, delay))
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            # The request never reached the server, so the actions can safely be run again
+            logger.warning(f"Batched actions failed, running them one by one: {str(e)}")
+            return await self._run_actions_separately(actions, delay, stop_on_error)
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"Batched actions failed: {str(e)}")
+
+        if response.status_code in (404, 405):
+            logger.warning("Container API has no /actions endpoint, running actions one by one")
+            self._missing_endpoints.add("/actions")
+            return await self._run_actions_separately(actions, delay, stop_on_error)
+        try:
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"Batched actions failed: {str(e)}: {response.text}")
+
+        return self._actions_result(actions, response.json())
+
+    async def _run_actions_separately(self, actions, delay, stop_on_error):
+        """Run a batch as one perform_action() call per action, with the same result as /actions."""
+        results = []
+        for index, action in enumerate(actions):
+            try:
+                result = await self.perform_action(action)
+                results.append({"index": index, **(result if isinstance(result, dict) else {"status": "success"})})
+            except Exception as e:
+                logger.error(f"Batch action {index} ({action.get('type')}) failed: {str(e)}")
+                results.append({"index": index, "status": "error", "action": action.get("type"), "error": str(e)})
+                if stop_on_error:
+                    break
+                continue
+
+            action_delay = action.get("delay", delay)
+            if action_delay and index < len(actions) - 1:
+                await asyncio.sleep(action_delay)
+        return self._batch_summary(results, len(actions))
+
+    # -------------------------
+    # Agent Integration
+    # -------------------------
+
+    async def get_page_html(self, query="return document.documentElement.outerHTML;"):
+        """Get the HTML content of the currently displayed webpage using Marionette."""
+        return await self.get_agent().get_page_html(query)
+
+    async def list_tabs(self):
+        """List the open Firefox tabs, oldest first (see Desktop.list_tabs)."""
+        return await asyncio.to_thread(super().list_tabs)
+
+    async def switch_tab(self, tab):
+        """Bring a tab to the front (see Desktop.switch_tab)."""
+        return await asyncio.to_thread(super().switch_tab, tab)
+
+    async def close_tabs(self, keep=None):
+        """Close every tab except the ones in keep (see Desktop.close_tabs)."""
+        return await asyncio.to_thread(super().close_tabs, keep)
+
+    async def reset_browser(self, url: str = "about:blank", clear_data: bool = True):
+        """Put the browser back into a clean state without restarting it (see Desktop.reset_browser)."""
+        return await asyncio.to_thread(self._reset_browser, url, clear_data)
+
+    async def execute_script(self, script: str, args=None):
+        """Run JavaScript in the current browser tab over the desktop's Marionette session."""
+        return await asyncio.to_thread(super().execute_script, script, args)
+
+    async def action(self, input_text=None, acknowledged_safety_checks=False, ignore_safety_and_input=False,
+                     complete_handler=None, needs_input_handler=None, needs_safety_check_handler=None, error_handler=None,
+                     tools=None, function_map=None, stop_event=None):
+        """
+        Execute an action in the desktop environment by delegating to the AsyncAgent.
+        Same arguments and return value as Desktop.action(); handlers may be coroutine functions.
+        """
+        self.tracer.start(str(uuid.uuid4()))
+        try:
+            agent = self.get_agent()
+            return await agent.action(
+                input_text=input_text,
+                acknowledged_safety_checks=acknowledged_safety_checks,
+                ignore_safety_and_input=ignore_safety_and_input,
+                complete_handler=complete_handler,
+                needs_input_handler=needs_input_handler,
+                needs_safety_check_handler=needs_safety_check_handler,
+                error_handler=error_handler,
+                tools=tools,
+                function_map=function_map,
+                stop_event=stop_event
+            )
+        finally:
+            self.tracer.stop()
@@ -1,12 +1,10 @@
 import docker
 from docker.errors import NotFound, ImageNotFound, APIError
 import requests
-import socket
 import time
 import base64
 import logging
 import warnings
-import socket
 import time
 import docker
 from docker.errors import NotFound, APIError, ImageNotFound
@@ -25,10 +23,17 @@ logger = logging.getLogger(__name__)
 
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import NewConnectionError
 import subprocess  # Import subprocess module
+import sqlite3
 
 from . import _exceptions
 from .agent import Agent
+from .marionette import MarionetteSession, MarionetteUnavailable, GOTO_TIMEOUT
+from .images import ensure_image, PULL_POLICIES, REFRESH_INTERVAL
+from .ports import port_registry, port_available, PORT_MODES
 
 # -------------------------
 # Container Management Functions
@@ -38,6 +43,9 @@ from .agent import Agent
 # Thread-Safe Port Allocation  #
 ################################
 
+# Ports are normally leased from the host-wide registry in ports.py. The lock and counters
+# below are the in-process fallback used when the registry can't be opened.
+
 # A single global lock ensures that only one thread at a time allocates ports.
 port_allocation_lock = threading.Lock()
 
@@ -52,6 +60,29 @@ GLOBAL_PORT_COUNTER = {
     "websocket": 6081   # Next candidate if 6080 is busy
 }
 
+# Hardcoded container ports (inside the container).
+CONTAINER_VNC_PORT = 5900
+CONTAINER_API_PORT = 8000
+CONTAINER_MARIONETTE_PORT = 3838
+CONTAINER_SOCAT_PORT = 2828
+CONTAINER_WEBSOCKET_PORT = 6080
+
+# Action types that can open browser tabs (links, popups, keyboard shortcuts), after which
+# step() and run_actions() enforce max_tabs
+TAB_OPENING_ACTIONS = ("click", "double_click", "keypress", "goto")
+
+def _request_never_sent(error: requests.RequestException) -> bool:
+    """
+    Whether a failed request certainly never reached the container API, so sending it again
+    can't run its actions twice. requests.ConnectionError alone doesn't tell: it also wraps
+    connections dropped after the request body was sent.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # Connection refused and the like: urllib3's MaxRetryError with a NewConnectionError reason
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
 ################################
 # Desktop Class                #
 ################################
@@ -65,13 +96,20 @@ class Desktop:
     Port handling:
     - Container ports are fixed at 5900 for VNC and 8000 for API
     - Local ports start at the specified values (default: 5900 for VNC, 8000 for API)
-    - If a port conflict is detected during container startup, the system will
-      automatically increment the port number and retry until an available port is found
-    - This reactive approach handles concurrent situations where a port becomes
-      unavailable between the initial check and the actual container startup
+    - Host ports are leased from a registry shared by every process on the host; if the
+      requested ports are taken, a free block of ports is leased instead
+    - If a port conflict is still detected during container startup, new ports are
+      leased and the container is retried
+    - With port_mode="ephemeral", Docker picks the host ports and they are read back
+      from the container after it starts
+    - With port_mode="direct", no host ports are published; the container is reached on
+      its bridge-network IP and fixed container ports
     """
 
-    def __init__(self, name: str = "newdesktop", isLocal: bool = False, docker_image: str = "spongebox/spongecake:latest", vnc_port: int = 5900, api_port: int = None, marionette_port: int = 3838, socat_port: int = 2828, websocket_port: int = 6080, host: str = None, openai_api_key: str = None, create_agent: bool = True, trace_config: Optional[TraceConfig] = None):
+    # Agent class created by get_agent() and when create_agent=True
+    agent_class = Agent
+
+    def __init__(self, name: str = "newdesktop", isLocal: bool = False, docker_image: str = "spongebox/spongecake:latest", vnc_port: int = 5900, api_port: int = None, marionette_port: int = 3838, socat_port: int = 2828, websocket_port: int = 6080, host: str = None, openai_api_key: str = None, create_agent: bool = True, trace_config: Optional[TraceConfig] = None, http_pool_size: int = 10, http_timeout: float = 10, http_retries: int = 2, settle_quiet_period: float = 0.3, settle_timeout: float = 3.0, max_tabs: Optional[int] = 10, ready_timeout: float = 60.0, pull_policy: str = "background-refresh", refresh_interval: float = REFRESH_INTERVAL, port_mode: str = "lease", shm_size: Optional[str] = "512m"):
         """
         Initialize a new Desktop instance.
         
@@ -85,6 +123,20 @@ class Desktop:
             host: Hostname or IP address to connect to the API (default: localhost). Set host='local' to not use a container and use an agent on your local machine (only MacOS supported currently)
             openai_api_key: OpenAI API key for agent functionality
             create_agent: Whether to create an agent instance automatically
+            http_pool_size: Maximum number of keep-alive connections kept open to the container API
+            http_timeout: Timeout in seconds for API requests (a float, or a (connect, read) tuple)
+            http_retries: Number of times to retry an API request that failed to connect
+            settle_quiet_period: Seconds the screen must stay unchanged for settle() to return
+            settle_timeout: Maximum seconds settle() waits for the screen to stop changing
+            max_tabs: Most browser tabs to keep open; goto(), step() and run_actions() close the oldest ones beyond it (None for no limit)
+            ready_timeout: Maximum seconds start() waits for the desktop to report ready
+            pull_policy: When start() pulls docker_image: "always", "if-not-present", "never" or "background-refresh"
+            refresh_interval: Minimum seconds between registry checks with "background-refresh"
+            port_mode: How the container is reached: "lease" (host ports from a host-wide lease registry,
+                       safe across processes), "ephemeral" (Docker picks free host ports) or "direct"
+                       (the container's bridge-network IP on its own ports; nothing is published)
+            shm_size: Size of the container's /dev/shm, which holds the Firefox profile and Firefox's shared
+                      memory (None for Docker's 64MB default)
         """
         # Set container info
         self.container_name = name  # Set container name for use in methods
@@ -99,6 +151,19 @@ class Desktop:
         self.websocket_port = websocket_port
         self.host = host
         self.container_started = False
+        self.settle_quiet_period = settle_quiet_period
+        self.settle_timeout = settle_timeout
+        self.max_tabs = max_tabs
+        self.ready_timeout = ready_timeout
+        if pull_policy not in PULL_POLICIES:
+            raise ValueError(f"pull_policy must be one of {', '.join(PULL_POLICIES)}")
+        self.pull_policy = pull_policy
+        self.refresh_interval = refresh_interval
+        if port_mode not in PORT_MODES:
+            raise ValueError(f"port_mode must be one of {', '.join(PORT_MODES)}")
+        self.port_mode = port_mode
+        self.shm_size = shm_size
+        self.container_ip = None  # Bridge-network IP of the container, used with port_mode="direct"
         self.tracer = Tracer(trace_config)
         self.isLocal = isLocal
 
@@ -132,6 +197,15 @@ class Desktop:
         # API base URL will be set based on host and ports
         self._update_api_base_url()
 
+        # Keep-alive HTTP session shared by all actions on this desktop
+        self.http_pool_size = http_pool_size
+        self.http_timeout = http_timeout
+        self.http_retries = http_retries
+        self.http_session = self._create_http_session(http_pool_size, http_retries)
+        self._missing_endpoints = set()  # Container API endpoints that older images don't have
+        self._marionette = None  # Persistent Marionette session, created on first use
+        self._marionette_lock = threading.Lock()
+
         # Create a Docker client from environment if we're not using a remote host
         self.docker_client = docker.from_env() if host is None else None
 
@@ -148,7 +222,7 @@ class Desktop:
         # Initialize agent if requested
         self._agent = None
         if create_agent:
-            self._agent = Agent(desktop=self, openai_api_key=openai_api_key)
+            self._agent = self.agent_class(desktop=self, openai_api_key=openai_api_key)
 
     def _update_api_base_url(self):
         # Update the base URL used for API calls.
@@ -156,14 +230,35 @@ class Desktop:
             self.api_base_url = f"http://{self.host}:{self.api_port}"
             self.container_started = True
         else:
-            # local containers are on localhost
-            self.api_base_url = f"http://localhost:{self.api_port}"
+            # local containers are on localhost, or on their bridge IP with port_mode="direct"
+            self.api_base_url = f"http://{self.container_ip or 'localhost'}:{self.api_port}"
+
+    def _create_http_session(self, pool_size: int, retries: int) -> requests.Session:
+        """
+        Build the pooled keep-alive session used to talk to the container API.
+        Only failed connection attempts are retried, so actions are never sent twice.
+        """
+        retry = Retry(total=retries, connect=retries, read=0, status=0, backoff_factor=0.1)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _extended_timeout(self, extra: float):
+        """Return http_timeout with `extra` seconds added to the read timeout."""
+        if isinstance(self.http_timeout, tuple):
+            connect_timeout, read_timeout = self.http_timeout
+            return (connect_timeout, read_timeout + extra)
+        return self.http_timeout + extra
 
     def start(self):
         """
         Starts the container if it's not already running.
-        - Uses auto-incrementing ports in a thread-safe way.
-        - If a container with the same name is found, we just start it (no new port mapping).
+        - Picks host ports according to port_mode: "lease" leases them from the host-wide
+          registry in ports.py, "ephemeral" lets Docker assign them, and "direct" publishes none.
+        - If a container with the same name is found, we just start it (no new port mapping)
+          and pick up the ports or IP address it already has.
         """
         if not self.docker_client:
             logger.warning("Docker client not available. Cannot start container.")
@@ -175,44 +270,48 @@ class Desktop:
             logger.info(f"Container '{self.container_name}' found, status: {container.status}.")
 
             # If it's not running, start it.
-            if container.status != "running":
+            restarted = container.status != "running"
+            if restarted:
                 logger.info(f"Container '{self.container_name}' is not running. Starting...")
                 container.start()
             else:
                 logger.info(f"Container '{self.container_name}' is already running.")
 
+            # Actions go through the mapped API port, so pick up the ports this container was created with.
+            if self.port_mode == "direct":
+                self._sync_container_ip(container)
+            else:
+                self._sync_ports_from_container(container)
+
             # Mark container as started.
             self.container_started = True
+            if restarted:
+                self._wait_after_start()
             return container
 
         except NotFound:
             # Container does not exist; we'll create it.
             pass
 
-        # Hardcoded container ports (inside the container).
-        CONTAINER_VNC_PORT = 5900
-        CONTAINER_API_PORT = 8000
-        CONTAINER_MARIONETTE_PORT = 3838
-        CONTAINER_SOCAT_PORT = 2828
-        CONTAINER_WEBSOCKET_PORT = 6080
-
-        # 1) Allocate all required ports in a single pass while holding a global lock.
-        self._allocate_all_ports_threadsafe()
-
-        logger.info(
-            f"Creating new container '{self.container_name}' "
-            f"with host ports: VNC={self.vnc_port}, API={self.api_port}, "
-            f"Marionette={self.marionette_port}, Socat={self.socat_port}"
-        )
+        # 1) Lease all required host ports in a single atomic step (Docker picks them in ephemeral mode).
+        if self.port_mode == "ephemeral":
+            logger.info(f"Creating new container '{self.container_name}' with Docker-assigned host ports")
+        elif self.port_mode == "direct":
+            logger.info(f"Creating new container '{self.container_name}' without published ports")
+        else:
+            self._allocate_all_ports_threadsafe()
+            logger.info(
+                f"Creating new container '{self.container_name}' "
+                f"with host ports: VNC={self.vnc_port}, API={self.api_port}, "
+                f"Marionette={self.marionette_port}, Socat={self.socat_port}"
+            )
 
-        # 2) Pull the image (best effort) to make sure we have the latest.
-        try:
-            self.docker_client.images.pull(self.docker_image)
-        except APIError:
-            logger.warning(f"Failed to pull image {self.docker_image}, attempting to run anyway...")
+        # 2) Make sure the image is available, pulling it as the pull policy says.
+        ensure_image(self.docker_client, self.docker_image, self.pull_policy, self.refresh_interval)
 
         # 3) Attempt to create the container. We'll do a few retries for rare collisions.
-        #    Because we hold a lock to choose ports, collisions should be unlikely.
+        #    Leased ports are reserved across processes and Docker-assigned or unpublished ports
+        #    can't clash, so this mostly covers ports taken by something outside the registry.
         max_retries = 10
         container = None
         for attempt in range(max_retries):
@@ -221,13 +320,8 @@ class Desktop:
                     self.docker_image,
                     detach=True,
                     name=self.container_name,
-                    ports={
-                        f"{CONTAINER_VNC_PORT}/tcp": self.vnc_port,
-                        f"{CONTAINER_API_PORT}/tcp": self.api_port,
-                        f"{CONTAINER_MARIONETTE_PORT}/tcp": self.marionette_port,
-                        f"{CONTAINER_SOCAT_PORT}/tcp": self.socat_port,
-                        f"{CONTAINER_WEBSOCKET_PORT}/tcp": self.websocket_port,
-                    },
+                    ports=self._port_bindings(),
+                    shm_size=self.shm_size,
                 )
                 break
             except APIError as e:
@@ -243,7 +337,8 @@ class Desktop:
                         partial_container.remove(force=True)
                     except NotFound:
                         pass
-                    self._allocate_all_ports_threadsafe()
+                    if self.port_mode == "lease":
+                        self._allocate_all_ports_threadsafe(avoid=self._host_ports())
                 else:
                     # Some other error, re-raise.
                     raise
@@ -254,15 +349,169 @@ class Desktop:
             )
 
         # 4) Container started successfully.
+        if self.port_mode == "ephemeral":
+            # Read back the host ports Docker assigned
+            self._sync_ports_from_container(container)
+        elif self.port_mode == "direct":
+            self._sync_container_ip(container)
         self._update_api_base_url()
         self.container_started = True
         logger.info(f"Container '{self.container_name}' started successfully!")
 
-        # Allow the container a moment to boot up.
-        time.sleep(2)
+        # Wait for the desktop inside the container to boot.
+        self._wait_after_start()
         return container
 
-    def _allocate_all_ports_threadsafe(self):
+    def _wait_after_start(self):
+        """Wait for a freshly started container; a desktop that is slow to come up is logged, not fatal."""
+        try:
+            self._wait_until_ready(self.ready_timeout)
+        except _exceptions.DesktopNotReady as e:
+            logger.warning(str(e))
+
+    def wait_until_ready(self, timeout: float = 60.0, require: Optional[list] = None) -> dict:
+        """
+        Poll the container API's /ready endpoint, with backoff, until the desktop is ready.
+
+        Args:
+            timeout: Maximum seconds to wait
+            require: Names of the checks that must pass (display, window_manager, vnc, api,
+                     marionette, browser_window). Defaults to all of them.
+
+        Returns:
+            dict: The last reported checks, e.g. {"display": True, "vnc": True, ...}
+
+        Raises:
+            DesktopNotReady: If the required checks don't all pass within timeout.
+        """
+        return self._wait_until_ready(timeout, require)
+
+    def _wait_until_ready(self, timeout: float, require: Optional[list] = None) -> dict:
+        deadline = time.monotonic() + timeout
+        interval = 0.05
+        checks = {}
+        while True:
+            checks = self._readiness_checks()
+            # Images without /ready can't report any other check, so an answering API meets every requirement
+            legacy = "/ready" in self._missing_endpoints
+            if checks is not None and (legacy or all(checks.get(name, False) for name in (require or checks))):
+                logger.info(f"Desktop '{self.container_name}' is ready")
+                return checks
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                not_ready = [name for name, ok in (checks or {}).items() if not ok] or ["api"]
+                raise _exceptions.DesktopNotReady(
+                    f"Desktop '{self.container_name}' not ready after {timeout}s, waiting on: {', '.join(not_ready)}"
+                )
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 1.5, 1.0)
+
+    def _readiness_checks(self) -> Optional[dict]:
+        """Return the container's readiness checks, or None if the API isn't answering yet."""
+        try:
+            response = self.http_session.get(f"{self.api_base_url}/ready", timeout=self.http_timeout)
+        except requests.RequestException:
+            return None
+        if response.status_code == 404:
+            # Older images have no /ready; the API answering is the best signal they give
+            self._missing_endpoints.add("/ready")
+            return {"api": True}
+        try:
+            return response.json().get("checks")
+        except ValueError:
+            return None
+
+    def _sync_ports_from_container(self, container):
+        """
+        Read the host ports an existing container publishes and update our ports to match.
+        Ports that aren't published keep their current value.
+        """
+        try:
+            container.reload()
+            port_bindings = container.attrs.get("NetworkSettings", {}).get("Ports") or {}
+        except APIError as e:
+            logger.warning(f"Could not inspect ports of container '{self.container_name}': {str(e)}")
+            return
+
+        def host_port(container_port):
+            bindings = port_bindings.get(f"{container_port}/tcp")
+            if bindings:
+                return int(bindings[0]["HostPort"])
+            return None
+
+        self.vnc_port = host_port(CONTAINER_VNC_PORT) or self.vnc_port
+        self.api_port = host_port(CONTAINER_API_PORT) or self.api_port
+        self.marionette_port = host_port(CONTAINER_MARIONETTE_PORT) or self.marionette_port
+        self.socat_port = host_port(CONTAINER_SOCAT_PORT) or self.socat_port
+        self.websocket_port = host_port(CONTAINER_WEBSOCKET_PORT) or self.websocket_port
+        self._update_api_base_url()
+
+    def _sync_container_ip(self, container):
+        """
+        Reach the container on its bridge-network IP and its own ports (port_mode="direct"),
+        skipping docker's port publishing proxy. The host must be able to route to the
+        bridge network, which is the case on Linux but not with Docker Desktop.
+        """
+        container.reload()
+        settings = container.attrs.get("NetworkSettings", {})
+        ip = settings.get("IPAddress") or next(
+            (network.get("IPAddress") for network in (settings.get("Networks") or {}).values() if network.get("IPAddress")), None
+        )
+        if not ip:
+            raise RuntimeError(f"Container '{self.container_name}' has no bridge network IP address, which port_mode='direct' needs.")
+
+        self.container_ip = ip
+        self.vnc_port = CONTAINER_VNC_PORT
+        self.api_port = CONTAINER_API_PORT
+        self.marionette_port = CONTAINER_MARIONETTE_PORT
+        self.socat_port = CONTAINER_SOCAT_PORT
+        self.websocket_port = CONTAINER_WEBSOCKET_PORT
+        logger.info(f"Reaching container '{self.container_name}' directly at {ip}")
+        self._update_api_base_url()
+
+    def _port_bindings(self) -> dict:
+        """Host port for each published container port. None lets Docker pick a free one."""
+        if self.port_mode == "direct":
+            return {}
+        ephemeral = self.port_mode == "ephemeral"
+        return {
+            f"{CONTAINER_VNC_PORT}/tcp": None if ephemeral else self.vnc_port,
+            f"{CONTAINER_API_PORT}/tcp": None if ephemeral else self.api_port,
+            f"{CONTAINER_MARIONETTE_PORT}/tcp": None if ephemeral else self.marionette_port,
+            f"{CONTAINER_SOCAT_PORT}/tcp": None if ephemeral else self.socat_port,
+            f"{CONTAINER_WEBSOCKET_PORT}/tcp": None if ephemeral else self.websocket_port,
+        }
+
+    def _host_ports(self) -> dict:
+        return {
+            "vnc": self.vnc_port,
+            "api": self.api_port,
+            "marionette": self.marionette_port,
+            "socat": self.socat_port,
+            "websocket": self.websocket_port,
+        }
+
+    def _allocate_all_ports_threadsafe(self, avoid: Optional[dict] = None):
+        """
+        Lease host ports for vnc, api, marionette, socat and websocket from the host-wide
+        port registry, so no two desktops get the same port, even in different processes.
+        The current ports are tried first; avoid holds ports that just failed. If the
+        registry can't be used, ports are picked under an in-process lock instead.
+        """
+        try:
+            ports = port_registry.lease(self.container_name, self._host_ports(), avoid=(avoid or {}).values())
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Port lease registry unavailable, allocating ports in-process: {str(e)}")
+            self._allocate_ports_in_process()
+            return
+        self.vnc_port = ports["vnc"]
+        self.api_port = ports["api"]
+        self.marionette_port = ports["marionette"]
+        self.socat_port = ports["socat"]
+        self.websocket_port = ports["websocket"]
+
+    def _allocate_ports_in_process(self):
         """
         Lock-protected function that picks valid free ports for vnc, api, marionette, socat.
         This ensures no two threads end up with the same port.
@@ -301,15 +550,7 @@ class Desktop:
 
     def _is_port_available(self, port: int) -> bool:
         """Attempt to bind to the port. If we succeed, it's available. Then release immediately."""
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            s.bind(("0.0.0.0", port))
-            s.listen(1)
-            return True
-        except OSError:
-            return False
-        finally:
-            s.close()
+        return port_available(port)
 
     def stop(self):
         """
@@ -332,6 +573,31 @@ class Desktop:
             logger.info(f"Container '{self.container_name}' stopped and removed.")
         except docker.errors.NotFound:
             logger.info(f"Container '{self.container_name}' not found.")
+        finally:
+            # Drop keep-alive connections to the removed container
+            self.http_session.close()
+            self.close_marionette()
+            if self.port_mode == "lease":
+                port_registry.release(self.container_name)
+
+    def reset(self):
+        """
+        Puts a running desktop back into a clean state so it can be reused for another task
+        without restarting the container (used by DesktopPool when a lease ends).
+        Clears the agent's conversation state and any in-progress trace, and puts the browser
+        back to a single blank tab with no cookies or site data (see reset_browser()).
+        """
+        logger.info(f"Resetting desktop '{self.container_name}'")
+        if self._agent is not None:
+            self._agent.reset_state()
+        self.tracer.stop()
+        if self.environment != "mac":
+            try:
+                # Not reset_browser(): AsyncDesktop overrides it with a coroutine, while it
+                # inherits this synchronous reset()
+                self._reset_browser()
+            except Exception as e:
+                logger.warning(f"Failed to reset the browser on '{self.container_name}': {str(e)}")
 
     # -------------------------
     # DESKTOP ACTIONS
@@ -359,51 +625,52 @@ class Desktop:
             "returncode": result.exit_code
         }
         
-    def _call_api_with_fallback(self, endpoint, method="post", json_data=None, fallback_cmd=None):
+    def _call_api_with_fallback(self, endpoint, method="post", json_data=None, fallback_cmd=None, timeout=None):
         """
-        Call the API endpoint with fallback to exec if the API call fails.
-        If host is None, directly use exec without attempting API call.
-        
+        Call the API endpoint with fallback to exec if the API server can't be reached.
+        Local containers (host is None) are reached through the API port mapped on
+        localhost; docker exec is only used if the request never reached the server, so
+        an action that already ran in the container is never run a second time.
+
         Args:
             endpoint: API endpoint to call (e.g., '/action')
             method: HTTP method to use (default: 'post')
             json_data: JSON data to send with the request
-            fallback_cmd: Command to execute if the API call fails
-            
+            fallback_cmd: Command to execute if the API server can't be reached
+            timeout: Optional request timeout, defaults to http_timeout
+
         Returns:
             API response or exec result
+
+        Raises:
+            RuntimeError: If the API call fails after reaching the server, or it can't be
+            reached and there is no fallback.
         """
-        # If host is None, use exec directly
-        if self.host is None:
-            if fallback_cmd:
-                logger.debug(f"Host is None, using exec directly: {fallback_cmd}")
-                return self.exec(fallback_cmd)
-            else:
-                raise RuntimeError("No host specified for API call and no fallback command provided")
-        
-        # Otherwise try API call with fallback to exec if possible
         url = f"{self.api_base_url}{endpoint}"
         logger.debug(f"Calling API: {url} with data: {json_data}")
-        
+        if method.lower() not in ("post", "get"):
+            raise ValueError(f"Unsupported HTTP method: {method}")
+
         try:
             if method.lower() == "post":
-                response = requests.post(url, json=json_data, timeout=10)
-            elif method.lower() == "get":
-                response = requests.get(url, timeout=10)
+                response = self.http_session.post(url, json=json_data, timeout=timeout or self.http_timeout)
             else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
-                
-            response.raise_for_status()  # Raise exception for HTTP errors
-            return response.json()
-            
-        except (requests.RequestException, ValueError) as e:
-            logger.warning(f"API call failed: {str(e)}")
+                response = self.http_session.get(url, timeout=timeout or self.http_timeout)
+        except requests.RequestException as e:
+            if not _request_never_sent(e):
+                raise RuntimeError(f"API call failed: {str(e)}")
+            logger.warning(f"API server unreachable: {str(e)}")
             # Only try fallback if we have a local container
             if fallback_cmd and self.docker_client is not None and self.container_started:
                 logger.warning("Falling back to exec command")
                 return self.exec(fallback_cmd)
-            else:
-                raise RuntimeError(f"API call failed and fallback not available: {str(e)}")
+            raise RuntimeError(f"API call failed and fallback not available: {str(e)}")
+
+        try:
+            response.raise_for_status()  # Raise exception for HTTP errors
+            return response.json()
+        except (requests.HTTPError, ValueError) as e:
+            raise RuntimeError(f"API call failed: {str(e)}: {response.text}")
 
     # ----------------------------------------------------------------
     # CLICK
@@ -428,13 +695,7 @@ class Desktop:
         else:
             logger.info(f"Action: click at ({x}, {y}) with button '{click_type}'")
             self.tracer.add_entry("click", x=x, y=y, button=click_type)
-            # Prepare API request data
-            json_data = {"type": "click", "x": x, "y": y, "button": click_type}
-            
-            # Prepare fallback command
-            click_type_map = {"left": 1, "middle": 2, "wheel": 2, "right": 3}
-            t = click_type_map.get(click_type.lower(), 1)
-            fallback_cmd = f"export DISPLAY={self.display} && xdotool mousemove {x} {y} click {t}"
+            json_data, fallback_cmd = self._click_request(x, y, click_type)
             
             # Call API with fallback
             return self._call_api_with_fallback(
@@ -444,6 +705,17 @@ class Desktop:
                 fallback_cmd=fallback_cmd
             )
 
+    def _click_request(self, x: int, y: int, click_type: str = "left"):
+        """Build the API request data and exec fallback command for a click."""
+        # Prepare API request data
+        json_data = {"type": "click", "x": x, "y": y, "button": click_type}
+        
+        # Prepare fallback command
+        click_type_map = {"left": 1, "middle": 2, "wheel": 2, "right": 3}
+        t = click_type_map.get(click_type.lower(), 1)
+        fallback_cmd = f"export DISPLAY={self.display} && xdotool mousemove {x} {y} click {t}"
+        return json_data, fallback_cmd
+
     # ----------------------------------------------------------------
     # SCROLL
     # ----------------------------------------------------------------
@@ -473,26 +745,7 @@ class Desktop:
         else:
             logger.info(f"Action: scroll at ({x}, {y}) with offsets (scroll_x={scroll_x}, scroll_y={scroll_y})")
             self.tracer.add_entry("scroll", x=x, y=y, scroll_x=scroll_x, scroll_y=scroll_y)
-            # Prepare API request data
-            json_data = {"type": "scroll", "x": x, "y": y, "scroll_x": scroll_x, "scroll_y": scroll_y}
-            
-            # Prepare fallback command
-            fallback_cmds = [f"export DISPLAY={self.display} && xdotool mousemove {x} {y}"]
-            
-            # Vertical scroll (button 4 = up, button 5 = down)
-            if scroll_y != 0:
-                button = 4 if scroll_y < 0 else 5
-                for _ in range(3):
-                    fallback_cmds.append(f"export DISPLAY={self.display} && xdotool click {button}")
-
-            # Horizontal scroll (button 6 = left, button 7 = right)
-            if scroll_x != 0:
-                button = 6 if scroll_x < 0 else 7
-                for _ in range(3):
-                    fallback_cmds.append(f"export DISPLAY={self.display} && xdotool click {button}")
-            
-            # Join fallback commands with semicolons
-            fallback_cmd = " && ".join(fallback_cmds) if fallback_cmds else None
+            json_data, fallback_cmd = self._scroll_request(x, y, scroll_x, scroll_y)
             
             # Call API with fallback
             return self._call_api_with_fallback(
@@ -502,6 +755,30 @@ class Desktop:
                 fallback_cmd=fallback_cmd
             )
 
+    def _scroll_request(self, x: int, y: int, scroll_x: int = 0, scroll_y: int = 0):
+        """Build the API request data and exec fallback command for a scroll."""
+        # Prepare API request data
+        json_data = {"type": "scroll", "x": x, "y": y, "scroll_x": scroll_x, "scroll_y": scroll_y}
+        
+        # Prepare fallback command
+        fallback_cmds = [f"export DISPLAY={self.display} && xdotool mousemove {x} {y}"]
+        
+        # Vertical scroll (button 4 = up, button 5 = down)
+        if scroll_y != 0:
+            button = 4 if scroll_y < 0 else 5
+            for _ in range(3):
+                fallback_cmds.append(f"export DISPLAY={self.display} && xdotool click {button}")
+
+        # Horizontal scroll (button 6 = left, button 7 = right)
+        if scroll_x != 0:
+            button = 6 if scroll_x < 0 else 7
+            for _ in range(3):
+                fallback_cmds.append(f"export DISPLAY={self.display} && xdotool click {button}")
+        
+        # Join fallback commands with semicolons
+        fallback_cmd = " && ".join(fallback_cmds) if fallback_cmds else None
+        return json_data, fallback_cmd
+
     # ----------------------------------------------------------------
     # KEYPRESS
     # ----------------------------------------------------------------
@@ -541,47 +818,8 @@ class Desktop:
                 
         # If running in container
         else:
-            # Prepare API request data
-            json_data = {"type": "keypress", "keys": keys}
-            
-            # Prepare fallback command
-            fallback_cmds = []
-            ctrl_pressed = False
-            shift_pressed = False
-            
             self.tracer.add_entry("keypress", keys=keys)
-            for k in keys:
-                logger.info(f"  - key '{k}'")
-                
-                # Handle special modifiers
-                if k.upper() == 'CTRL':
-                    logger.info("    => holding down CTRL")
-                    fallback_cmds.append(f"export DISPLAY={self.display} && xdotool keydown ctrl")
-                    ctrl_pressed = True
-                elif k.upper() == 'SHIFT':
-                    logger.info("    => holding down SHIFT")
-                    fallback_cmds.append(f"export DISPLAY={self.display} && xdotool keydown shift")
-                    shift_pressed = True
-                # Check special keys
-                elif k.lower() == "enter":
-                    fallback_cmds.append(f"export DISPLAY={self.display} && xdotool key Return")
-                elif k.lower() == "space":
-                    fallback_cmds.append(f"export DISPLAY={self.display} && xdotool key space")
-                else:
-                    # For normal alphabetic or punctuation
-                    lower_k = k.lower()  # xdotool keys are typically lowercase
-                    fallback_cmds.append(f"export DISPLAY={self.display} && xdotool key '{lower_k}'")
-
-            # Release modifiers
-            if ctrl_pressed:
-                logger.info("    => releasing CTRL")
-                fallback_cmds.append(f"export DISPLAY={self.display} && xdotool keyup ctrl")
-            if shift_pressed:
-                logger.info("    => releasing SHIFT")
-                fallback_cmds.append(f"export DISPLAY={self.display} && xdotool keyup shift")
-                
-            # Join fallback commands with semicolons
-            fallback_cmd = " && ".join(fallback_cmds) if fallback_cmds else None
+            json_data, fallback_cmd = self._keypress_request(keys)
             
             # Call API with fallback
             return self._call_api_with_fallback(
@@ -591,6 +829,50 @@ class Desktop:
                 fallback_cmd=fallback_cmd
             )
 
+    def _keypress_request(self, keys: list[str]):
+        """Build the API request data and exec fallback command for a keypress."""
+        # Prepare API request data
+        json_data = {"type": "keypress", "keys": keys}
+        
+        # Prepare fallback command
+        fallback_cmds = []
+        ctrl_pressed = False
+        shift_pressed = False
+        
+        for k in keys:
+            logger.info(f"  - key '{k}'")
+            
+            # Handle special modifiers
+            if k.upper() == 'CTRL':
+                logger.info("    => holding down CTRL")
+                fallback_cmds.append(f"export DISPLAY={self.display} && xdotool keydown ctrl")
+                ctrl_pressed = True
+            elif k.upper() == 'SHIFT':
+                logger.info("    => holding down SHIFT")
+                fallback_cmds.append(f"export DISPLAY={self.display} && xdotool keydown shift")
+                shift_pressed = True
+            # Check special keys
+            elif k.lower() == "enter":
+                fallback_cmds.append(f"export DISPLAY={self.display} && xdotool key Return")
+            elif k.lower() == "space":
+                fallback_cmds.append(f"export DISPLAY={self.display} && xdotool key space")
+            else:
+                # For normal alphabetic or punctuation
+                lower_k = k.lower()  # xdotool keys are typically lowercase
+                fallback_cmds.append(f"export DISPLAY={self.display} && xdotool key '{lower_k}'")
+
+        # Release modifiers
+        if ctrl_pressed:
+            logger.info("    => releasing CTRL")
+            fallback_cmds.append(f"export DISPLAY={self.display} && xdotool keyup ctrl")
+        if shift_pressed:
+            logger.info("    => releasing SHIFT")
+            fallback_cmds.append(f"export DISPLAY={self.display} && xdotool keyup shift")
+            
+        # Join fallback commands with semicolons
+        fallback_cmd = " && ".join(fallback_cmds) if fallback_cmds else None
+        return json_data, fallback_cmd
+
     # ----------------------------------------------------------------
     # TYPE
     # ----------------------------------------------------------------
@@ -610,11 +892,7 @@ class Desktop:
 
         # If running in a container
         else: 
-            # Prepare API request data
-            json_data = {"type": "type", "text": text}
-            
-            # Prepare fallback command
-            fallback_cmd = f"export DISPLAY={self.display} && xdotool type '{text}'"
+            json_data, fallback_cmd = self._type_request(text)
             
             # Call API with fallback
             return self._call_api_with_fallback(
@@ -623,6 +901,15 @@ class Desktop:
                 json_data=json_data,
                 fallback_cmd=fallback_cmd
             )
+
+    def _type_request(self, text: str):
+        """Build the API request data and exec fallback command for typing text."""
+        # Prepare API request data
+        json_data = {"type": "type", "text": text}
+        
+        # Prepare fallback command
+        fallback_cmd = f"export DISPLAY={self.display} && xdotool type '{text}'"
+        return json_data, fallback_cmd
     
     # ----------------------------------------------------------------
     # TAKE SCREENSHOT
@@ -636,24 +923,11 @@ class Desktop:
         
         # If running locally on MacOS
         if self.environment == "mac":
-            # Use PyAutoGUI to capture the screenshot on macOS
-            import pyautogui
-            screenshot = pyautogui.screenshot()
-            # Save screenshot to a bytes buffer in PNG format
-            buffered = BytesIO()
-            screenshot.save(buffered, format="PNG")
-            screenshot_bytes = buffered.getvalue()
-            # Encode to base64
-            encoded = base64.b64encode(screenshot_bytes).decode("utf-8")
-            return encoded
+            return base64.b64encode(self._mac_screenshot()).decode("utf-8")
 
         # If running in container
         else: 
-            # Prepare API request data
-            json_data = {"type": "screenshot"}
-            
-            # Prepare fallback command
-            fallback_cmd = f"export DISPLAY={self.display} && import -window root png:- | base64 -w 0"
+            json_data, fallback_cmd = self._screenshot_request()
             
             # Call API with fallback
             response = self._call_api_with_fallback(
@@ -662,7 +936,57 @@ class Desktop:
                 json_data=json_data,
                 fallback_cmd=fallback_cmd
             )
+        return self._extract_screenshot(response)
+
+    def get_screenshot_bytes(self, fmt: str = "png") -> bytes:
+        """
+        Takes a screenshot of the current desktop and returns the raw image bytes.
+        The image is sent as binary from the container API, so there is no base64
+        encoding on the wire. fmt can be 'png', 'jpg' or 'webp' (containers only).
+        """
+        logger.info("Action: take screenshot")
+
+        # If running locally on MacOS
+        if self.environment == "mac":
+            return self._mac_screenshot()
+
+        # If running in container
+        try:
+            response = self.http_session.get(f"{self.api_base_url}/screenshot.{fmt}", timeout=self.http_timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            if fmt != "png":
+                raise RuntimeError(f"Screenshot as {fmt} failed: {str(e)}")
+            # Older images only serve base64 screenshots; get_screenshot() also falls back to exec
+            logger.warning(f"Binary screenshot failed, falling back to base64 screenshot: {str(e)}")
+            return base64.b64decode(self.get_screenshot())
+
+        screenshot_bytes = response.content
+        if self.tracer.config.trace_screenshots:
+            self._trace_screenshot(base64.b64encode(screenshot_bytes).decode("ascii"), response.headers.get("Content-Type", "image/png"))
+        return screenshot_bytes
+
+    def _mac_screenshot(self) -> bytes:
+        """Capture the local macOS screen and return it as PNG bytes."""
+        # Use PyAutoGUI to capture the screenshot on macOS
+        import pyautogui
+        screenshot = pyautogui.screenshot()
+        # Save screenshot to a bytes buffer in PNG format
+        buffered = BytesIO()
+        screenshot.save(buffered, format="PNG")
+        return buffered.getvalue()
+
+    def _screenshot_request(self):
+        """Build the API request data and exec fallback command for a screenshot."""
+        # Prepare API request data
+        json_data = {"type": "screenshot"}
         
+        # Prepare fallback command
+        fallback_cmd = f"export DISPLAY={self.display} && import -window root png:- | base64 -w 0"
+        return json_data, fallback_cmd
+
+    def _extract_screenshot(self, response):
+        """Pull the base64 screenshot out of an API or exec response, and trace it if enabled."""
         # Extract screenshot data from response
         screenshot_bytes = None
         if isinstance(response, dict) and "screenshot" in response:
@@ -671,18 +995,28 @@ class Desktop:
             # If the response comes from the fallback command
             screenshot_bytes = response["result"]
         if self.tracer.config.trace_screenshots:
-            self.tracer.add_entry("screenshot", screenshot=f"data:image/png;base64,{screenshot_bytes}")
+            self._trace_screenshot(screenshot_bytes)
         return screenshot_bytes
+
+    def _trace_screenshot(self, screenshot_base64, media_type="image/png"):
+        """Add a base64 screenshot to the current trace."""
+        self.tracer.add_entry("screenshot", screenshot=f"data:{media_type};base64,{screenshot_base64}")
     
     # ----------------------------------------------------------------
     # GOTO URL
     # ----------------------------------------------------------------
-    def goto(self, url: str) -> None:
+    def goto(self, url: str, wait_until: str = "load", timeout: float = GOTO_TIMEOUT):
         """
-        Open Firefox in the container and navigate to the specified URL.
+        Navigate the current Firefox tab to the specified URL and wait for it to load.
         
         Args:
             url: The URL to navigate to (e.g., "https://example.com")
+            wait_until: "none", "domcontentloaded", "load" or "networkidle"
+            timeout: Maximum seconds to wait for the page
+        
+        Returns:
+            dict: The final URL, whether the page reached wait_until in time ("loaded"),
+            the elapsed seconds and the page's navigation timing.
         """
         logger.info(f"Action: goto URL: {url}")
         self.tracer.add_entry("goto", url=url)
@@ -693,21 +1027,36 @@ class Desktop:
             subprocess.run(["open", url])
             return
 
-        # If running in container
-        else: 
-            # Prepare API request data
-            json_data = {"type": "goto", "url": url}
-            
-            # Prepare fallback command - add `&` at the end to run Firefox in background
-            fallback_cmd = f"export DISPLAY={self.display} && firefox-esr -new-tab {url} &"
-            
-            # Call API with fallback
-            return self._call_api_with_fallback(
-                endpoint="/action",
-                method="post",
-                json_data=json_data,
-                fallback_cmd=fallback_cmd
-            )
+        # If running in container, navigate over our Marionette session. Only fall back to the
+        # API if nothing was sent, since a second navigation (a new tab on older images) is worse
+        try:
+            result = self.get_marionette().navigate(url, wait_until, timeout)
+            self._enforce_tab_limit()
+            return result
+        except MarionetteUnavailable as e:
+            logger.warning(f"Marionette navigation failed, falling back to the API: {str(e)}")
+
+        json_data, fallback_cmd = self._goto_request(url, wait_until, timeout)
+
+        # Call API with fallback - the server waits for the page before replying
+        result = self._call_api_with_fallback(
+            endpoint="/action",
+            method="post",
+            json_data=json_data,
+            fallback_cmd=fallback_cmd,
+            timeout=self._extended_timeout(timeout)
+        )
+        self._enforce_tab_limit()
+        return result
+
+    def _goto_request(self, url: str, wait_until: str = "load", timeout: float = GOTO_TIMEOUT):
+        """Build the API request data and exec fallback command for opening a URL."""
+        # Prepare API request data
+        json_data = {"type": "goto", "url": url, "wait_until": wait_until, "timeout": timeout}
+        
+        # Prepare fallback command - add `&` at the end to run Firefox in background
+        fallback_cmd = f"export DISPLAY={self.display} && firefox-esr -new-tab {url} &"
+        return json_data, fallback_cmd
 
     # ----------------------------------------------------------------
     # WAIT
@@ -727,20 +1076,289 @@ class Desktop:
         
         # If running in a container
         else: 
-            # Prepare API request data
-            json_data = {"type": "wait", "seconds": seconds}
-            
-            # Prepare fallback command
-            fallback_cmd = f"sleep {seconds}"
+            json_data, fallback_cmd = self._wait_request(seconds)
             
-            # Call API with fallback
+            # Call API with fallback - the server sleeps before replying, so allow for that
             return self._call_api_with_fallback(
                 endpoint="/action",
                 method="post",
                 json_data=json_data,
-                fallback_cmd=fallback_cmd
+                fallback_cmd=fallback_cmd,
+                timeout=self._extended_timeout(seconds)
             )
-    
+
+    def settle(self, quiet_period: Optional[float] = None, timeout: Optional[float] = None):
+        """
+        Wait until the screen has stopped changing, e.g. after a click or page load.
+        Returns as soon as the screen has been unchanged for quiet_period seconds,
+        or after timeout seconds at most. Both default to the values given to Desktop().
+
+        Returns:
+            dict with "settled" (False if the timeout was hit) and "elapsed" seconds
+        """
+        quiet_period = self.settle_quiet_period if quiet_period is None else quiet_period
+        timeout = self.settle_timeout if timeout is None else timeout
+
+        if self.environment == "mac":
+            # No cheap framebuffer access on macOS, so wait for the quiet period only
+            time.sleep(min(quiet_period, timeout))
+            return {"settled": True, "elapsed": min(quiet_period, timeout)}
+
+        try:
+            response = self.http_session.post(
+                f"{self.api_base_url}/settle",
+                json=self._settle_request(quiet_period, timeout),
+                timeout=self._extended_timeout(timeout)
+            )
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            # Older images don't have /settle, so wait a fixed amount instead
+            fallback = min(1.0, timeout)
+            logger.warning(f"Settle failed, waiting {fallback} seconds instead: {str(e)}")
+            time.sleep(fallback)
+            return {"settled": False, "elapsed": fallback}
+
+    def _settle_request(self, quiet_period: float, timeout: float):
+        """Build the API request data for a settle."""
+        return {"quiet_period": quiet_period, "timeout": timeout}
+
+    def _wait_request(self, seconds: float = 2.0):
+        """Build the API request data and exec fallback command for a wait."""
+        # Prepare API request data
+        json_data = {"type": "wait", "seconds": seconds}
+        
+        # Prepare fallback command
+        fallback_cmd = f"sleep {seconds}"
+        return json_data, fallback_cmd
+
+    # ----------------------------------------------------------------
+    # ACTION + SETTLE + SCREENSHOT
+    # ----------------------------------------------------------------
+    def perform_action(self, action: dict):
+        """
+        Run one action given as an API action dict, e.g. {"type": "click", "x": 10, "y": 20}.
+        Supported types: click, scroll, keypress, type, wait, goto, settle, screenshot.
+        """
+        action_type = action.get("type")
+        if action_type == "click":
+            return self.click(action["x"], action["y"], action.get("button") or "left")
+        elif action_type == "scroll":
+            return self.scroll(action["x"], action["y"], action.get("scroll_x") or 0, action.get("scroll_y") or 0)
+        elif action_type == "keypress":
+            return self.keypress(action["keys"])
+        elif action_type == "type":
+            return self.type_text(action["text"])
+        elif action_type == "wait":
+            return self.wait(action.get("seconds") or 2.0)
+        elif action_type == "goto":
+            return self.goto(action["url"], action.get("wait_until") or "load", action.get("timeout") or GOTO_TIMEOUT)
+        elif action_type == "settle":
+            return self.settle(action.get("quiet_period"), action.get("timeout"))
+        elif action_type == "screenshot":
+            return self.get_screenshot()
+        raise ValueError(f"Unknown action type: {action_type}")
+
+    def step(self, action: Optional[dict] = None, settle: bool = True, quiet_period: Optional[float] = None, timeout: Optional[float] = None, fmt: str = "png") -> bytes:
+        """
+        Run an action, wait for the screen to settle and return the screenshot that follows,
+        in a single round trip to the container API.
+
+        Args:
+            action: API action dict (see perform_action), or None to only settle and take a screenshot
+            settle: Whether to wait for the screen to settle before the screenshot
+            quiet_period: Settle quiet period, defaults to settle_quiet_period
+            timeout: Settle timeout, defaults to settle_timeout
+            fmt: Screenshot format: 'png', 'jpg' or 'webp'
+
+        Returns:
+            The screenshot as image bytes
+        """
+        screenshot_bytes = self._step(action, settle, quiet_period, timeout, fmt)
+        if self._may_open_tabs([action]):
+            self._enforce_tab_limit()
+        return screenshot_bytes
+
+    def _step(self, action, settle, quiet_period, timeout, fmt):
+        quiet_period = self.settle_quiet_period if quiet_period is None else quiet_period
+        timeout = self.settle_timeout if timeout is None else timeout
+
+        # Older images don't have /step, so run the three parts separately
+        if self.environment == "mac" or "/step" in self._missing_endpoints:
+            return self._step_separately(action, settle, quiet_period, timeout, fmt)
+
+        logger.info(f"Action: step {action}")
+        try:
+            response = self.http_session.post(
+                f"{self.api_base_url}/step",
+                json=self._step_request(action, settle, quiet_period, timeout, fmt),
+                timeout=self._step_timeout(action, settle, timeout)
+            )
+        except requests.RequestException as e:
+            if not _request_never_sent(e):
+                raise RuntimeError(f"Step failed: {str(e)}")
+            # The request never reached the server, so the action can safely be run again
+            logger.warning(f"Step failed, running action and screenshot separately: {str(e)}")
+            return self._step_separately(action, settle, quiet_period, timeout, fmt)
+
+        if response.status_code in (404, 405):
+            logger.warning("Container API has no /step endpoint, running action and screenshot separately")
+            self._missing_endpoints.add("/step")
+            return self._step_separately(action, settle, quiet_period, timeout, fmt)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            raise RuntimeError(f"Step failed: {str(e)}: {response.text}")
+
+        return self._step_result(action, response.content, response.headers)
+
+    def _step_separately(self, action, settle, quiet_period, timeout, fmt):
+        """Run a step as separate action, settle and screenshot calls."""
+        if action is not None:
+            self.perform_action(action)
+        if settle:
+            self.settle(quiet_period, timeout)
+        return self.get_screenshot_bytes(fmt)
+
+    def _step_request(self, action, settle, quiet_period, timeout, fmt):
+        """Build the API request data for a step."""
+        return {"action": action, "settle": settle, "quiet_period": quiet_period, "timeout": timeout, "format": fmt}
+
+    def _step_timeout(self, action, settle, timeout):
+        """Request timeout for a step: the server may wait and settle before replying."""
+        extra = timeout if settle else 0
+        if action is not None and action.get("type") == "wait":
+            extra += action.get("seconds") or 2.0
+        elif action is not None and action.get("type") == "goto":
+            extra += action.get("timeout") or GOTO_TIMEOUT
+        return self._extended_timeout(extra)
+
+    def _step_result(self, action, screenshot_bytes, headers):
+        """Trace a completed step and return its screenshot."""
+        if action is not None:
+            self._trace_action(action)
+        if self.tracer.config.trace_screenshots:
+            self._trace_screenshot(base64.b64encode(screenshot_bytes).decode("ascii"), headers.get("Content-Type", "image/png"))
+        return screenshot_bytes
+
+    def _trace_action(self, action):
+        """Add a trace entry for an action dict that ran on the server."""
+        if action["type"] not in ("screenshot", "settle"):
+            self.tracer.add_entry(action["type"], **{k: v for k, v in action.items() if k not in ("type", "delay")})
+
+    # ----------------------------------------------------------------
+    # BATCHED ACTIONS
+    # ----------------------------------------------------------------
+    def run_actions(self, actions: list[dict], delay: float = 0.0, stop_on_error: bool = True) -> dict:
+        """
+        Run an ordered list of actions in a single request to the container API.
+        Useful for scripted sequences such as logging in or filling a form.
+
+        Example:
+            desktop.run_actions([
+                {"type": "click", "x": 300, "y": 200},
+                {"type": "type", "text": "user@example.com"},
+                {"type": "keypress", "keys": ["TAB"]},
+                {"type": "type", "text": "hunter2"},
+                {"type": "keypress", "keys": ["ENTER"], "delay": 1.0},
+            ], delay=0.1)
+
+        Args:
+            actions: API action dicts (see perform_action). An action may have a "delay"
+                     key with the seconds to wait after it, overriding `delay`
+            delay: Seconds to wait between actions
+            stop_on_error: Stop at the first failing action instead of running the rest
+
+        Returns:
+            dict with "status" ("success" or "error"), "completed", "total" and a
+            "results" entry per action that was attempted
+        """
+        result = self._run_actions(actions, delay, stop_on_error)
+        if self._may_open_tabs(actions):
+            self._enforce_tab_limit()
+        return result
+
+    def _run_actions(self, actions, delay, stop_on_error):
+        logger.info(f"Action: run {len(actions)} actions")
+
+        # Older images don't have /actions, so run the actions one by one
+        if self.environment == "mac" or "/actions" in self._missing_endpoints:
+            return self._run_actions_separately(actions, delay, stop_on_error)
+
+        try:
+            response = self.http_session.post(
+                f"{self.api_base_url}/actions",
+                json={"actions": actions, "delay": delay, "stop_on_error": stop_on_error},
+                timeout=self._actions_timeout(actions, delay)
+            )
+        except requests.RequestException as e:
+            if not _request_never_sent(e):
+                raise RuntimeError(f"Batched actions failed: {str(e)}")
+            # The request never reached the server, so the actions can safely be run again
+            logger.warning(f"Batched actions failed, running them one by one: {str(e)}")
+            return self._run_actions_separately(actions, delay, stop_on_error)
+
+        if response.status_code in (404, 405):
+            logger.warning("Container API has no /actions endpoint, running actions one by one")
+            self._missing_endpoints.add("/actions")
+            return self._run_actions_separately(actions, delay, stop_on_error)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            raise RuntimeError(f"Batched actions failed: {str(e)}: {response.text}")
+
+        return self._actions_result(actions, response.json())
+
+    def _run_actions_separately(self, actions, delay, stop_on_error):
+        """Run a batch as one perform_action() call per action, with the same result as /actions."""
+        results = []
+        for index, action in enumerate(actions):
+            try:
+                result = self.perform_action(action)
+                results.append({"index": index, **(result if isinstance(result, dict) else {"status": "success"})})
+            except Exception as e:
+                logger.error(f"Batch action {index} ({action.get('type')}) failed: {str(e)}")
+                results.append({"index": index, "status": "error", "action": action.get("type"), "error": str(e)})
+                if stop_on_error:
+                    break
+                continue
+
+            action_delay = action.get("delay", delay)
+            if action_delay and index < len(actions) - 1:
+                time.sleep(action_delay)
+        return self._batch_summary(results, len(actions))
+
+    def _batch_summary(self, results, total):
+        """Build the /actions style summary for a list of per-action results."""
+        errors = sum(1 for result in results if result.get("status") == "error")
+        return {
+            "status": "error" if errors else "success",
+            "action": "actions",
+            "completed": len(results) - errors,
+            "total": total,
+            "results": results
+        }
+
+    def _actions_result(self, actions, result):
+        """Trace the actions of a completed /actions request and return its result."""
+        for action, action_result in zip(actions, result.get("results", [])):
+            if action_result.get("status") != "error":
+                self._trace_action(action)
+        return result
+
+    def _actions_timeout(self, actions, delay):
+        """Request timeout for a batch: allow for every wait, settle and delay on the server."""
+        extra = 0.0
+        for action in actions:
+            if action.get("type") == "wait":
+                extra += action.get("seconds") or 2.0
+            elif action.get("type") == "settle":
+                extra += self.settle_timeout if action.get("timeout") is None else action["timeout"]
+            elif action.get("type") == "goto":
+                extra += action.get("timeout") or GOTO_TIMEOUT
+            extra += action.get("delay", delay) or 0
+        return self._extended_timeout(extra)
+
     # -------------------------
     # Agent Integration
     # -------------------------
@@ -756,7 +1374,7 @@ class Desktop:
             An Agent instance
         """
         if self._agent is None and create_if_none:
-            self._agent = Agent(desktop=self, openai_api_key=self.openai_api_key)
+            self._agent = self.agent_class(desktop=self, openai_api_key=self.openai_api_key)
         return self._agent
     
     def set_agent(self, agent):
@@ -844,6 +1462,118 @@ class Desktop:
             str: The HTML content of the current page, or an error message if retrieval fails.
         """
         return self.get_agent().get_page_html(query)
+
+    def get_marionette(self) -> MarionetteSession:
+        """
+        Return this desktop's persistent Marionette session, creating it on first use.
+
+        The session is shared by get_page_html and any other DOM queries, so Firefox only
+        has to start one Marionette session per desktop. It reconnects by itself if the
+        connection drops, and is closed when the desktop is stopped.
+        """
+        host = self.host or self.container_ip or "localhost"
+        with self._marionette_lock:
+            session = self._marionette
+            if session is not None and (session.host, session.port) != (host, self.marionette_port):
+                # Ports changed (e.g. the container was restarted on new ports)
+                session.close()
+                session = None
+            if session is None:
+                session = MarionetteSession(host, self.marionette_port)
+                self._marionette = session
+            return session
+
+    def close_marionette(self):
+        """Close the persistent Marionette session, if one is open."""
+        with self._marionette_lock:
+            session, self._marionette = self._marionette, None
+        if session is not None:
+            session.close()
+
+    # ----------------------------------------------------------------
+    # BROWSER TABS
+    # ----------------------------------------------------------------
+    def list_tabs(self) -> list:
+        """
+        List the open Firefox tabs, oldest first.
+
+        Returns:
+            list: One dict per tab with its "handle", "url", "title" and whether it's "current".
+        """
+        return self.get_marionette().list_tabs()
+
+    def switch_tab(self, tab):
+        """
+        Bring a tab to the front so that actions and screenshots apply to it.
+
+        Args:
+            tab: A handle from list_tabs(), or an index into that list.
+
+        Returns:
+            str: The handle of the tab now in front.
+        """
+        logger.info(f"Action: switch to tab {tab}")
+        return self.get_marionette().switch_tab(tab)
+
+    def close_tabs(self, keep: Optional[list] = None) -> list:
+        """
+        Close every tab except the ones in keep.
+
+        Args:
+            keep: Handles of the tabs to keep open. Defaults to the current tab.
+
+        Returns:
+            list: The handles of the tabs that are still open.
+        """
+        logger.info("Action: close tabs")
+        return self.get_marionette().close_tabs(keep)
+
+    def reset_browser(self, url: str = "about:blank", clear_data: bool = True):
+        """
+        Put the browser back into a clean state without restarting it: close every tab but
+        the current one, load url in it and, if clear_data is set, clear cookies, storage
+        and cache for every site. Used by reset() when a pooled desktop is returned.
+        """
+        self._reset_browser(url, clear_data)
+
+    def _reset_browser(self, url: str = "about:blank", clear_data: bool = True):
+        """Synchronous body of reset_browser(), safe to call from reset() on an AsyncDesktop too."""
+        session = self.get_marionette()
+        session.close_tabs()
+        session.navigate(url, wait_until="load", timeout=10)
+        if clear_data:
+            session.clear_browsing_data()
+
+    def _may_open_tabs(self, actions) -> bool:
+        """Whether any of the actions could have opened a tab that max_tabs should apply to."""
+        if self.max_tabs is None or self.environment == "mac":
+            return False
+        return any(action is not None and action.get("type") in TAB_OPENING_ACTIONS for action in actions)
+
+    def _enforce_tab_limit(self):
+        """Close the oldest tabs if more than max_tabs are open."""
+        if self.max_tabs is None:
+            return
+        try:
+            self.get_marionette().enforce_tab_limit(self.max_tabs)
+        except Exception as e:
+            logger.warning(f"Failed to enforce the open tab limit: {str(e)}")
+
+    def execute_script(self, script: str, args: Optional[list] = None):
+        """
+        Run JavaScript in the current browser tab over the desktop's Marionette session.
+
+        Args:
+            script: JavaScript function body; use `return` to send a value back.
+            args: Optional list of values available to the script as `arguments`.
+
+        Returns:
+            The script's return value.
+
+        Raises:
+            RuntimeError: If Firefox can't be reached over Marionette.
+        """
+        return self.get_marionette().execute_script(script, args)
             
     def action(self, input_text=None, acknowledged_safety_checks=False, ignore_safety_and_input=False,
               complete_handler=None, needs_input_handler=None, needs_safety_check_handler=None, error_handler=None, tools=None, function_map=None, stop_event=None, **kwargs):
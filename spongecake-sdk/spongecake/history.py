@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+from typing import Any, Iterator, List, Optional
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+class History:
+    """
+    Bounded ring buffer for agent history (responses or inputs).
+
+    Keeps the most recent `maxlen` items in memory. When an item falls out of the buffer
+    it is appended as a JSON line to `spill_path` if one is set, and dropped otherwise,
+    so a long-running agent's memory use stays flat. The first item ever appended (the
+    original task for input history) is always kept.
+    """
+
+    def __init__(self, maxlen: Optional[int] = 100, spill_path: Optional[str] = None):
+        """
+        Args:
+            maxlen: Number of items to keep in memory. None keeps everything.
+            spill_path: Optional JSON lines file that evicted items are appended to.
+        """
+        self.maxlen = maxlen
+        self.spill_path = spill_path
+        self.first = None       # First item appended since the last clear()
+        self.total = 0          # Number of items appended since the last clear()
+        self.spilled = 0        # Number of items written to spill_path
+        self._items = deque()
+        self._lock = threading.Lock()
+
+    def append(self, item: Any):
+        """Add an item, evicting (and possibly spilling) the oldest one if the buffer is full."""
+        with self._lock:
+            if self.total == 0:
+                self.first = item
+            self.total += 1
+            self._items.append(item)
+            if self.maxlen is not None and len(self._items) > self.maxlen:
+                self._spill(self._items.popleft())
+
+    def _spill(self, item: Any):
+        if self.spill_path is None:
+            return
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(_to_json(item) + "\n")
+            self.spilled += 1
+        except Exception as e:
+            logger.warning(f"Failed to spill history item to {self.spill_path}: {str(e)}")
+
+    def spilled_items(self) -> Iterator[Any]:
+        """Iterate over the evicted items that were spilled to disk, oldest first, as decoded JSON."""
+        if self.spill_path is None or not os.path.exists(self.spill_path):
+            return
+        with open(self.spill_path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def to_list(self) -> List[Any]:
+        """Return the items currently held in memory, oldest first."""
+        with self._lock:
+            return list(self._items)
+
+    def copy(self) -> List[Any]:
+        return self.to_list()
+
+    def clear(self):
+        """Drop all items. Spilled items are removed from disk as well."""
+        with self._lock:
+            self._items.clear()
+            self.first = None
+            self.total = 0
+            self.spilled = 0
+            if self.spill_path is not None and os.path.exists(self.spill_path):
+                os.remove(self.spill_path)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.to_list())
+
+    def __getitem__(self, index):
+        return self.to_list()[index]
+
+    def __bool__(self) -> bool:
+        return bool(self._items)
+
+
+def history_spill_path(spill_dir: Optional[str], kind: str) -> Optional[str]:
+    """Return a unique spill file path for one history in spill_dir, or None if spilling is off."""
+    if spill_dir is None:
+        return None
+    os.makedirs(spill_dir, exist_ok=True)
+    return os.path.join(spill_dir, f"{kind}-{uuid.uuid4().hex}.jsonl")
+
+
+def _to_json(item: Any) -> str:
+    # OpenAI response objects are pydantic models; plain inputs are dicts
+    if hasattr(item, "model_dump_json"):
+        return item.model_dump_json()
+    return json.dumps(item, default=str)
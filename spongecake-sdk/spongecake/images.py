@@ -0,0 +1,172 @@
+"""
+Docker image pull policies for Desktop.start().
+
+Pulling the image on every start costs a registry round trip, and a long timeout when
+the registry can't be reached. The policy decides when start() pulls:
+
+* ``always``: ask the registry for the image's digest and pull only if it differs from
+  the local image.
+* ``if-not-present``: pull only if the image isn't available locally.
+* ``never``: never pull; the image must already be available locally.
+* ``background-refresh``: use the local image right away and check the registry in a
+  background thread (at most once per refresh interval); pull synchronously only if the
+  image isn't available locally.
+
+Registry digests are cached in a small JSON index at ``~/.cache/spongecake/image_index.json``
+so refreshes are rate limited across processes. Between checks, a background refresh compares
+the cached digest with the local image and pulls if an earlier check found a newer image that
+was never pulled (e.g. the pull failed or its process exited), without asking the registry again.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from docker.errors import APIError, ImageNotFound
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+PULL_POLICIES = ("always", "if-not-present", "never", "background-refresh")
+
+# Default seconds between background registry checks for the same image
+REFRESH_INTERVAL = 3600
+
+_INDEX_FILE = Path.home() / ".cache" / "spongecake" / "image_index.json"
+
+# Images with a background refresh in flight in this process
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+class ImageIndex:
+    """JSON file mapping image names to their last known registry digest and check time."""
+
+    def __init__(self, path: Path = _INDEX_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def get(self, image: str) -> dict:
+        return self._read().get(image, {})
+
+    def update(self, image: str, **fields):
+        with self._lock:
+            entries = self._read()
+            entries.setdefault(image, {}).update(fields)
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                # Write to a temporary file first so readers never see a partial index
+                tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+                tmp_path.write_text(json.dumps(entries, indent=2))
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Could not write image index {self.path}: {str(e)}")
+
+    def _read(self) -> dict:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+
+image_index = ImageIndex()
+
+
+def ensure_image(docker_client, image: str, policy: str = "if-not-present", refresh_interval: float = REFRESH_INTERVAL):
+    """
+    Make sure image is available locally according to the pull policy.
+
+    Raises:
+        ValueError: If policy is not one of PULL_POLICIES.
+        RuntimeError: If the policy is "never" and the image isn't available locally.
+    """
+    if policy not in PULL_POLICIES:
+        raise ValueError(f"pull_policy must be one of {', '.join(PULL_POLICIES)}")
+
+    local = _local_image(docker_client, image)
+    if local is None:
+        if policy == "never":
+            raise RuntimeError(f"Image {image} is not available locally and pull_policy is 'never'")
+        _pull(docker_client, image)
+    elif policy == "always":
+        _refresh(docker_client, image, local)
+    elif policy == "background-refresh":
+        _refresh_in_background(docker_client, image, local, refresh_interval)
+
+
+def _local_image(docker_client, image: str):
+    try:
+        return docker_client.images.get(image)
+    except ImageNotFound:
+        return None
+    except APIError as e:
+        logger.warning(f"Could not inspect local image {image}: {str(e)}")
+        return None
+
+
+def _local_digests(local) -> set:
+    """Registry digests of a local image, from its RepoDigests ("repo@sha256:...")."""
+    return {repo_digest.split("@", 1)[1] for repo_digest in local.attrs.get("RepoDigests") or [] if "@" in repo_digest}
+
+
+def _pull(docker_client, image: str):
+    """Pull the image (best effort) and record its digest."""
+    logger.info(f"Pulling image {image}")
+    try:
+        pulled = docker_client.images.pull(image)
+    except APIError as e:
+        logger.warning(f"Failed to pull image {image}, attempting to run anyway...")
+        logger.debug(str(e))
+        return
+    digests = _local_digests(pulled)
+    image_index.update(image, digest=next(iter(digests), None), checked_at=time.time())
+
+
+def _refresh(docker_client, image: str, local):
+    """Pull the image only if the registry has a different digest than the local image."""
+    try:
+        remote_digest = docker_client.images.get_registry_data(image).id
+    except APIError as e:
+        logger.warning(f"Could not check the registry for {image}, using the local image: {str(e)}")
+        # Count the failed check too, so an offline host isn't retried on every start
+        image_index.update(image, checked_at=time.time())
+        return
+    image_index.update(image, digest=remote_digest, checked_at=time.time())
+    if remote_digest in _local_digests(local):
+        logger.info(f"Image {image} is up to date")
+        return
+    _pull(docker_client, image)
+
+
+def _refresh_in_background(docker_client, image: str, local, refresh_interval: float):
+    """
+    Start a background refresh of the image unless one is running. If the registry was checked
+    recently, only pull when its cached digest is newer than the local image.
+    """
+    entry = image_index.get(image)
+    if time.time() - (entry.get("checked_at") or 0) < refresh_interval:
+        digest = entry.get("digest")
+        if digest is None or digest in _local_digests(local):
+            return
+        logger.info(f"Image {image} is behind the last registry check, pulling {digest}")
+        update = lambda: _pull(docker_client, image)
+    else:
+        update = lambda: _refresh(docker_client, image, local)
+
+    with _refreshing_lock:
+        if image in _refreshing:
+            return
+        _refreshing.add(image)
+
+    def refresh():
+        try:
+            update()
+        except Exception as e:
+            logger.warning(f"Background refresh of {image} failed: {str(e)}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(image)
+
+    threading.Thread(target=refresh, name=f"image-refresh-{image}", daemon=True).start()
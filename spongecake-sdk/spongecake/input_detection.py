@@ -0,0 +1,112 @@
+"""
+Local classifier that decides whether an agent message is asking the user for input.
+
+The agent used to ask gpt-4o-mini about every message, which costs a network round trip
+(and a paid request) at the end of every task. Most messages are clear-cut, so simple
+rules decide those locally; only ambiguous text is sent to the model, and the model's
+verdicts are cached by message hash.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# Phrases that ask the user for something
+ASK_PATTERNS = [
+    r"\bplease (provide|confirm|specify|choose|select|clarify|enter|share|tell me|let me know)\b",
+    r"\b(could|can|would) you (please )?(provide|confirm|specify|choose|select|clarify|enter|share|tell me|let me know)\b",
+    r"\bi need (you to|your|more (information|details)|the following)\b",
+    r"\blet me know (which|what|whether|how|your)\b",
+    r"\b(waiting|wait) for your (input|confirmation|response|answer)\b",
+    r"\bbefore i (proceed|continue)\b",
+]
+
+# Phrases that report a result or a finished task
+FINAL_PATTERNS = [
+    r"\b(here is|here are|here's)\b",
+    r"\bi( have|'ve) (successfully )?(completed|finished|added|submitted|sent|saved|updated|found|entered|booked|placed)\b",
+    r"\b(successfully|all done)\b",
+    r"\b(task|request) (is|has been) (complete|completed|done|finished)\b",
+    r"^(done|finished|completed)\b",
+    r"\bi found\b",
+    r"\bthe (answer|result|results|total|price|cheapest|best) (is|are|was|were)\b",
+]
+
+# Closing pleasantries that don't actually ask for anything
+CLOSING_PATTERNS = [
+    r"\blet me know if (you need|you have|there is|there's) anything else\b",
+    r"\bfeel free to ask\b",
+    r"\b(is there )?anything else (that )?(i can|i could|you need|you'd like|you would like|you want)[^.!?]*\?",
+    r"\b(do you need|would you like|do you want|can i (help|assist) (you )?with|can i do) anything else[^.!?]*\?",
+    r"\b(how|what) else can i (help|assist|do)[^.!?]*\?",
+]
+
+_ask_re = re.compile("|".join(ASK_PATTERNS))
+_final_re = re.compile("|".join(FINAL_PATTERNS))
+_closing_re = re.compile("|".join(CLOSING_PATTERNS))
+_sentence_re = re.compile(r"[^.!?]+[.!?]*")
+
+
+def classify_input_request(message_text: str) -> Optional[bool]:
+    """
+    Decide locally whether a message is asking for more input.
+
+    Returns:
+        True if the message asks for input, False if it is a final answer,
+        or None if the rules can't tell and the model should decide.
+    """
+    text = " ".join(message_text.lower().replace("\u2019", "'").split())
+    if not text:
+        return False
+
+    # Drop closing pleasantries so they don't count as questions
+    text = _closing_re.sub("", text).strip()
+    if not text:
+        return False
+
+    # A message that ends with a question is asking the user something
+    sentences = [s.strip() for s in _sentence_re.findall(text) if s.strip()]
+    if sentences and sentences[-1].endswith("?"):
+        return True
+
+    asks = bool(_ask_re.search(text))
+    final = bool(_final_re.search(text))
+    if asks and not final:
+        return True
+    if final and not asks:
+        return False
+    return None
+
+
+class VerdictCache:
+    """Thread-safe LRU cache of model verdicts, keyed by a hash of the message text."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._verdicts = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(message_text: str) -> str:
+        return hashlib.sha256(message_text.strip().encode("utf-8")).hexdigest()
+
+    def get(self, message_text: str) -> Optional[bool]:
+        key = self._key(message_text)
+        with self._lock:
+            verdict = self._verdicts.get(key)
+            if verdict is not None:
+                self._verdicts.move_to_end(key)
+            return verdict
+
+    def set(self, message_text: str, verdict: bool):
+        key = self._key(message_text)
+        with self._lock:
+            self._verdicts[key] = verdict
+            self._verdicts.move_to_end(key)
+            while len(self._verdicts) > self.maxsize:
+                self._verdicts.popitem(last=False)
+
+
+# Shared by all agents in the process
+verdict_cache = VerdictCache()
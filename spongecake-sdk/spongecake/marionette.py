@@ -0,0 +1,306 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+from urllib.parse import urldefrag
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# Page states goto() can wait for, from earliest to latest
+WAIT_UNTIL = ("none", "domcontentloaded", "load", "networkidle")
+
+# Seconds goto() waits for a page by default
+GOTO_TIMEOUT = 30.0
+
+# How often navigate() polls the page while waiting, in seconds
+NAVIGATE_POLL_INTERVAL = 0.05
+
+# networkidle: no new resource may finish loading for this many seconds
+NETWORK_IDLE_TIME = 0.5
+
+# After Firefox refuses a connection, calls fail fast for this many seconds instead of
+# waiting for connect_timeout again (goto() falls back to the API in the meantime)
+CONNECT_BACKOFF = 30.0
+
+# Reports the state of the current document. timeOrigin is unique per document, so it
+# tells the old page apart from the new one while a navigation is in flight.
+# docker/api_server.py keeps its own copy of this script, WAIT_UNTIL, NETWORK_IDLE_TIME
+# and the wait loop in _wait_for_page (the container can't import the SDK) - keep them in sync.
+PAGE_STATE_SCRIPT = """
+const nav = performance.getEntriesByType("navigation")[0];
+return {
+    url: document.location.href,
+    origin: performance.timeOrigin,
+    readyState: document.readyState,
+    resources: performance.getEntriesByType("resource").length,
+    timing: nav ? {
+        dom_content_loaded: Math.round(nav.domContentLoadedEventEnd),
+        load: Math.round(nav.loadEventEnd),
+        response_end: Math.round(nav.responseEnd),
+    } : null,
+};
+"""
+
+class MarionetteUnavailable(RuntimeError):
+    """Raised when Firefox can't be reached over Marionette, before anything was sent to it."""
+    pass
+
+################################
+# Marionette Session           #
+################################
+class MarionetteSession:
+    """
+    Persistent Marionette session to the Firefox running in a desktop.
+
+    Firefox only allows one Marionette session at a time, and starting one costs more than
+    most DOM queries, so each Desktop keeps a single session open and shares it between
+    get_page_html and any other browser calls. Calls are serialized with a lock. If the
+    connection or session is lost (e.g. Firefox restarted), the session is re-created and
+    the call is retried once.
+
+    Example:
+        session = desktop.get_marionette()
+        title = session.execute_script("return document.title;")
+
+    Tabs are identified by their Marionette window handle and listed in the order Firefox
+    reports them, which is the order they were opened in.
+    """
+
+    def __init__(self, host: str, port: int, socket_timeout: float = 30, connect_timeout: int = 5):
+        self.host = host
+        self.port = port
+        self.socket_timeout = socket_timeout
+        self.connect_timeout = connect_timeout  # Seconds to wait for Firefox to accept the connection
+        self._client = None
+        self._lock = threading.RLock()
+        self._unreachable_until = 0.0  # monotonic time until which connecting isn't retried
+
+    @property
+    def connected(self) -> bool:
+        return self._client is not None
+
+    def _connect(self):
+        """Open the connection and start a new session."""
+        try:
+            from marionette_driver.marionette import Marionette
+        except ImportError:
+            raise RuntimeError("marionette_driver package is not installed. Please install it with 'pip install marionette_driver'.")
+
+        logger.info(f"Starting Marionette session at {self.host}:{self.port}")
+        client = Marionette(self.host, port=self.port, socket_timeout=self.socket_timeout, startup_timeout=self.connect_timeout)
+        client.start_session()
+        self._client = client
+
+    def run(self, fn: Callable[[Any], Any]) -> Any:
+        """
+        Call fn(client) with the shared Marionette client, (re)connecting as needed.
+
+        Raises:
+            RuntimeError if Firefox can't be reached, or the Marionette error raised by fn.
+            Once a connection attempt fails, further calls raise straight away for
+            CONNECT_BACKOFF seconds.
+        """
+        from marionette_driver import errors
+
+        with self._lock:
+            for attempt in range(2):
+                if self._client is None and time.monotonic() < self._unreachable_until:
+                    raise MarionetteUnavailable(f"Marionette at {self.host}:{self.port} was unreachable, not retrying for up to {CONNECT_BACKOFF:g}s")
+                try:
+                    if self._client is None:
+                        try:
+                            self._connect()
+                        except (OSError, errors.MarionetteException) as e:
+                            self._unreachable_until = time.monotonic() + CONNECT_BACKOFF
+                            raise MarionetteUnavailable(f"Could not connect to Marionette at {self.host}:{self.port}: {str(e)}")
+                        self._unreachable_until = 0.0
+                    return fn(self._client)
+                except errors.NoSuchWindowException:
+                    # The tab we were attached to was closed; move to one that's still open
+                    if attempt == 1 or not self._switch_to_open_window():
+                        raise
+                except (OSError, errors.InvalidSessionIdException, errors.UnresponsiveInstanceException, errors.SessionNotCreatedException) as e:
+                    self.close()
+                    if attempt == 1:
+                        raise RuntimeError(f"Could not use Marionette at {self.host}:{self.port}: {str(e)}")
+                    logger.warning(f"Marionette session lost ({e}), reconnecting")
+
+    def _switch_to_open_window(self) -> bool:
+        try:
+            handles = self._client.window_handles
+            if handles:
+                self._client.switch_to_window(handles[-1])
+                return True
+        except Exception as e:
+            logger.warning(f"Failed to switch Marionette to an open window: {str(e)}")
+        return False
+
+    def execute_script(self, script: str, args: Optional[list] = None, script_timeout: Optional[float] = None) -> Any:
+        """Run JavaScript in the current page and return its result. script_timeout is in milliseconds."""
+        return self.run(lambda client: client.execute_script(script, script_args=args or [], script_timeout=script_timeout))
+
+    def navigate(self, url: str, wait_until: str = "load", timeout: float = GOTO_TIMEOUT) -> Dict[str, Any]:
+        """
+        Navigate the current tab to url and wait for the page to reach wait_until.
+
+        Args:
+            url: The URL to open.
+            wait_until: "none", "domcontentloaded", "load" or "networkidle" (load plus no new
+                resources for NETWORK_IDLE_TIME seconds).
+            timeout: Maximum seconds to wait. The navigation itself isn't cancelled on timeout.
+
+        Returns:
+            dict: The final URL, whether the wait completed ("loaded"), the elapsed wall time
+            and the page's own navigation timing in milliseconds (when available).
+
+        Raises:
+            MarionetteUnavailable: If Firefox couldn't be used before the navigation was sent,
+            so the caller can safely navigate another way. Once it was sent, losing Marionette
+            returns a result with "loaded" set to False instead.
+        """
+        from marionette_driver import errors
+
+        if wait_until not in WAIT_UNTIL:
+            raise ValueError(f"wait_until must be one of {', '.join(WAIT_UNTIL)}")
+
+        with self._lock:
+            start = time.monotonic()
+            try:
+                before = self.execute_script(PAGE_STATE_SCRIPT)
+            except (RuntimeError, errors.MarionetteException) as e:
+                raise MarionetteUnavailable(f"Could not use Marionette at {self.host}:{self.port}: {str(e)}") from e
+            try:
+                self.execute_script("window.location.assign(arguments[0]);", [url])
+                # A fragment change on the same page doesn't load a new document
+                same_document = urldefrag(before["url"])[0] == urldefrag(url)[0] and "#" in url
+                if wait_until == "none":
+                    state, loaded = {}, True
+                else:
+                    state, loaded = self._wait_for_page(before["origin"], wait_until, start + timeout, same_document)
+            except (RuntimeError, errors.MarionetteException) as e:
+                # The page may already be loading, so don't let the caller navigate a second time
+                logger.warning(f"Lost Marionette while navigating to {url}: {str(e)}")
+                state, loaded = {}, False
+
+        elapsed = round(time.monotonic() - start, 3)
+        if not loaded:
+            logger.warning(f"Page did not reach '{wait_until}' within {timeout}s: {url}")
+        return {
+            "status": "success",
+            "action": "goto",
+            "url": state.get("url") or url,
+            "requested_url": url,
+            "wait_until": wait_until,
+            "loaded": loaded,
+            "elapsed": elapsed,
+            "timing": state.get("timing"),
+        }
+
+    def _wait_for_page(self, old_origin: float, wait_until: str, deadline: float, same_document: bool):
+        """Poll the page until the new document reaches wait_until. Returns (state, loaded)."""
+        from marionette_driver import errors
+
+        ready_states = ("interactive", "complete") if wait_until == "domcontentloaded" else ("complete",)
+        state = None
+        resources, idle_since = None, None
+        while True:
+            try:
+                current = self.execute_script(PAGE_STATE_SCRIPT)
+            except errors.MarionetteException:
+                # The old document was torn down mid-call; try again on the new one
+                current = None
+
+            now = time.monotonic()
+            if current is not None and (same_document or current["origin"] != old_origin) and current["readyState"] in ready_states:
+                state = current
+                if wait_until != "networkidle":
+                    return state, True
+                if current["resources"] != resources:
+                    resources, idle_since = current["resources"], now
+                elif now - idle_since >= NETWORK_IDLE_TIME:
+                    return state, True
+
+            if now >= deadline:
+                return state or current or {}, False
+            time.sleep(NAVIGATE_POLL_INTERVAL)
+
+    # Tabs
+    def list_tabs(self) -> List[Dict[str, Any]]:
+        """Return the open tabs as dicts with their handle, url, title and whether they're current."""
+        def list_all(client):
+            current = client.current_window_handle
+            tabs = []
+            try:
+                for handle in client.window_handles:
+                    client.switch_to_window(handle, focus=False)
+                    tabs.append({"handle": handle, "url": client.get_url(), "title": client.title, "current": handle == current})
+            finally:
+                client.switch_to_window(current, focus=False)
+            return tabs
+        return self.run(list_all)
+
+    def switch_tab(self, tab: Union[str, int]) -> str:
+        """Bring a tab to the front, by handle or by index in list order. Returns its handle."""
+        def switch(client):
+            handle = client.window_handles[tab] if isinstance(tab, int) else tab
+            client.switch_to_window(handle, focus=True)
+            return handle
+        return self.run(switch)
+
+    def close_tabs(self, keep: Optional[List[str]] = None) -> List[str]:
+        """
+        Close every tab except the ones in keep (default: the current tab).
+        The current tab stays in front if it's kept, otherwise the first kept tab is.
+
+        Returns:
+            list: The handles of the tabs that are still open.
+        """
+        def close_others(client):
+            current = client.current_window_handle
+            handles = client.window_handles
+            kept = [handle for handle in handles if handle in (keep or [current])] or [current]
+            for handle in handles:
+                if handle not in kept:
+                    client.switch_to_window(handle, focus=False)
+                    client.close()
+            client.switch_to_window(current if current in kept else kept[0], focus=True)
+            return kept
+        return self.run(close_others)
+
+    def enforce_tab_limit(self, max_tabs: int) -> int:
+        """Close the oldest tabs (never the current one) until at most max_tabs are open. Returns how many were closed."""
+        def trim(client):
+            handles = client.window_handles
+            if len(handles) <= max_tabs:
+                return 0
+            current = client.current_window_handle
+            extra = [handle for handle in handles if handle != current][:len(handles) - max(max_tabs, 1)]
+            for handle in extra:
+                client.switch_to_window(handle, focus=False)
+                client.close()
+            client.switch_to_window(current, focus=False)
+            logger.info(f"Closed {len(extra)} tabs to stay within {max_tabs} open tabs")
+            return len(extra)
+        return self.run(trim)
+
+    def clear_browsing_data(self):
+        """Clear cookies, storage and cache for every site (runs in Firefox's chrome context)."""
+        def clear(client):
+            with client.using_context("chrome"):
+                client.execute_async_script("""
+                    const [resolve] = arguments;
+                    Services.clearData.deleteData(Ci.nsIClearDataService.CLEAR_ALL, () => resolve());
+                """, script_timeout=10000)
+        self.run(clear)
+
+    def close(self):
+        """End the session on the Firefox side and drop the connection."""
+        with self._lock:
+            client, self._client = self._client, None
+            if client is None:
+                return
+            try:
+                client.delete_session()
+            except Exception:
+                pass
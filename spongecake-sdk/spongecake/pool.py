@@ -0,0 +1,241 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from . import _exceptions
+from .desktop import Desktop
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+################################
+# Desktop Pool                 #
+################################
+class DesktopPool:
+    """
+    Keeps a fixed number of started, ready-to-use Desktop containers.
+
+    Desktops are handed out with `lease()`, which is a context manager. When a lease
+    ends, the desktop is reset and put back into the pool. If the reset fails, the
+    desktop is stopped and a fresh one is started in the background instead, so the
+    pool always converges back to `size` ready desktops.
+
+    Example:
+        with DesktopPool(size=3) as pool:
+            with pool.lease() as desktop:
+                desktop.action(input_text="...")
+    """
+
+    def __init__(self, size: int = 2, name_prefix: str = "spongecake_pool", max_uses: Optional[int] = None, reset_fn: Optional[Callable[[Desktop], None]] = None, start: bool = True, **desktop_kwargs):
+        """
+        Initialize a new DesktopPool.
+
+        Args:
+            size: Number of ready desktops to keep in the pool
+            name_prefix: Prefix for container names; each desktop gets a unique suffix
+            max_uses: Optional number of leases after which a desktop is replaced by a fresh one
+            reset_fn: Optional function called with a desktop when its lease ends.
+                      Defaults to `Desktop.reset()`
+            start: Whether to start filling the pool immediately
+            **desktop_kwargs: Extra keyword arguments passed to every `Desktop(...)`
+        """
+        if size < 1:
+            raise ValueError("DesktopPool size must be at least 1")
+        if "name" in desktop_kwargs:
+            raise ValueError("Use name_prefix instead of name for pooled desktops")
+
+        self.size = size
+        self.name_prefix = name_prefix
+        self.max_uses = max_uses
+        self.reset_fn = reset_fn
+        self.desktop_kwargs = desktop_kwargs
+
+        self._ready = queue.Queue()   # Started desktops waiting to be leased
+        self._uses = {}               # container_name -> number of completed leases
+        self._leased = set()          # container names currently leased out
+        self._pending = 0             # Desktops currently being started in the background
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)  # Notified when a desktop is put into _ready
+        self._closed = False
+
+        if start:
+            self.fill()
+
+    # -------------------------
+    # Pool filling
+    # -------------------------
+
+    def _total(self) -> int:
+        # Number of desktops the pool currently owns or is creating.
+        return self._ready.qsize() + len(self._leased) + self._pending
+
+    def fill(self):
+        """
+        Start as many desktops in the background as needed to bring the pool back to `size`.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            missing = self.size - self._total()
+            self._pending += max(missing, 0)
+        for _ in range(max(missing, 0)):
+            threading.Thread(target=self._start_one, daemon=True).start()
+
+    def _start_one(self):
+        """Create and start a single desktop, then make it available for leasing."""
+        desktop = None
+        try:
+            name = f"{self.name_prefix}_{uuid.uuid4().hex[:8]}"
+            desktop = Desktop(name=name, **self.desktop_kwargs)
+            desktop.start()
+            logger.info(f"🍰 Pooled desktop '{name}' is ready.")
+        except Exception as e:
+            logger.error(f"Failed to start pooled desktop: {str(e)}")
+            if desktop is not None:
+                self._discard(desktop)
+            desktop = None
+        with self._lock:
+            self._pending -= 1
+            closed = self._closed
+            if desktop is not None and not closed:
+                # Hand over under the lock so _total() never undercounts.
+                self._uses[desktop.container_name] = 0
+                self._ready.put(desktop)
+                self._available.notify()
+        if desktop is not None and closed:
+            self._discard(desktop)
+
+    def _discard(self, desktop: Desktop):
+        """Stop and remove a desktop that should not go back into the pool."""
+        try:
+            desktop.stop()
+        except Exception as e:
+            logger.warning(f"Failed to stop pooled desktop '{desktop.container_name}': {str(e)}")
+        with self._lock:
+            self._uses.pop(desktop.container_name, None)
+
+    # -------------------------
+    # Leasing
+    # -------------------------
+
+    def acquire(self, timeout: Optional[float] = None) -> Desktop:
+        """
+        Take a ready desktop out of the pool, waiting up to `timeout` seconds for one.
+
+        Raises:
+            SpongecakeException if the pool is closed or no desktop becomes ready in time.
+        """
+        if self._closed:
+            raise _exceptions.SpongecakeException("DesktopPool is closed")
+        # Make sure that desktops lost to earlier failures get replaced.
+        self.fill()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._available:
+            while True:
+                if self._closed:
+                    raise _exceptions.SpongecakeException("DesktopPool is closed")
+                # Take and lease under the lock so _total() never undercounts.
+                try:
+                    desktop = self._ready.get_nowait()
+                except queue.Empty:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise _exceptions.SpongecakeException(f"No pooled desktop became ready within {timeout} seconds")
+                    self._available.wait(remaining)
+                    continue
+                self._leased.add(desktop.container_name)
+                return desktop
+
+    def release(self, desktop: Desktop, discard: bool = False):
+        """
+        Return a leased desktop to the pool. The desktop is reset first; if the reset fails,
+        `discard` is set, or the desktop has reached `max_uses`, it is stopped and replaced.
+        """
+        name = desktop.container_name
+        with self._lock:
+            uses = self._uses[name] = self._uses.get(name, 0) + 1
+        if self.max_uses is not None and uses >= self.max_uses:
+            discard = True
+
+        if not discard and not self._closed:
+            try:
+                if self.reset_fn is not None:
+                    self.reset_fn(desktop)
+                else:
+                    desktop.reset()
+            except Exception as e:
+                logger.warning(f"Failed to reset pooled desktop '{name}', replacing it: {str(e)}")
+                discard = True
+
+        with self._lock:
+            self._leased.discard(name)
+            closed = self._closed
+            if not (discard or closed):
+                # Hand back under the lock so _total() never undercounts.
+                self._ready.put(desktop)
+                self._available.notify()
+
+        if discard or closed:
+            self._discard(desktop)
+            self.fill()
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None):
+        """
+        Context manager that leases a desktop and returns it to the pool afterwards.
+        If the body raises, the desktop is considered dirty and is replaced.
+        """
+        desktop = self.acquire(timeout=timeout)
+        failed = False
+        try:
+            yield desktop
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.release(desktop, discard=failed)
+
+    # -------------------------
+    # Lifecycle
+    # -------------------------
+
+    def wait_until_full(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until `size` desktops are ready (or leased). Returns False on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                if self._closed:
+                    return False
+                if self._ready.qsize() + len(self._leased) >= self.size:
+                    return True
+                starting = self._pending
+            if starting == 0:
+                self.fill()
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.1)
+
+    def close(self):
+        """Stop and remove every idle desktop. Leased desktops are removed when they are released."""
+        with self._lock:
+            self._closed = True
+            # Wake up waiting acquire() calls so they fail instead of waiting out their timeout
+            self._available.notify_all()
+        while True:
+            try:
+                desktop = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(desktop)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
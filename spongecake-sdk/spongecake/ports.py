@@ -0,0 +1,191 @@
+"""
+Host-wide port leases for local desktops.
+
+Desktops used to pick host ports with an in-process counter and a lock, so separate
+worker processes routinely chose the same ports and had to remove and retry their
+containers. The registry is a small SQLite database shared by every process on the host:
+ports are leased in one transaction, so two processes can never be handed the same port.
+
+A desktop first asks for its preferred ports (e.g. 5900 for VNC). If any of them is leased
+or in use, it gets a contiguous block from PORT_RANGE instead. Leases are released when the
+desktop stops, and leases held by processes that have exited are reclaimed once their
+container is gone too.
+"""
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import docker
+from docker.errors import APIError, NotFound
+
+# Set up logger
+logger = logging.getLogger(__name__)
+
+# How Desktop reaches a container: host ports leased from the registry, host ports assigned
+# by Docker, or the container's bridge IP with no published ports
+PORT_MODES = ("lease", "ephemeral", "direct")
+
+# Host ports that port blocks are handed out from
+PORT_RANGE = (20000, 40000)
+
+_REGISTRY_FILE = Path.home() / ".cache" / "spongecake" / "port_leases.sqlite3"
+
+
+class PortLeaseRegistry:
+    """SQLite-backed registry of host ports leased by desktops on this host."""
+
+    def __init__(self, path: Path = _REGISTRY_FILE, port_range=PORT_RANGE):
+        self.path = Path(path)
+        self.port_range = port_range
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self):
+        """Yield a connection to the registry, creating it on first use."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode, so transactions are only the explicit BEGIN IMMEDIATE ones
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            if not self._initialized:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS leases ("
+                    "port INTEGER PRIMARY KEY, owner TEXT NOT NULL, name TEXT, pid INTEGER, leased_at REAL)"
+                )
+                self._initialized = True
+            yield conn
+        finally:
+            conn.close()
+
+    def lease(self, owner: str, preferred: Dict[str, Optional[int]], avoid: Iterable[int] = ()) -> Dict[str, int]:
+        """
+        Atomically lease one host port per name in preferred, and return name -> port.
+
+        The preferred ports are used if none of them is leased, in use or in avoid. Otherwise
+        a contiguous block of free ports from port_range is leased. Ports the owner already
+        held are released.
+
+        Raises:
+            RuntimeError: If the port range is exhausted.
+        """
+        avoid = set(avoid)
+        with self._lock, self._connect() as conn:
+            # BEGIN IMMEDIATE takes the database write lock, so other processes wait here
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._reclaim_stale(conn)
+                conn.execute("DELETE FROM leases WHERE owner = ?", (owner,))
+                taken = {row[0] for row in conn.execute("SELECT port FROM leases")} | avoid
+
+                ports = self._pick(list(preferred), list(preferred.values()), taken)
+                now = time.time()
+                conn.executemany(
+                    "INSERT INTO leases (port, owner, name, pid, leased_at) VALUES (?, ?, ?, ?, ?)",
+                    [(port, owner, name, os.getpid(), now) for name, port in ports.items()],
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        logger.debug(f"Leased ports {ports} for '{owner}'")
+        return ports
+
+    def _pick(self, names, preferred_ports, taken) -> Dict[str, int]:
+        if all(port is not None for port in preferred_ports) and len(set(preferred_ports)) == len(preferred_ports):
+            if all(port not in taken and port_available(port) for port in preferred_ports):
+                return dict(zip(names, preferred_ports))
+
+        # Blocks are aligned, so a block is either free or leased as a whole by one desktop
+        size = len(names)
+        start, end = self.port_range
+        for base in range(start, end - size + 1, size):
+            block = list(range(base, base + size))
+            if not any(port in taken for port in block) and all(port_available(port) for port in block):
+                return dict(zip(names, block))
+        raise RuntimeError(f"Exhausted port range {start}-{end} while leasing {size} ports.")
+
+    def _reclaim_stale(self, conn: sqlite3.Connection):
+        """
+        Drop leases held by processes that no longer exist, unless the owner's container is
+        still there: a container that outlives the process that started it (no stop() call)
+        keeps publishing its ports.
+        """
+        owners = conn.execute("SELECT DISTINCT owner, pid FROM leases").fetchall()
+        dead = [(owner, pid) for owner, pid in owners if not _pid_alive(pid)]
+        if not dead:
+            return
+        try:
+            docker_client = docker.from_env()
+        except Exception:
+            docker_client = None
+        stale = [(owner, pid) for owner, pid in dead if not _container_exists(docker_client, owner)]
+        if stale:
+            conn.executemany("DELETE FROM leases WHERE owner = ? AND pid IS ?", stale)
+
+    def release(self, owner: str):
+        """Release every port leased by owner."""
+        try:
+            with self._lock, self._connect() as conn:
+                conn.execute("DELETE FROM leases WHERE owner = ?", (owner,))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not release ports of '{owner}': {str(e)}")
+
+    def leases(self) -> Dict[int, dict]:
+        """Return the current leases, keyed by port."""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute("SELECT port, owner, name, pid, leased_at FROM leases ORDER BY port").fetchall()
+        return {port: {"owner": owner, "name": name, "pid": pid, "leased_at": leased_at} for port, owner, name, pid, leased_at in rows}
+
+
+def port_available(port: int) -> bool:
+    """Attempt to bind to the port. If we succeed, it's available. Then release immediately."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind(("0.0.0.0", port))
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+
+def _container_exists(docker_client, name: str) -> bool:
+    """Whether a Docker container called name exists. False if Docker can't be reached."""
+    if docker_client is None:
+        return False
+    try:
+        docker_client.containers.get(name)
+    except NotFound:
+        return False
+    except APIError as e:
+        # Docker answered but couldn't tell; keep the lease rather than hand out ports in use
+        logger.warning(f"Could not look up container '{name}', keeping its port lease: {str(e)}")
+        return True
+    except Exception:
+        return False
+    return True
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    if os.name == "nt":
+        # os.kill() would terminate the process on Windows, so assume it's alive
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user
+        return True
+    return True
+
+
+port_registry = PortLeaseRegistry()